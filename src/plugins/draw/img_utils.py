@@ -5,6 +5,7 @@ from itertools import chain
 from PIL import Image, ImageSequence
 import numpy as np
 from pathlib import Path
+import io
 
 
 # ============================ 透明GIF处理 ============================ #
@@ -279,6 +280,54 @@ def save_apng(images: List[Image.Image], save_path: str, duration=50, loop=0):
         loop=loop
     )
 
+def encode_image(
+    image: Union[Image.Image, List[Image.Image]],
+    fmt: str,
+    quality: int = 75,
+    optimize: bool = False,
+    subsampling: int = -1,
+    duration: int = 50,
+    size_budget: int = None,
+    quality_ladder: List[int] = None,
+) -> Tuple[bytes, str]:
+    """
+    将图片编码为bytes，fmt为gif/jpg/png，gif时image可以为帧列表
+    给定size_budget（字节）时，超出大小的png改为jpg，jpg依次使用quality_ladder中更低的质量，仍然超出时缩小尺寸
+    返回 (数据, 实际使用的格式)
+    """
+    def save(img: Image.Image, fmt: str, quality: int, flatten: bool = False) -> bytes:
+        f = io.BytesIO()
+        if fmt == 'gif':
+            save_transparent_gif(img, duration, f)
+        elif fmt == 'jpg':
+            # png改为jpg时透明部分使用白色背景
+            if flatten and img.mode in ('RGBA', 'LA', 'P'):
+                img = img.convert('RGBA')
+                bg = Image.new('RGB', img.size, (255, 255, 255))
+                bg.paste(img, mask=img.split()[3])
+                img = bg
+            img.convert('RGB').save(f, format='JPEG', quality=quality, optimize=optimize, subsampling=subsampling, progressive=False)
+        else:
+            img.save(f, format='PNG')
+        return f.getvalue()
+
+    data = save(image, fmt, quality)
+    if not size_budget or len(data) <= size_budget or fmt == 'gif':
+        return data, fmt
+
+    ladder = [q for q in (quality_ladder or [90, 80, 70, 60, 50, 40]) if fmt == 'png' or q < quality]
+    for q in ladder:
+        data = save(image, 'jpg', q, flatten=fmt == 'png')
+        if len(data) <= size_budget:
+            return data, 'jpg'
+    # 最低质量仍然超出时逐步缩小尺寸
+    q = min(ladder) if ladder else quality
+    img = image
+    while len(data) > size_budget and min(img.size) > 64:
+        img = img.resize((int(img.width * 0.75), int(img.height * 0.75)), Image.Resampling.LANCZOS)
+        data = save(img, 'jpg', q, flatten=fmt == 'png')
+    return data, 'jpg'
+
 def multiply_image_by_color(img: Image.Image, color: tuple) -> Image.Image:
     """
     将图像的每个像素乘以指定颜色的RGB值，A通道保持不变
@@ -1,4 +1,4 @@
-from typing import Union, Tuple, List, Optional, Dict, Any
+from typing import Union, Tuple, List, Optional, Dict, Any, Callable
 from PIL import Image, ImageFont, ImageDraw, ImageFilter, ImageChops
 from PIL.ImageFont import ImageFont as Font
 from dataclasses import dataclass, is_dataclass, fields
@@ -18,8 +18,16 @@ import colorsys
 import random
 import hashlib
 import pickle
-import glob
 import io
+import time
+import threading
+import atexit
+import contextvars
+import itertools
+import heapq
+from contextlib import contextmanager
+from collections import OrderedDict
+from multiprocessing import shared_memory
 import colour
 import struct
 
@@ -40,6 +48,19 @@ def get_memo_usage():
         return mem_info.rss / (1024 * 1024)  # 返回单位为MB
     return 0
 
+IMAGE_FINGERPRINT_ATTR = '_painter_fingerprint'
+
+def set_image_fingerprint(img: Image.Image, fingerprint: str) -> Image.Image:
+    """
+    为图片对象附加稳定的内容指纹，计算哈希时使用指纹代替像素数据
+    只应用于不会被原地修改的图片（如资源缓存中共享的图片），copy/resize等操作产生的新图片不会继承指纹
+    """
+    setattr(img, IMAGE_FINGERPRINT_ATTR, fingerprint)
+    return img
+
+def get_image_fingerprint(img: Image.Image) -> Optional[str]:
+    return getattr(img, IMAGE_FINGERPRINT_ATTR, None)
+
 def deterministic_hash(obj: Any, raise_error: bool = False) -> str:
     """
     计算复杂对象的确定性哈希值。
@@ -51,6 +72,8 @@ def deterministic_hash(obj: Any, raise_error: bool = False) -> str:
     hasher = hashlib.md5()
     # 用于检测循环引用：id(obj) -> recursion_depth
     seen = set()
+    # 无指纹图片的像素摘要：id(img) -> md5
+    image_digests: Dict[int, bytes] = {}
     
     # 预编译 struct 格式，提高性能
     # 对应: bool(?), float(d), int-length(Q), array-shape(Q)
@@ -181,9 +204,16 @@ def deterministic_hash(obj: Any, raise_error: bool = False) -> str:
                 _update_bytes(b'P') # PIL
                 # 包含尺寸、模式、数据
                 _update_str(f"{o.size}:{o.mode}")
-                # 使用 tobytes() 获取像素数据
-                _update_bytes(STRUCT_Q.pack(len(o.tobytes())))
-                _update_bytes(o.tobytes())
+                fingerprint = get_image_fingerprint(o)
+                if fingerprint is not None:
+                    # 有指纹的图片直接使用指纹
+                    _update_bytes(b'FP')
+                    _update_str(fingerprint)
+                else:
+                    # 使用 tobytes() 获取像素数据，同一张图片只获取一次
+                    if oid not in image_digests:
+                        image_digests[oid] = hashlib.md5(o.tobytes()).digest()
+                    _update_bytes(image_digests[oid])
 
             elif hasattr(o, '__array__') and hasattr(o, 'dtype'):
                 # Numpy Array
@@ -405,24 +435,150 @@ def has_emoji(text: str) -> bool:
             return True
     return False
 
+class TextMetricCache:
+    """
+    单个字体（路径+字号）的文本测量缓存  
+    基础排版引擎下字符串宽度等于各字符步进宽度加相邻字符间的字距调整之和，
+    因此缓存单字符步进和字符对的字距（LRU，数量有上限），纯文本宽度由缓存值累加得到；
+    字符串的bbox和含emoji文本的尺寸按字符串缓存
+    """
+    def __init__(self, font: Font):
+        self.font = font
+        # raqm排版引擎会进行连字等整串处理，此时宽度不能按字符累加
+        self.additive = getattr(font, 'layout_engine', None) == ImageFont.Layout.BASIC
+        self.advances: OrderedDict[str, float] = OrderedDict()
+        self.kernings: OrderedDict[str, float] = OrderedDict()
+        self.strings: OrderedDict[tuple, Any] = OrderedDict()
+        self.lock = threading.Lock()
+        # 保护advances和kernings，累加一个字符串的宽度期间持有
+        self.char_lock = threading.Lock()
+
+    @staticmethod
+    def _get_lru(cache: OrderedDict, key: str, func: Callable[[], float]) -> float:
+        val = cache.get(key)
+        if val is not None:
+            cache.move_to_end(key)
+            return val
+        val = cache[key] = func()
+        while len(cache) > TEXT_METRIC_CHAR_CACHE_NUM_CFG.get(16384):
+            cache.popitem(last=False)
+        return val
+
+    def _get_advance(self, c: str) -> float:
+        return self._get_lru(self.advances, c, lambda: self.font.getlength(c))
+
+    def _get_kerning(self, pair: str) -> float:
+        return self._get_lru(self.kernings, pair,
+            lambda: self.font.getlength(pair) - self._get_advance(pair[0]) - self._get_advance(pair[1]))
+
+    def _get_string(self, key: tuple, func: Callable[[], Any]) -> Any:
+        with self.lock:
+            if key in self.strings:
+                self.strings.move_to_end(key)
+                return self.strings[key]
+        ret = func()
+        with self.lock:
+            self.strings[key] = ret
+            while len(self.strings) > TEXT_METRIC_CACHE_NUM_CFG.get(4096):
+                self.strings.popitem(last=False)
+        return ret
+
+    def get_prefix_widths(self, text: str) -> Optional[List[float]]:
+        """
+        获取纯文本每个前缀 text[:i+1] 的宽度，不能按字符累加时返回None
+        """
+        if not self.additive:
+            return None
+        ret = []
+        w, prev = 0, None
+        with self.char_lock:
+            for c in text:
+                w += self._get_advance(c)
+                if prev is not None:
+                    w += self._get_kerning(prev + c)
+                ret.append(w)
+                prev = c
+        return ret
+
+    def get_width(self, text: str) -> float:
+        if not self.additive:
+            return self._get_string(('w', text), lambda: self.font.getlength(text))
+        w, prev = 0, None
+        with self.char_lock:
+            for c in text:
+                w += self._get_advance(c)
+                if prev is not None:
+                    w += self._get_kerning(prev + c)
+                prev = c
+        return w
+
+    def get_bbox(self, text: str) -> Tuple[int, int, int, int]:
+        return self._get_string(('b', text), lambda: self.font.getbbox(text))
+
+    def get_emoji_size(self, text: str) -> Size:
+        scale = EMOJI_SCALE_CFG.get()
+        return self._get_string(('e', text, scale), lambda: getsize_emoji(text, font=self.font, emoji_scale_factor=scale))
+
+TEXT_METRIC_CACHE_NUM_CFG = global_config.item('painter.text_metric_cache_num')
+TEXT_METRIC_CHAR_CACHE_NUM_CFG = global_config.item('painter.text_metric_char_cache_num')
+_text_metric_caches: OrderedDict[tuple, TextMetricCache] = OrderedDict()
+_text_metric_caches_lock = threading.Lock()
+
+def get_text_metric_cache(font: Font) -> Optional[TextMetricCache]:
+    """
+    获取字体对应的文本测量缓存，缓存的字体数量与字体缓存上限相同
+    """
+    path = getattr(font, 'path', None)
+    if not isinstance(path, str):
+        return None
+    key = (path, font.size)
+    with _text_metric_caches_lock:
+        cache = _text_metric_caches.get(key)
+        if cache is not None and cache.font is font:
+            _text_metric_caches.move_to_end(key)
+            return cache
+        cache = _text_metric_caches[key] = TextMetricCache(font)
+        while len(_text_metric_caches) > FONT_CACHE_MAX_NUM_CFG.get():
+            _text_metric_caches.popitem(last=False)
+        return cache
+
 def get_text_size(font: Font, text: str) -> Size:
     if not text: 
         return (0, 0)
+    cache = get_text_metric_cache(font)
     if has_emoji(text):
-        return getsize_emoji(text, font=font, emoji_scale_factor=EMOJI_SCALE_CFG.get())
-    bbox = font.getbbox(text)
+        if cache is None:
+            return getsize_emoji(text, font=font, emoji_scale_factor=EMOJI_SCALE_CFG.get())
+        return cache.get_emoji_size(text)
+    bbox = cache.get_bbox(text) if cache is not None else font.getbbox(text)
     return bbox[2] - bbox[0], bbox[3] - bbox[1]
     
 def get_text_width(font: Font, text: str) -> int:
     if not text:
         return 0
+    cache = get_text_metric_cache(font)
     if has_emoji(text):
-        size = getsize_emoji(text, font=font, emoji_scale_factor=EMOJI_SCALE_CFG.get())
-        return size[0]
-    return font.getlength(text)
+        if cache is None:
+            return getsize_emoji(text, font=font, emoji_scale_factor=EMOJI_SCALE_CFG.get())[0]
+        return cache.get_emoji_size(text)[0]
+    if cache is None:
+        return font.getlength(text)
+    return cache.get_width(text)
+
+def get_text_prefix_widths(font: Font, text: str) -> Optional[List[float]]:
+    """
+    获取纯文本每个前缀 text[:i+1] 的宽度，用于按宽度裁剪文本，文本含emoji或无法使用缓存时返回None
+    """
+    if not text or has_emoji(text):
+        return None
+    cache = get_text_metric_cache(font)
+    if cache is None:
+        return None
+    return cache.get_prefix_widths(text)
 
 def get_text_offset(font: Font, text: str) -> Position:
-    bbox = font.getbbox(text)
+    cache = get_text_metric_cache(font)
+    bbox = cache.get_bbox(text) if cache is not None else font.getbbox(text)
     return bbox[0], bbox[1]
 
 def resize_keep_ratio(img: Image.Image, max_size: Union[int, float], mode='long', scale=None) -> Image.Image:
@@ -610,6 +766,252 @@ class RandomTriangleBgPreset:
     periods: list[tuple[str, str]] | None = None
 
 
+# =========================== 绘图缓存 =========================== #
+
+PAINTER_CACHE_MEM_MAX_MB_CFG = global_config.item('painter.cache.mem_max_mb')
+PAINTER_CACHE_DISK_MAX_MB_CFG = global_config.item('painter.cache.disk_max_mb')
+PAINTER_CACHE_MAX_AGE_DAYS_CFG = global_config.item('painter.cache.max_age_days')
+PAINTER_CACHE_EVICT_INTERVAL_SECONDS = 60
+
+@dataclass
+class PainterCacheEntry:
+    cache_key: str
+    op_hash: str
+    path: str
+    size: int
+    last_access: float
+    mtime: float
+
+
+class PainterCache:
+    """
+    Painter绘图结果缓存，分为两层：
+    - 磁盘层: 以 {cache_key}__{op_hash}.png 保存，启动后首次访问时扫描一次目录建立索引，之后只维护内存索引，按总大小和过期时间LRU淘汰
+    - 内存层: 最近访问的PNG编码数据，按总字节数LRU淘汰，命中时无需读盘
+    """
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        self.index: Dict[str, PainterCacheEntry] = {}
+        self.mem: OrderedDict[str, Tuple[str, bytes]] = OrderedDict()
+        self.mem_bytes = 0
+        self.disk_bytes = 0
+        self.indexed = False
+        self.last_evict_time = 0.0
+        self.lock = threading.RLock()
+        self.stats = {
+            'mem_hit': 0,
+            'disk_hit': 0,
+            'miss': 0,
+            'hit_bytes': 0,
+            'write_bytes': 0,
+            'evict_num': 0,
+            'evict_bytes': 0,
+        }
+
+    @staticmethod
+    def _parse_filename(name: str) -> Tuple[str, str] | None:
+        if not name.endswith('.png') or '__' not in name:
+            return None
+        cache_key, op_hash = name[:-4].rsplit('__', 1)
+        return cache_key, op_hash
+
+    def _ensure_indexed(self):
+        if self.indexed:
+            return
+        with self.lock:
+            if self.indexed:
+                return
+            t = datetime.now()
+            if os.path.isdir(self.cache_dir):
+                for entry in os.scandir(self.cache_dir):
+                    parsed = self._parse_filename(entry.name)
+                    if not parsed or not entry.is_file():
+                        continue
+                    cache_key, op_hash = parsed
+                    stat = entry.stat()
+                    old = self.index.get(cache_key)
+                    if old is not None:
+                        # 同一个key存在多个版本时只保留最新的
+                        if old.mtime >= stat.st_mtime:
+                            self._remove_file(entry.path)
+                            continue
+                        self._remove_file(old.path)
+                        self.disk_bytes -= old.size
+                    self.index[cache_key] = PainterCacheEntry(
+                        cache_key=cache_key,
+                        op_hash=op_hash,
+                        path=entry.path,
+                        size=stat.st_size,
+                        last_access=stat.st_mtime,
+                        mtime=stat.st_mtime,
+                    )
+                    self.disk_bytes += stat.st_size
+            self.indexed = True
+            debug_print(f"Painter cache indexed {len(self.index)} files in {datetime.now() - t}")
+
+    @staticmethod
+    def _remove_file(path: str) -> bool:
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return True
+        except Exception as e:
+            print(f"Failed to remove cache file {path}: {e}")
+            return False
+
+    def _mem_pop(self, cache_key: str):
+        item = self.mem.pop(cache_key, None)
+        if item is not None:
+            self.mem_bytes -= len(item[1])
+
+    def _mem_put(self, cache_key: str, op_hash: str, data: bytes):
+        max_bytes = int(PAINTER_CACHE_MEM_MAX_MB_CFG.get(64) * 1024 * 1024)
+        self._mem_pop(cache_key)
+        if len(data) > max_bytes:
+            return
+        self.mem[cache_key] = (op_hash, data)
+        self.mem_bytes += len(data)
+        while self.mem_bytes > max_bytes and self.mem:
+            _, (_, old) = self.mem.popitem(last=False)
+            self.mem_bytes -= len(old)
+
+    def _drop(self, cache_key: str) -> int:
+        """
+        删除某个key的内存和磁盘缓存，返回删除的文件数量
+        """
+        self._mem_pop(cache_key)
+        entry = self.index.pop(cache_key, None)
+        if entry is None:
+            return 0
+        self.disk_bytes -= entry.size
+        return 1 if self._remove_file(entry.path) else 0
+
+    def _evict(self, force: bool = False):
+        now = time.time()
+        if not force and now - self.last_evict_time < PAINTER_CACHE_EVICT_INTERVAL_SECONDS:
+            return
+        self.last_evict_time = now
+        max_bytes = PAINTER_CACHE_DISK_MAX_MB_CFG.get(1024) * 1024 * 1024
+        max_age = PAINTER_CACHE_MAX_AGE_DAYS_CFG.get(30) * 86400
+        expired = [e for e in self.index.values() if now - e.last_access > max_age]
+        evict_bytes = self.disk_bytes - sum(e.size for e in expired) - max_bytes
+        if evict_bytes > 0:
+            rest = sorted((e for e in self.index.values() if now - e.last_access <= max_age), key=lambda e: e.last_access)
+            for e in rest:
+                if evict_bytes <= 0:
+                    break
+                expired.append(e)
+                evict_bytes -= e.size
+        for e in expired:
+            self.stats['evict_num'] += 1
+            self.stats['evict_bytes'] += e.size
+            self._drop(e.cache_key)
+        if expired:
+            debug_print(f"Painter cache evicted {len(expired)} files")
+
+    def get(self, cache_key: str, op_hash: str) -> Image.Image | None:
+        """
+        获取缓存图片，op_hash不一致时会删除旧缓存
+        """
+        self._ensure_indexed()
+        with self.lock:
+            entry = self.index.get(cache_key)
+            if entry is None or entry.op_hash != op_hash:
+                if entry is not None:
+                    debug_print(f"Cache mismatch: {cache_key}")
+                    self._drop(cache_key)
+                self.stats['miss'] += 1
+                return None
+            entry.last_access = time.time()
+            item = self.mem.get(cache_key)
+            if item is not None and item[0] == op_hash:
+                self.mem.move_to_end(cache_key)
+                self.stats['mem_hit'] += 1
+                self.stats['hit_bytes'] += len(item[1])
+                data = item[1]
+            else:
+                data = None
+        if data is None:
+            try:
+                with open(entry.path, 'rb') as f:
+                    data = f.read()
+            except Exception as e:
+                debug_print(f"Failed to read cache file {entry.path}: {e}")
+                with self.lock:
+                    if self.index.get(cache_key) is entry:
+                        self._drop(cache_key)
+                    self.stats['miss'] += 1
+                return None
+            with self.lock:
+                self._mem_put(cache_key, op_hash, data)
+                self.stats['disk_hit'] += 1
+                self.stats['hit_bytes'] += len(data)
+        img = Image.open(io.BytesIO(data))
+        img.load()
+        return img
+
+    def put(self, cache_key: str, op_hash: str, img: Image.Image):
+        """
+        保存缓存图片
+        """
+        self._ensure_indexed()
+        buf = io.BytesIO()
+        img.save(buf, format='PNG')
+        data = buf.getvalue()
+        path = os.path.join(self.cache_dir, f"{cache_key}__{op_hash}.png")
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        now = time.time()
+        with self.lock:
+            old = self.index.get(cache_key)
+            if old is not None:
+                self.disk_bytes -= old.size
+                if old.path != path:
+                    self._remove_file(old.path)
+            self.index[cache_key] = PainterCacheEntry(
+                cache_key=cache_key,
+                op_hash=op_hash,
+                path=path,
+                size=len(data),
+                last_access=now,
+                mtime=now,
+            )
+            self.disk_bytes += len(data)
+            self.stats['write_bytes'] += len(data)
+            self._mem_put(cache_key, op_hash, data)
+            self._evict()
+
+    def clear(self, cache_key: str) -> int:
+        """
+        清除某个key的缓存，返回删除的文件数量
+        """
+        self._ensure_indexed()
+        with self.lock:
+            return self._drop(cache_key)
+
+    def get_key_mtimes(self) -> Dict[str, datetime]:
+        self._ensure_indexed()
+        with self.lock:
+            return { k: datetime.fromtimestamp(e.mtime) for k, e in self.index.items() }
+
+    def get_stats(self) -> Dict[str, Any]:
+        self._ensure_indexed()
+        with self.lock:
+            return {
+                **self.stats,
+                'disk_num': len(self.index),
+                'disk_bytes': self.disk_bytes,
+                'mem_num': len(self.mem),
+                'mem_bytes': self.mem_bytes,
+            }
+
+painter_cache = PainterCache(PAINTER_CACHE_DIR)
+
+
 @dataclass
 class PainterOperation:
     offset: Position
@@ -618,6 +1020,16 @@ class PainterOperation:
     args: List
     exclude_on_hash: bool
 
+    def get_hash(self) -> str | None:
+        """
+        获取操作的哈希值，首次调用时计算并缓存，exclude_on_hash的操作返回None
+        """
+        if self.exclude_on_hash:
+            return None
+        if getattr(self, '_hash', None) is None:
+            self._hash = deterministic_hash((self.offset, self.size, self.func, self.args))
+        return self._hash
+
     def image_to_id(self, img_dict: Dict[int, Image.Image]):
         if isinstance(self.args, tuple):
             self.args = list(self.args)
@@ -636,6 +1048,255 @@ class PainterOperation:
                 self.args[i] = img_dict[img_id]
 
 
+# =========================== 进程间图片传输 =========================== #
+
+PAINTER_SHM_ENABLE_CFG = global_config.item('painter.shm.enable')
+PAINTER_SHM_MIN_BYTES_CFG = global_config.item('painter.shm.min_bytes')
+PAINTER_SHM_ASSET_MAX_MB_CFG = global_config.item('painter.shm.asset_max_mb')
+
+SHM_IMAGE_MODES = { 'RGBA': 4, 'RGB': 3, 'LA': 2, 'L': 1 }
+SHM_MAPPED_IMAGE_MODES = { 'RGBA', 'L' }   # Pillow可直接映射缓冲区（不复制）的模式
+
+@dataclass
+class ShmImageRef:
+    """
+    存放在共享内存中的图片的引用，asset_id不为None时表示可被worker按ID缓存的共享资源图片
+    """
+    shm_name: str
+    mode: str
+    size: Size
+    asset_id: Optional[str] = None
+
+    @property
+    def nbytes(self) -> int:
+        return self.size[0] * self.size[1] * SHM_IMAGE_MODES[self.mode]
+
+
+def _write_image_to_shm(img: Image.Image, asset_id: str = None) -> ShmImageRef:
+    data = img.tobytes()
+    shm = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+    try:
+        shm.buf[:len(data)] = data
+    finally:
+        shm.close()
+    return ShmImageRef(shm_name=shm.name, mode=img.mode, size=img.size, asset_id=asset_id)
+
+def _read_image_from_shm(ref: ShmImageRef, unlink: bool = False) -> Image.Image:
+    shm = shared_memory.SharedMemory(name=ref.shm_name)
+    try:
+        buf = shm.buf[:ref.nbytes]
+        img = Image.frombytes(ref.mode, ref.size, buf)
+        buf.release()
+    finally:
+        shm.close()
+        if unlink:
+            shm.unlink()
+    return img
+
+def _unlink_shm(name: str):
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+        shm.close()
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"Failed to unlink painter shm {name}: {e}")
+
+
+class PainterShmTransport:
+    """
+    主进程侧的共享内存图片传输管理
+    - 有指纹的资源图片（边框、图标等）以指纹为ID长期保存在共享内存中，按总大小LRU淘汰，worker首次使用时读取并按ID缓存
+    - 其他较大的图片每次绘制时写入临时共享内存，绘制完成后释放
+    - 较小的图片仍然直接通过pickle传输
+    """
+    def __init__(self):
+        self.assets: OrderedDict[str, ShmImageRef] = OrderedDict()
+        self.asset_in_use: Dict[str, int] = {}
+        self.asset_bytes = 0
+        self.lock = threading.Lock()
+
+    def _get_asset_ref(self, asset_id: str, img: Image.Image) -> ShmImageRef:
+        with self.lock:
+            ref = self.assets.get(asset_id)
+            if ref is not None:
+                self.assets.move_to_end(asset_id)
+            else:
+                ref = _write_image_to_shm(img, asset_id)
+                self.assets[asset_id] = ref
+                self.asset_bytes += ref.nbytes
+                self._evict_assets()
+            self.asset_in_use[asset_id] = self.asset_in_use.get(asset_id, 0) + 1
+            return ref
+
+    def _evict_assets(self):
+        max_bytes = PAINTER_SHM_ASSET_MAX_MB_CFG.get(256) * 1024 * 1024
+        for asset_id in list(self.assets.keys()):
+            if self.asset_bytes <= max_bytes:
+                break
+            # 正在被绘制任务引用的资源不淘汰
+            if self.asset_in_use.get(asset_id, 0) > 0:
+                continue
+            ref = self.assets.pop(asset_id)
+            self.asset_bytes -= ref.nbytes
+            _unlink_shm(ref.shm_name)
+
+    def export_image(self, img: Image.Image) -> Union[Image.Image, ShmImageRef]:
+        """
+        将图片转换为用于传输到worker的对象，需要在绘制完成后对返回值调用release
+        """
+        if img is None or img.mode not in SHM_IMAGE_MODES:
+            return img
+        fingerprint = get_image_fingerprint(img)
+        if fingerprint is not None:
+            return self._get_asset_ref(f"{fingerprint}:{img.mode}:{img.size}", img)
+        if img.size[0] * img.size[1] * SHM_IMAGE_MODES[img.mode] < PAINTER_SHM_MIN_BYTES_CFG.get(65536):
+            return img
+        return _write_image_to_shm(img)
+
+    def release(self, obj: Union[Image.Image, ShmImageRef]):
+        if not isinstance(obj, ShmImageRef):
+            return
+        if obj.asset_id is None:
+            _unlink_shm(obj.shm_name)
+            return
+        with self.lock:
+            self.asset_in_use[obj.asset_id] -= 1
+            if self.asset_in_use[obj.asset_id] <= 0:
+                self.asset_in_use.pop(obj.asset_id)
+
+    def close(self):
+        with self.lock:
+            for ref in self.assets.values():
+                _unlink_shm(ref.shm_name)
+            self.assets.clear()
+            self.asset_bytes = 0
+
+
+class AttachedShmImage:
+    """
+    worker进程中映射到共享内存的图片，RGBA/L模式的图片直接使用共享内存中的数据（修改时Pillow会自动复制），
+    其他模式复制一份，映射的图片在close前需要保持共享内存打开
+    """
+    def __init__(self, ref: ShmImageRef):
+        self.ref = ref
+        self.shm = shared_memory.SharedMemory(name=ref.shm_name)
+        self.buf = self.shm.buf[:ref.nbytes]
+        if ref.mode in SHM_MAPPED_IMAGE_MODES:
+            self.img = Image.frombuffer(ref.mode, ref.size, self.buf, 'raw', ref.mode, 0, 1)
+        else:
+            self.img = Image.frombytes(ref.mode, ref.size, self.buf)
+            self._release()
+
+    def _release(self):
+        try:
+            self.buf.release()
+            self.shm.close()
+        except BufferError:
+            # 图片仍被引用时保持映射，由垃圾回收释放
+            pass
+
+    def close(self):
+        self.img = None
+        self._release()
+
+
+# worker进程中按ID缓存的共享资源图片（保持映射，主进程淘汰后的资源在worker淘汰前仍占用共享内存）
+_worker_shm_assets: OrderedDict[str, AttachedShmImage] = OrderedDict()
+_worker_shm_asset_bytes = 0
+
+def _import_shm_image(obj: Union[Image.Image, ShmImageRef], attached: List[AttachedShmImage]) -> Image.Image:
+    """
+    在worker进程中从共享内存获取图片，非资源图片的映射加入attached，需要在绘制完成后关闭
+    """
+    global _worker_shm_asset_bytes
+    if not isinstance(obj, ShmImageRef):
+        return obj
+    if obj.asset_id is None:
+        a = AttachedShmImage(obj)
+        attached.append(a)
+        return a.img
+    a = _worker_shm_assets.get(obj.asset_id)
+    if a is not None:
+        _worker_shm_assets.move_to_end(obj.asset_id)
+        return a.img
+    a = AttachedShmImage(obj)
+    _worker_shm_assets[obj.asset_id] = a
+    _worker_shm_asset_bytes += obj.nbytes
+    max_bytes = PAINTER_SHM_ASSET_MAX_MB_CFG.get(256) * 1024 * 1024
+    while _worker_shm_asset_bytes > max_bytes and len(_worker_shm_assets) > 1:
+        _, old = _worker_shm_assets.popitem(last=False)
+        _worker_shm_asset_bytes -= old.ref.nbytes
+        old.close()
+    return a.img
+
+
+# =========================== 绘图任务调度 =========================== #
+
+PAINTER_PRIORITY_INTERACTIVE = 0
+PAINTER_PRIORITY_BACKGROUND = 10
+
+_painter_priority: contextvars.ContextVar[int] = contextvars.ContextVar('painter_priority', default=PAINTER_PRIORITY_INTERACTIVE)
+
+def get_painter_priority() -> int:
+    return _painter_priority.get()
+
+def set_painter_priority(priority: int):
+    """
+    设置当前上下文（及其之后创建的子任务）中绘图任务的优先级，数值越小越优先
+    """
+    _painter_priority.set(priority)
+
+@contextmanager
+def painter_priority(priority: int):
+    token = _painter_priority.set(priority)
+    try:
+        yield
+    finally:
+        _painter_priority.reset(token)
+
+
+class PainterScheduler:
+    """
+    限制同时提交到绘图进程池的任务数量，超出时任务按优先级排队，
+    使指令等交互任务可以越过排队中的定时推送等后台任务
+    """
+    def __init__(self, max_running: int):
+        self.max_running = max_running
+        self.running = 0
+        self.waiting: List[Tuple[int, int, asyncio.Future]] = []
+        self.seq = itertools.count()
+
+    async def acquire(self, priority: int):
+        if self.running < self.max_running and not self.waiting:
+            self.running += 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiting, (priority, next(self.seq), fut))
+        try:
+            await fut
+        except asyncio.CancelledError:
+            # 已经分配到名额但是被取消时需要归还
+            if fut.done() and not fut.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        while self.waiting:
+            _, _, fut = heapq.heappop(self.waiting)
+            if not fut.done():
+                # 名额直接转交给排队中优先级最高的任务
+                fut.set_result(None)
+                return
+        self.running -= 1
+
+    def get_waiting_num(self) -> int:
+        return sum(1 for _, _, fut in self.waiting if not fut.done())
+
+PainterJob = Tuple[List[PainterOperation], Optional[Image.Image], Size]
+
+
 class Painter:
     
     def __init__(self, img: Image.Image = None, size: Tuple[int, int] = None):
@@ -796,66 +1457,200 @@ class Painter:
         debug_print(f"Sub process use time: {datetime.now() - start_time}")
         return p.img
 
-    async def get(self, cache_key: str=None) -> Image.Image:
-        # 使用缓存
-        if cache_key is not None:
-            t = datetime.now()
-            debug_print(f"Cache key: {cache_key}")
-            op_hash = await asyncio.to_thread(deterministic_hash, {"key": cache_key, "op": self.operations})
-            debug_print(f"Cache key: {cache_key}, op_hash: {op_hash}, elapsed: {datetime.now() - t}")
-
-            paths = glob.glob(os.path.join(PAINTER_CACHE_DIR, f"{cache_key}__*.png"))
-            if paths:
-                path = paths[0]
-                if path.endswith(f"{cache_key}__{op_hash}.png"):
-                    # 如果hash相同则直接返回缓存的图片
-                    debug_print(f"Using cached image: {path}")
-                    img = Image.open(path)
-                    img.load()
-                    return img
+    @staticmethod
+    def _execute_batch(jobs: List[PainterJob], image_dict: Dict[str, Image.Image]) -> List[Image.Image]:
+        return [Painter._execute(operations, img, size, image_dict) for operations, img, size in jobs]
+
+    @staticmethod
+    def _execute_batch_shm(
+        jobs: List[PainterJob], 
+        image_dict: Dict[str, Union[Image.Image, ShmImageRef]],
+    ) -> List[Union[Image.Image, ShmImageRef]]:
+        """
+        在worker进程中依次执行一组绘图任务，输入图片和输出画布通过共享内存传输
+        """
+        attached: List[AttachedShmImage] = []
+        rets = []
+        try:
+            image_dict = { k: _import_shm_image(v, attached) for k, v in image_dict.items() }
+            for operations, img, size in jobs:
+                ret = Painter._execute(operations, _import_shm_image(img, attached), size, image_dict)
+                rets.append(_write_image_to_shm(ret) if ret.mode in SHM_IMAGE_MODES else ret)
+        except:
+            for ret in rets:
+                if isinstance(ret, ShmImageRef):
+                    _unlink_shm(ret.shm_name)
+            raise
+        finally:
+            image_dict = None
+            for a in attached:
+                a.close()
+        return rets
+
+    @staticmethod
+    async def _execute_jobs(jobs: List[PainterJob], image_dict: Dict[str, Image.Image], priority: int) -> List[Image.Image]:
+        """
+        将一组绘图任务作为一次提交执行
+        """
+        if PAINTER_PROCESS_NUM <= 0:
+            return await asyncio.to_thread(Painter._execute_batch, jobs, image_dict)
+        global _painter_pool
+        await _painter_scheduler.acquire(priority)
+        try:
+            if not PAINTER_SHM_ENABLE_CFG.get(True):
+                return await _painter_pool.submit(Painter._execute_batch, jobs, image_dict)
+
+            exported = []
+            def export():
+                shm_jobs = []
+                for operations, img, size in jobs:
+                    shm_img = _painter_shm_transport.export_image(img)
+                    exported.append(shm_img)
+                    shm_jobs.append((operations, shm_img, size))
+                shm_image_dict = {}
+                for k, v in image_dict.items():
+                    shm_image_dict[k] = _painter_shm_transport.export_image(v)
+                    exported.append(shm_image_dict[k])
+                return shm_jobs, shm_image_dict
+            def release_exported():
+                for obj in exported:
+                    _painter_shm_transport.release(obj)
+                exported.clear()
+
+            # 等待被取消时导出和绘制仍会继续执行，完成后再释放输入并删除输出的共享内存画布
+            export_future = asyncio.ensure_future(asyncio.to_thread(export))
+            try:
+                shm_jobs, shm_image_dict = await asyncio.shield(export_future)
+            except BaseException:
+                if export_future.done():
+                    release_exported()
                 else:
-                    # 否则清空缓存并重新绘图
-                    for p in paths:
-                        try: 
-                            os.remove(p)
-                        except Exception as e: 
-                            print(f"Failed to remove cache file {p}: {e}")
-                    debug_print(f"Cache mismatch, removed {len(paths)} files")
+                    export_future.add_done_callback(lambda _: release_exported())
+                raise
+            submit_future = _painter_pool.submit(Painter._execute_batch_shm, shm_jobs, shm_image_dict)
+            try:
+                rets = await asyncio.shield(submit_future)
+            except asyncio.CancelledError:
+                def on_done(f: asyncio.Future):
+                    release_exported()
+                    if not f.cancelled() and f.exception() is None:
+                        for r in f.result():
+                            if isinstance(r, ShmImageRef):
+                                _unlink_shm(r.shm_name)
+                submit_future.add_done_callback(on_done)
+                raise
+            finally:
+                if submit_future.done():
+                    release_exported()
+        finally:
+            _painter_scheduler.release()
 
-        debug_print(f"Main process memory usage: {get_memo_usage()} MB")
+        def read_results():
+            imgs = []
+            for i, ret in enumerate(rets):
+                try:
+                    imgs.append(_read_image_from_shm(ret, unlink=True) if isinstance(ret, ShmImageRef) else ret)
+                except:
+                    for r in rets[i + 1:]:
+                        if isinstance(r, ShmImageRef):
+                            _unlink_shm(r.shm_name)
+                    raise
+            return imgs
+        return await asyncio.to_thread(read_results)
+
+    async def _get_from_cache(self, cache_key: str) -> Tuple[str, Optional[Image.Image]]:
+        t = datetime.now()
+        debug_print(f"Cache key: {cache_key}")
+        op_hash = await asyncio.to_thread(self.get_operations_hash, cache_key)
+        debug_print(f"Cache key: {cache_key}, op_hash: {op_hash}, elapsed: {datetime.now() - t}")
+        img = await asyncio.to_thread(painter_cache.get, cache_key, op_hash)
+        if img is not None:
+            debug_print(f"Using cached image: {cache_key}")
+        return op_hash, img
 
-        # 收集所有图片对象到字典中
-        image_dict = {}
+    async def _save_to_cache(self, cache_key: str, op_hash: str):
+        try:
+            await asyncio.to_thread(painter_cache.put, cache_key, op_hash, self.img)
+        except Exception as e:
+            debug_print(f"Failed to save cache for {cache_key}: {e}")
+
+    def _collect_images(self, image_dict: Dict[int, Image.Image]):
         for op in self.operations:
             op.image_to_id(image_dict)
-        total_img_size = 0
-        for img in image_dict.values():
-            total_img_size += img.size[0] * img.size[1] * 4
-        debug_print(f"image_dict len: {len(image_dict)}, total size: {total_img_size//1024//1024} MB")
+
+    @staticmethod
+    async def get_batch(painters: List['Painter'], cache_keys: List[Optional[str]] = None) -> List[Image.Image]:
+        """
+        批量执行多个Painter的绘图操作，返回与painters顺序对应的图片列表
+        未命中缓存的Painter按画布面积均衡分为不超过绘图进程数量的组，每组在一个绘图进程中一次执行，
+        多个Painter间共用的图片只传输一次
+        """
+        if cache_keys is None:
+            cache_keys = [None] * len(painters)
+        assert len(cache_keys) == len(painters), "cache_keys must have the same length as painters"
+        priority = get_painter_priority()
+
+        # 使用缓存
+        results: List[Optional[Image.Image]] = [None] * len(painters)
+        op_hashes: List[Optional[str]] = [None] * len(painters)
+        pending: List[int] = []
+        for i, (p, cache_key) in enumerate(zip(painters, cache_keys)):
+            if cache_key is not None:
+                op_hashes[i], results[i] = await p._get_from_cache(cache_key)
+                if results[i] is not None:
+                    continue
+            pending.append(i)
+        if not pending:
+            return results
+
+        debug_print(f"Main process memory usage: {get_memo_usage()} MB")
+
+        # 分组
+        group_num = max(1, min(len(pending), PAINTER_PROCESS_NUM))
+        groups: List[List[int]] = [[] for _ in range(group_num)]
+        loads = [0] * group_num
+        for i in sorted(pending, key=lambda i: painters[i].size[0] * painters[i].size[1], reverse=True):
+            g = loads.index(min(loads))
+            groups[g].append(i)
+            loads[g] += painters[i].size[0] * painters[i].size[1]
+
+        async def execute_group(idxs: List[int]):
+            # 收集所有图片对象到字典中
+            image_dict = {}
+            for i in idxs:
+                painters[i]._collect_images(image_dict)
+            total_img_size = 0
+            for img in image_dict.values():
+                total_img_size += img.size[0] * img.size[1] * 4
+            debug_print(f"image_dict len: {len(image_dict)}, total size: {total_img_size//1024//1024} MB")
+
+            jobs = [(painters[i].operations, painters[i].img, painters[i].size) for i in idxs]
+            imgs = await Painter._execute_jobs(jobs, image_dict, priority)
+            for i, img in zip(idxs, imgs):
+                painters[i].img = img
+                painters[i].operations = []
 
         # 执行绘图操作
         t = datetime.now()
+        await asyncio.gather(*[execute_group(idxs) for idxs in groups if idxs])
+        debug_print(f"Painter executed {len(pending)} jobs in {len(groups)} groups in {datetime.now() - t}")
 
-        if PAINTER_PROCESS_NUM > 0:
-            global _painter_pool
-            self.img = await _painter_pool.submit(Painter._execute, self.operations, self.img, self.size, image_dict)
-        else:
-            self.img = await asyncio.to_thread(Painter._execute, self.operations, self.img, self.size, image_dict)
+        # 保存缓存
+        for i in pending:
+            results[i] = painters[i].img
+            if cache_keys[i] is not None:
+                await painters[i]._save_to_cache(cache_keys[i], op_hashes[i])
+        return results
 
-        self.operations = []
-        debug_print(f"Painter executed in {datetime.now() - t}")
+    async def get(self, cache_key: str=None) -> Image.Image:
+        return (await Painter.get_batch([self], [cache_key]))[0]
 
-        # 保存缓存
-        if cache_key is not None:
-            try:
-                cache_path = os.path.join(PAINTER_CACHE_DIR, f"{cache_key}__{op_hash}.png")
-                os.makedirs(PAINTER_CACHE_DIR, exist_ok=True)
-                self.img.save(cache_path, format='PNG')
-            except:
-                debug_print(f"Failed to save cache for {cache_key}")
+    def get_operations_hash(self, cache_key: str) -> str:
+        """
+        计算当前所有操作的哈希值，各操作的哈希值只在首次计算时序列化参数
+        """
+        return deterministic_hash({"key": cache_key, "op": [op.get_hash() for op in self.operations]})
 
-        return self.img
-    
     def add_operation(self, func: Union[str, callable], exclude_on_hash: bool, args: List[Any]):
         self.operations.append(PainterOperation(
             offset=self.offset,
@@ -868,25 +1663,15 @@ class Painter:
 
     @staticmethod
     def clear_cache(cache_key: str) -> int:
-        paths = glob.glob(os.path.join(PAINTER_CACHE_DIR, f"{cache_key}__*.png"))
-        ok = 0
-        for p in paths:
-            try: 
-                os.remove(p)
-                ok += 1
-            except Exception as e: 
-                print(f"Failed to remove cache file {p}: {e}")
-        return ok
+        return painter_cache.clear(cache_key)
     
     @staticmethod
     def get_cache_key_mtimes() -> Dict[str, datetime]:
-        paths = glob.glob(os.path.join(PAINTER_CACHE_DIR, f"*.png"))
-        cache_keys = {}
-        for p in paths:
-            mtime = os.path.getmtime(p)
-            cache_key = os.path.basename(p).split('__')[0]
-            cache_keys[cache_key] = datetime.fromtimestamp(mtime)
-        return cache_keys
+        return painter_cache.get_key_mtimes()
+
+    @staticmethod
+    def get_cache_stats() -> Dict[str, Any]:
+        return painter_cache.get_stats()
 
 
     def set_region(self, pos: Position, size: Size):
@@ -1674,4 +2459,7 @@ class Painter:
 
 if PAINTER_PROCESS_NUM > 0 and is_main_process():
     _painter_pool: ProcessPool = ProcessPool(PAINTER_PROCESS_NUM, name='draw')
+    _painter_shm_transport = PainterShmTransport()
+    _painter_scheduler = PainterScheduler(PAINTER_PROCESS_NUM)
+    atexit.register(_painter_shm_transport.close)
 
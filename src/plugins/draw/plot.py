@@ -1,9 +1,12 @@
-from typing import Union, Tuple, List, Optional, Callable
+from typing import Union, Tuple, List, Dict, Optional, Callable, Any
 from PIL import Image, ImageFilter, ImageEnhance
 import threading
 import contextvars
 from dataclasses import dataclass
 from copy import deepcopy
+import functools
+import bisect
+import time
 
 from ..common.config import *
 from .painter import *
@@ -118,6 +121,71 @@ class RandomTriangleBg(WidgetBg):
         p.draw_random_triangle_bg(self.preset_config_name, self.size_fixed_rate, self.dt)
 
 
+# =========================== 布局缓存 =========================== #
+
+class LayoutProfile:
+    """
+    统计布局计算耗时，按控件类型汇总自身耗时（不含子控件），并记录耗时最长的控件
+    """
+    def __init__(self, top_n: int = 10):
+        self.top_n = top_n
+        self.stack: List[float] = []
+        self.class_stats: Dict[str, List[float]] = {}   # class -> [count, self_time]
+        self.widget_times: Dict[int, Tuple[float, str]] = {}  # id -> (self_time, desc)
+
+    def enter(self):
+        self.stack.append(0.0)
+
+    def exit(self, widget: 'Widget', name: str, elapsed: float):
+        child_time = self.stack.pop()
+        self_time = elapsed - child_time
+        if self.stack:
+            self.stack[-1] += elapsed
+        cls_name = f"{widget.__class__.__name__}.{name}"
+        stat = self.class_stats.setdefault(cls_name, [0, 0.0])
+        stat[0] += 1
+        stat[1] += self_time
+        t, desc = self.widget_times.get(id(widget), (0.0, widget._get_layout_desc()))
+        self.widget_times[id(widget)] = (t + self_time, desc)
+
+    def get_report(self) -> str:
+        total = sum(t for _, t in self.class_stats.values())
+        lines = [f"Layout total: {total * 1000:.2f}ms"]
+        for cls_name, (count, t) in sorted(self.class_stats.items(), key=lambda x: -x[1][1])[:self.top_n]:
+            lines.append(f"  {cls_name}: {t * 1000:.2f}ms ({count} calls)")
+        lines.append("Slowest widgets:")
+        for t, desc in sorted(self.widget_times.values(), key=lambda x: -x[0])[:self.top_n]:
+            lines.append(f"  {desc}: {t * 1000:.2f}ms")
+        return "\n".join(lines)
+
+_layout_profile: contextvars.ContextVar[Optional[LayoutProfile]] = contextvars.ContextVar('layout_profile', default=None)
+
+def layout_cached(func):
+    """
+    缓存控件的布局计算结果，修改控件布局属性（set_*/add_item等）时自身及所有父控件的缓存失效
+    缓存的结果会被之后的调用共享，被缓存的函数需要返回不可变对象（tuple而非list）
+    """
+    name = func.__name__
+    @functools.wraps(func)
+    def wrapper(self: 'Widget'):
+        cache = self._layout_cache
+        if name in cache:
+            return cache[name]
+        profile = _layout_profile.get()
+        if profile is None:
+            ret = func(self)
+        else:
+            profile.enter()
+            t = time.perf_counter()
+            try:
+                ret = func(self)
+            finally:
+                profile.exit(self, name, time.perf_counter() - t)
+        cache[name] = ret
+        return ret
+    return wrapper
+
+
 # =========================== 布局类型 =========================== #
 
 class Widget:
@@ -125,6 +193,7 @@ class Widget:
 
     def __init__(self):
         self.parent: Optional[Widget] = None
+        self._layout_cache: Dict[str, Any] = {}
 
         self.content_halign = 'l'
         self.content_valign = 't'
@@ -141,9 +210,6 @@ class Widget:
         self.offset_yanchor = 't'
         self.allow_draw_outside = False
         self.set_size_policy('fixed', 'fixed')
-
-        self._calc_w = None
-        self._calc_h = None
         
         self.draw_funcs = []
         
@@ -160,6 +226,18 @@ class Widget:
                 return k
         return None
 
+    def _invalidate_layout(self):
+        """
+        清除自身和所有父控件的布局缓存
+        """
+        w = self
+        while w is not None:
+            w._layout_cache.clear()
+            w = w.parent
+
+    def _get_layout_desc(self) -> str:
+        return self.__class__.__name__
+
     @classmethod
     def get_current_widget_stack(cls) -> List['Widget']:
         local = cls._thread_local.get()
@@ -194,16 +272,19 @@ class Widget:
             self.items.append(item)
         else:
             self.items.insert(index, item)
+        self._invalidate_layout()
         return self
     
     def remove_item(self, item: 'Widget'):
         self.items.remove(item)
         item.set_parent(None)
+        self._invalidate_layout()
         return self
 
     def remove_item_at(self, index: int):
         item = self.items.pop(index)
         item.set_parent(None)
+        self._invalidate_layout()
         return self
     
     def set_items(self, items: List['Widget']):
@@ -212,10 +293,15 @@ class Widget:
         self.items = items
         for item in self.items:
             item.set_parent(self)
+        self._invalidate_layout()
         return self
 
     def set_parent(self, parent: 'Widget'):
+        # 原父控件和新父控件的布局都会变化
+        if self.parent is not None:
+            self.parent._invalidate_layout()
         self.parent = parent
+        self._invalidate_layout()
         return self
 
     def set_content_align(self, align: str):
@@ -231,6 +317,7 @@ class Widget:
         else:
             self.hmargin = margin[0]
             self.vmargin = margin[1]
+        self._invalidate_layout()
         return self
 
     def set_padding(self, padding: Union[int, Tuple[int, int]]):
@@ -240,20 +327,24 @@ class Widget:
         else:
             self.hpadding = padding[0]
             self.vpadding = padding[1]
+        self._invalidate_layout()
         return self
 
     def set_size(self, size: Tuple[int, int]):
         if not size: size = (None, None)
         self.w = size[0]
         self.h = size[1]
+        self._invalidate_layout()
         return self
 
     def set_w(self, w: int):
         self.w = w
+        self._invalidate_layout()
         return self
     
     def set_h(self, h: int):
         self.h = h
+        self._invalidate_layout()
         return self
 
     def set_offset(self, offset: Tuple[int, int]):
@@ -281,33 +372,36 @@ class Widget:
         if h_policy:
             assert h_policy in ('fixed', 'fit')
             self.h_size_policy = h_policy
+        self._invalidate_layout()
         return self
 
     def set_allow_draw_outside(self, allow: bool):
         self.allow_draw_outside = allow
+        self._invalidate_layout()
         return self
 
+    @layout_cached
     def _get_content_size(self):
         return (0, 0)
     
+    @layout_cached
     def _get_self_size(self):
-        if not all([self._calc_w, self._calc_h]):
-            content_w, content_h = self._get_content_size()
-            content_w_limit = self.w - self.hpadding * 2 if self.w is not None else content_w
-            content_h_limit = self.h - self.vpadding * 2 if self.h is not None else content_h
-            if content_w > content_w_limit or content_h > content_h_limit:
-                if not self.allow_draw_outside:
-                    raise ValueError(f'Content size is too large with ({content_w}, {content_h}) > ({content_w_limit}, {content_h_limit})')
-                else:
-                    content_w = min(content_w, content_w_limit)
-                    content_h = min(content_h, content_h_limit)
-            self._calc_w = content_w_limit + self.hmargin * 2 + self.hpadding * 2
-            self._calc_h = content_h_limit + self.vmargin * 2 + self.vpadding * 2
-            if self.w_size_policy == 'fit':
-                self._calc_w = min(self._calc_w, content_w + self.hmargin * 2 + self.hpadding * 2)
-            if self.h_size_policy == 'fit':
-                self._calc_h = min(self._calc_h, content_h + self.vmargin * 2 + self.vpadding * 2)
-        return (int(self._calc_w), int(self._calc_h))
+        content_w, content_h = self._get_content_size()
+        content_w_limit = self.w - self.hpadding * 2 if self.w is not None else content_w
+        content_h_limit = self.h - self.vpadding * 2 if self.h is not None else content_h
+        if content_w > content_w_limit or content_h > content_h_limit:
+            if not self.allow_draw_outside:
+                raise ValueError(f'Content size is too large with ({content_w}, {content_h}) > ({content_w_limit}, {content_h_limit})')
+            else:
+                content_w = min(content_w, content_w_limit)
+                content_h = min(content_h, content_h_limit)
+        calc_w = content_w_limit + self.hmargin * 2 + self.hpadding * 2
+        calc_h = content_h_limit + self.vmargin * 2 + self.vpadding * 2
+        if self.w_size_policy == 'fit':
+            calc_w = min(calc_w, content_w + self.hmargin * 2 + self.hpadding * 2)
+        if self.h_size_policy == 'fit':
+            calc_h = min(calc_h, content_h + self.vmargin * 2 + self.vpadding * 2)
+        return (int(calc_w), int(calc_h))
 
     def _get_content_pos(self):
         w, h = self._get_self_size()
@@ -394,6 +488,7 @@ class Frame(Widget):
         for item in self.items:
             item.set_parent(self)
 
+    @layout_cached
     def _get_content_size(self):
         size = (0, 0)
         for item in self.items:
@@ -451,21 +546,25 @@ class HSplit(Widget):
 
     def set_sep(self, sep: int):
         self.sep = sep  
+        self._invalidate_layout()
         return self
 
     def set_ratios(self, ratios: List[float]):
         self.ratios = ratios
+        self._invalidate_layout()
         return self
 
     def set_item_size_mode(self, mode: str):
         assert mode in ('expand', 'fixed')
         self.item_size_mode = mode
+        self._invalidate_layout()
         return self
 
     def set_item_bg(self, bg: WidgetBg | Callable[[int, Widget], WidgetBg]):
         self.item_bg = bg
         return self
     
+    @layout_cached
     def _get_item_sizes(self):
         ratios = self.ratios if self.ratios else [item._get_self_size()[0] for item in self.items]
         if self.item_size_mode == 'expand':
@@ -481,8 +580,9 @@ class HSplit(Widget):
         h = max([item._get_self_size()[1] for item in self.items])
         for r, item in zip(ratios, self.items):
             ret.append((int(unit_w * r), h))
-        return ret
+        return tuple(ret)
 
+    @layout_cached
     def _get_content_size(self):
         if not self.items:
             return (0, 0)
@@ -549,21 +649,25 @@ class VSplit(Widget):
 
     def set_sep(self, sep: int):
         self.sep = sep  
+        self._invalidate_layout()
         return self
 
     def set_ratios(self, ratios: List[float]):
         self.ratios = ratios
+        self._invalidate_layout()
         return self
 
     def set_item_size_mode(self, mode: str):
         assert mode in ('expand', 'fixed')
         self.item_size_mode = mode
+        self._invalidate_layout()
         return self
 
     def set_item_bg(self, bg: WidgetBg | Callable[[int, Widget], WidgetBg]):
         self.item_bg = bg
         return self
 
+    @layout_cached
     def _get_item_sizes(self):
         ratios = self.ratios if self.ratios else [item._get_self_size()[1] for item in self.items]
         if self.item_size_mode == 'expand':
@@ -579,8 +683,9 @@ class VSplit(Widget):
         w = max([item._get_self_size()[0] for item in self.items])
         for r, item in zip(ratios, self.items):
             ret.append((w, int(unit_h * r)))
-        return ret
+        return tuple(ret)
     
+    @layout_cached
     def _get_content_size(self):
         if not self.items:
             return (0, 0)
@@ -645,12 +750,9 @@ class Grid(Widget):
         self.item_bg = None
         self.vertical = vertical
 
-        self._grid_rc = None
-        self._col_ws = None
-        self._row_hs = None
-
     def set_vertical(self, vertical: bool):
         self.vertical = vertical
+        self._invalidate_layout()
         return self
     
     def set_item_align(self, align: str):
@@ -669,68 +771,72 @@ class Grid(Widget):
             self.hsep = hsep
         if vsep is not None:
             self.vsep = vsep
+        self._invalidate_layout()
         return self
 
     def set_row_count(self, count: int):
         self.row_count = count
         self.col_count = None
+        self._invalidate_layout()
         return self
 
     def set_col_count(self, count: int):
         self.col_count = count
         self.row_count = None
+        self._invalidate_layout()
         return self
 
     def set_item_size_mode(self, mode: str):
         assert mode in ('expand', 'fixed', 'flex')
         self.item_size_mode = mode
+        self._invalidate_layout()
         return self
 
     def set_item_bg(self, bg: WidgetBg | Callable[[int, int, Widget], WidgetBg]):
         self.item_bg = bg
         return self
 
-    def _calc_grid_rc_and_sizes(self) -> tuple[tuple[int, int], list[int], list[int]]:
-        if self._grid_rc is None:
-            # 计算行列数
-            r, c = self.row_count, self.col_count
-            assert r and not c or c and not r, 'Either row_count or col_count should be None'
-            if not r: r = (len(self.items) + c - 1) // c
-            if not c: c = (len(self.items) + r - 1) // r
-            self._grid_rc = (r, c)
-            # 计算每列宽度和每行高度
-            if self.item_size_mode == 'expand':
-                # 固定大小，按比例分配
-                assert self.w is not None and self.h is not None, 'Expand mode requires width and height'
-                gw = (self.w - self.hsep * (c - 1) - self.hpadding * 2) / c
-                gh = (self.h - self.vsep * (r - 1) - self.vpadding * 2) / r
-                self._col_ws = [int(gw) for _ in range(c)]
-                self._row_hs = [int(gh) for _ in range(r)]
-            elif self.item_size_mode == 'fixed':
-                # 固定大小，取最大值
-                gw, gh = 0, 0
-                for item in self.items:
-                    iw, ih = item._get_self_size()
-                    gw = max(gw, iw)
-                    gh = max(gh, ih)
-                self._col_ws = [int(gw) for _ in range(c)]
-                self._row_hs = [int(gh) for _ in range(r)]
-            elif self.item_size_mode == 'flex':
-                # 可变大小，每行每列各自取最大值
-                self._col_ws = [0 for _ in range(c)]
-                self._row_hs = [0 for _ in range(r)]
-                for idx, item in enumerate(self.items):
-                    if not self.vertical:
-                        i, j = idx // c, idx % c
-                    else:
-                        i, j = idx % r, idx // r
-                    iw, ih = item._get_self_size()
-                    self._col_ws[j] = max(self._col_ws[j], iw)
-                    self._row_hs[i] = max(self._row_hs[i], ih)
-            else:
-                raise ValueError(f'Invalid item_size_mode: {self.item_size_mode}')
-        return self._grid_rc, self._col_ws, self._row_hs
+    @layout_cached
+    def _calc_grid_rc_and_sizes(self) -> tuple[tuple[int, int], tuple[int, ...], tuple[int, ...]]:
+        # 计算行列数
+        r, c = self.row_count, self.col_count
+        assert r and not c or c and not r, 'Either row_count or col_count should be None'
+        if not r: r = (len(self.items) + c - 1) // c
+        if not c: c = (len(self.items) + r - 1) // r
+        # 计算每列宽度和每行高度
+        if self.item_size_mode == 'expand':
+            # 固定大小，按比例分配
+            assert self.w is not None and self.h is not None, 'Expand mode requires width and height'
+            gw = (self.w - self.hsep * (c - 1) - self.hpadding * 2) / c
+            gh = (self.h - self.vsep * (r - 1) - self.vpadding * 2) / r
+            col_ws = [int(gw) for _ in range(c)]
+            row_hs = [int(gh) for _ in range(r)]
+        elif self.item_size_mode == 'fixed':
+            # 固定大小，取最大值
+            gw, gh = 0, 0
+            for item in self.items:
+                iw, ih = item._get_self_size()
+                gw = max(gw, iw)
+                gh = max(gh, ih)
+            col_ws = [int(gw) for _ in range(c)]
+            row_hs = [int(gh) for _ in range(r)]
+        elif self.item_size_mode == 'flex':
+            # 可变大小，每行每列各自取最大值
+            col_ws = [0 for _ in range(c)]
+            row_hs = [0 for _ in range(r)]
+            for idx, item in enumerate(self.items):
+                if not self.vertical:
+                    i, j = idx // c, idx % c
+                else:
+                    i, j = idx % r, idx // r
+                iw, ih = item._get_self_size()
+                col_ws[j] = max(col_ws[j], iw)
+                row_hs[i] = max(row_hs[i], ih)
+        else:
+            raise ValueError(f'Invalid item_size_mode: {self.item_size_mode}')
+        return (r, c), tuple(col_ws), tuple(row_hs)
     
+    @layout_cached
     def _get_content_size(self):
         (r, c), ws, hs = self._calc_grid_rc_and_sizes()
         return (int(sum(ws) + self.hsep * (c - 1)), int(sum(hs) + self.vsep * (r - 1)))
@@ -827,6 +933,7 @@ class Flow(Widget):
         if align not in ALIGN_MAP:
             raise ValueError('Invalid align')
         self.item_halign, self.item_valign = ALIGN_MAP[align]
+        self._invalidate_layout()
         return self
 
     def set_content_and_item_align(self, align: str):
@@ -836,6 +943,7 @@ class Flow(Widget):
 
     def set_vertical(self, vertical: bool):
         self.vertical = vertical
+        self._invalidate_layout()
         return self
     
     def set_sep(self, hsep=None, vsep=None):
@@ -843,20 +951,24 @@ class Flow(Widget):
             self.hsep = hsep
         if vsep is not None:
             self.vsep = vsep
+        self._invalidate_layout()
         return self
     
     def set_row_or_col_count(self, row_count: int = None, col_count: int = None):
         assert not (row_count and col_count), 'Either row_count or col_count should be None'
         self.row_count = row_count
         self.col_count = col_count
+        self._invalidate_layout()
         return self
     
     def set_aspect_ratio(self, aspect_ratio: float):
         self.aspect_ratio = aspect_ratio
+        self._invalidate_layout()
         return self
     
     def set_keep_empty_row_or_col(self, keep: bool):
         self.keep_empty_row_or_col = keep
+        self._invalidate_layout()
         return self
 
     def _calc_total_size_by_layout_fast(self, layout: list[list[int]]) -> tuple[int, int]:
@@ -1069,15 +1181,16 @@ class Flow(Widget):
             layout = [row for row in layout if row]
         return layout
 
-    def _get_total_size_and_item_pos(self) -> tuple[tuple[int, int], list[tuple[int, int]]]:
-        if self.layout is None or self.total_size is None or self.item_positions is None:
-            layout = self._calc_item_layout(self.row_count, self.col_count, self.aspect_ratio)
-            total_size, item_pos = self._calc_total_size_and_item_pos_by_layout(layout)
-            self.layout = layout
-            self.total_size = total_size
-            self.item_positions = item_pos
-        return self.total_size, self.item_positions
+    @layout_cached
+    def _get_total_size_and_item_pos(self) -> tuple[tuple[int, int], tuple[tuple[int, int], ...]]:
+        layout = self._calc_item_layout(self.row_count, self.col_count, self.aspect_ratio)
+        total_size, item_pos = self._calc_total_size_and_item_pos_by_layout(layout)
+        self.layout = layout
+        self.total_size = total_size
+        self.item_positions = item_pos
+        return self.total_size, tuple(self.item_positions)
 
+    @layout_cached
     def _get_content_size(self):
         total_size, _ = self._get_total_size_and_item_pos()
         return total_size
@@ -1153,33 +1266,42 @@ class TextBox(Widget):
 
     def set_text(self, text: str):
         self.text = text
+        self._invalidate_layout()
         return self
 
     def set_style(self, style: TextStyle):
         self.style = style
+        self._invalidate_layout()
         return self
    
     def set_line_count(self, count: int):
         self.line_count = count
+        self._invalidate_layout()
         return self
     
     def set_line_sep(self, sep: int):
         self.line_sep = sep
+        self._invalidate_layout()
         return self
 
     def set_wrap(self, wrap: bool):
         self.wrap = wrap
+        self._invalidate_layout()
         return self
 
     def set_overflow(self, overflow: str):
         assert overflow in ('shrink', 'clip')
         self.overflow = overflow
+        self._invalidate_layout()
 
     def set_text_offset(self, offset: Tuple[int, int]):
         self.text_offset_x = offset[0]
         self.text_offset_y = offset[1]
         return self
 
+    def _get_layout_desc(self) -> str:
+        return f"TextBox({self.text[:16]!r})"
+
     def _get_pil_font(self):
         return get_font(self.style.font, self.style.size)
     
@@ -1188,7 +1310,7 @@ class TextBox(Widget):
 
     def _get_clip_text_to_width_idx(self, font, text: str, width: int, suffix=''):
         """
-        基于“估算+步进”的线性查找。
+        纯文本基于缓存的前缀宽度二分查找；含emoji时基于“估算+步进”的线性查找，
         通常比二分法更快，因为不需要反复在大范围内测量。
         """
         suffix_width = 0
@@ -1201,14 +1323,21 @@ class TextBox(Widget):
         if target_width < 0:
             return 0
             
-        # 2. 快速检查：如果整行都放得下
+        # 2. 纯文本可以直接由缓存的字符宽度得到所有前缀宽度，二分查找裁剪位置
+        prefix_widths = get_text_prefix_widths(font, text)
+        if prefix_widths is not None:
+            if prefix_widths[-1] <= target_width:
+                return None
+            return bisect.bisect_right(prefix_widths, target_width)
+
+        # 3. 快速检查：如果整行都放得下
         full_width = get_text_width(font, text)
         if full_width <= target_width:
             return None
 
         text_len = len(text)
         
-        # 3. 估算起点
+        # 4. 估算起点
         # 假设ascii字符宽度为1，非ascii字符宽度为2，计算要跳到哪个字符位置
         if full_width > 0:
             char_len_weight_sum = 0
@@ -1226,7 +1355,7 @@ class TextBox(Widget):
             idx = 0
         idx = max(0, min(idx, text_len))
 
-        # 4. 局部步进修正 
+        # 5. 局部步进修正 
         current_w = get_text_width(font, text[:idx])
 
         if current_w < target_width:
@@ -1252,6 +1381,7 @@ class TextBox(Widget):
         else:
             return idx
 
+    @layout_cached
     def _get_lines(self):
         font = self._get_pil_font()
         lines = self.text.split('\n')  
@@ -1290,8 +1420,9 @@ class TextBox(Widget):
                     clipped_lines.append(line)
             else:
                 clipped_lines.append(line)
-        return clipped_lines[:self.line_count]
+        return tuple(clipped_lines[:self.line_count])
 
+    @layout_cached
     def _get_content_size(self):
         lines = self._get_lines()
         w, h = 0, 0
@@ -1399,13 +1530,16 @@ class ImageBox(Widget):
             self.image = Image.open(image)
         else:
             self.image = image
+        self._invalidate_layout()
         return self
 
     def set_image_size_mode(self, mode: str):
         assert mode in ('fit', 'fill', 'original')
         self.image_size_mode = mode
+        self._invalidate_layout()
         return self
 
+    @layout_cached
     def _get_content_size(self):
         w, h = self.image.size
         if self.image_size_mode == 'original':
@@ -1445,6 +1579,7 @@ class Spacer(Widget):
         super().__init__()
         self.set_size((w, h))
     
+    @layout_cached
     def _get_content_size(self):
         return (self.w - 2 * self.hpadding, self.h - 2 * self.vpadding)
 
@@ -1459,23 +1594,41 @@ class Canvas(Frame):
         self.set_bg(bg)
         self.set_margin(0)
 
-    async def get_img(self, scale: float = None, cache_key: str=None):
+    def _prepare_painter(self) -> Painter:
         t = datetime.now()
-        size = self._get_self_size()
-        size_limit = global_config.get('plot.canvas_size_limit')
-        assert size[0] * size[1] <= size_limit[0] * size_limit[1], f'Canvas size is too large ({size[0]}x{size[1]})'
-        p = Painter(size=size)
-        self.draw(p)
+        profile = LayoutProfile() if global_config.get('plot.log_layout_time', False) else None
+        token = _layout_profile.set(profile)
+        try:
+            size = self._get_self_size()
+            size_limit = global_config.get('plot.canvas_size_limit')
+            assert size[0] * size[1] <= size_limit[0] * size_limit[1], f'Canvas size is too large ({size[0]}x{size[1]})'
+            p = Painter(size=size)
+            self.draw(p)
+        finally:
+            _layout_profile.reset(token)
         if global_config.get('plot.log_draw_time', False):
             print(f"Canvas layouted in {(datetime.now() - t).total_seconds():.3f}s, size={size}")
+        if profile is not None:
+            print(profile.get_report())
+        return p
 
+    async def get_img(self, scale: float = None, cache_key: str=None):
+        return (await Canvas.get_imgs([self], scale, [cache_key]))[0]
+
+    @staticmethod
+    async def get_imgs(canvases: List['Canvas'], scale: float = None, cache_keys: List[Optional[str]] = None) -> List[Image.Image]:
+        """
+        批量绘制多个Canvas，所有绘图任务作为一批提交到绘图进程池
+        """
+        painters = [canvas._prepare_painter() for canvas in canvases]
         t = datetime.now()
-        img = await p.get(cache_key)
+        imgs = await Painter.get_batch(painters, cache_keys)
         if scale:
-            img = img.resize((int(size[0] * scale), int(size[1] * scale)), Image.Resampling.BILINEAR)
+            imgs = [img.resize((int(img.size[0] * scale), int(img.size[1] * scale)), Image.Resampling.BILINEAR) for img in imgs]
         if global_config.get('plot.log_draw_time', False):
-            print(f"Canvas drawn in {(datetime.now() - t).total_seconds():.3f}s, size={size}")
-        return img
+            sizes = ', '.join(f"{p.size[0]}x{p.size[1]}" for p in painters)
+            print(f"Canvas drawn in {(datetime.now() - t).total_seconds():.3f}s, size={sizes}")
+        return imgs
     
 
 # =========================== 控件函数 =========================== #
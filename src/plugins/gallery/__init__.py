@@ -99,6 +99,79 @@ class GalleryPic:
             self.thumb_path = None
 
 
+# 每个字节中1的个数，numpy没有bitwise_count时用于计算popcount
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def _popcount64(arr: np.ndarray) -> np.ndarray:
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(arr)
+    return _POPCOUNT_TABLE[arr.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+class GalleryHashIndex:
+    """
+    画廊图片hash的内存索引，hash1打包为uint64数组，hash2为uint8矩阵，向量化查找相似图片
+    先按hash1中1的个数分桶预筛选（两个hash的汉明距离不小于1的个数之差），再计算汉明距离和hash2的MAE
+    """
+    HASH2_SIZE = 16 * 16
+
+    def __init__(self, pics: list[GalleryPic] = ()):
+        self.lock = threading.Lock()
+        self.n = 0
+        self.pids = np.zeros(0, dtype=np.int64)
+        self.hash1 = np.zeros(0, dtype=np.uint64)
+        self.hash1_popcount = np.zeros(0, dtype=np.int16)
+        self.hash2 = np.zeros((0, self.HASH2_SIZE), dtype=np.uint8)
+        for pic in pics:
+            self.add(pic)
+
+    @classmethod
+    def _parse(cls, pic: GalleryPic) -> tuple[int, np.ndarray] | None:
+        if not pic.hash1 or not pic.hash2:
+            return None
+        hash2 = np.frombuffer(bytes.fromhex(pic.hash2), dtype=np.uint8)
+        if hash2.size != cls.HASH2_SIZE:
+            return None
+        return int(pic.hash1, 16), hash2
+
+    def add(self, pic: GalleryPic):
+        parsed = self._parse(pic)
+        if parsed is None:
+            return
+        hash1, hash2 = parsed
+        with self.lock:
+            if self.n == len(self.pids):
+                cap = max(16, self.n * 2)
+                self.pids = np.resize(self.pids, cap)
+                self.hash1 = np.resize(self.hash1, cap)
+                self.hash1_popcount = np.resize(self.hash1_popcount, cap)
+                self.hash2 = np.resize(self.hash2, (cap, self.HASH2_SIZE))
+            self.pids[self.n] = pic.pid
+            self.hash1[self.n] = hash1
+            self.hash1_popcount[self.n] = hash1.bit_count()
+            self.hash2[self.n] = hash2
+            self.n += 1
+
+    def find_same(self, pic: GalleryPic) -> list[int]:
+        """
+        查找与图片相同的所有图片pid，按加入索引的顺序
+        """
+        parsed = self._parse(pic)
+        if parsed is None:
+            return []
+        hash1, hash2 = parsed
+        t1, t2 = HASH1_DIFFERENCE_THRESHOLD_CFG.get(), HASH2_DIFFERENCE_THRESHOLD_CFG.get()
+        with self.lock:
+            n = self.n
+            idx = np.nonzero(np.abs(self.hash1_popcount[:n] - hash1.bit_count()) <= t1)[0]
+            if idx.size:
+                idx = idx[_popcount64(self.hash1[idx] ^ np.uint64(hash1)) <= t1]
+            if idx.size:
+                diff = np.abs(self.hash2[idx].astype(np.int16) - hash2.astype(np.int16)).sum(axis=1)
+                idx = idx[diff <= t2]
+            return self.pids[idx].tolist()
+
+
 class GalleryPicRepeatedException(Exception):
     def __init__(self, pid: int):
         super().__init__(f'画廊中已存在相似图片(pid={pid})')
@@ -121,10 +194,15 @@ class GalleryManager:
     def __init__(self):
         self.pid_top = 0
         self.galleries: dict[str, Gallery] = {}
+        self.hash_indexes: dict[str, GalleryHashIndex] = {}
+        # 画廊hash索引的版本，索引失效时增加，构建期间版本变化的索引不保存
+        self.hash_index_versions: dict[str, int] = {}
+        self.hash_index_lock = threading.Lock()
 
     def _load(self):
         self.pid_top = file_db.get('pid_top', 0)
         self.galleries = {}
+        self.hash_indexes = {}
         for name, g in file_db.get('galleries', {}).items():
             self.galleries[name] = Gallery(
                 name=g['name'],
@@ -150,13 +228,30 @@ class GalleryManager:
             return False
         return True
 
+    def _get_hash_index(self, gallery: Gallery) -> GalleryHashIndex:
+        """
+        获取画廊的hash索引（不存在则构建，较慢，需要在线程池中调用）
+        """
+        with self.hash_index_lock:
+            index = self.hash_indexes.get(gallery.name)
+            version = self.hash_index_versions.get(gallery.name, 0)
+        if index is None:
+            index = GalleryHashIndex(gallery.pics)
+            with self.hash_index_lock:
+                if version == self.hash_index_versions.get(gallery.name, 0):
+                    self.hash_indexes[gallery.name] = index
+        return index
+
+    def _invalidate_hash_index(self, gallery: Gallery):
+        with self.hash_index_lock:
+            self.hash_indexes.pop(gallery.name, None)
+            self.hash_index_versions[gallery.name] = self.hash_index_versions.get(gallery.name, 0) + 1
+
     async def _async_check_duplicated(self, pic: GalleryPic, gallery: Gallery) -> int | None:
         with ProfileTimer("gallery.check_duplicated"):
             def check():
-                for p in gallery.pics:
-                    if pic.is_same(p):
-                        return p.pid
-                return None
+                pids = self._get_hash_index(gallery).find_same(pic)
+                return pids[0] if pids else None
             return await run_in_pool(check)
         
 
@@ -210,6 +305,7 @@ class GalleryManager:
         g = self.find_gall(name_or_alias)
         assert g is not None, f'画廊\"{name_or_alias}\"不存在'
         self.galleries.pop(g.name)
+        self._invalidate_hash_index(g)
         self._save()
 
     def add_gall_alias(self, name_or_alias: str, alias: str):
@@ -293,6 +389,11 @@ class GalleryManager:
 
         pic.path = dst_path
         g.pics.append(pic)
+        if index := self.hash_indexes.get(g.name):
+            index.add(pic)
+        else:
+            # 可能有正在构建的索引未包含该图片
+            self._invalidate_hash_index(g)
         await run_in_pool(pic.ensure_thumb)
         self._save()
         return self.pid_top
@@ -337,6 +438,7 @@ class GalleryManager:
         p.path = dst_path
         p.hash1 = new_pic.hash1
         p.hash2 = new_pic.hash2
+        self._invalidate_hash_index(g)
         p.thumb_path = None
         await run_in_pool(p.ensure_thumb)
 
@@ -351,6 +453,7 @@ class GalleryManager:
         assert p is not None, f'图片ID {pid} 不存在'
         g = self.find_gall(p.gall_name)
         g.pics.remove(p)
+        self._invalidate_hash_index(g)
         try:
             if os.path.exists(p.path):
                 os.remove(p.path)
@@ -392,6 +495,7 @@ class GalleryManager:
             if not os.path.exists(pic.path):
                 g.pics.remove(pic)
                 del_pids.append(pic.pid)
+        self._invalidate_hash_index(g)
         self._save()
         return new_pids, del_pids
     
@@ -415,22 +519,21 @@ class GalleryManager:
             assert g is not None, f'画廊\"{name_or_alias}\"不存在'
             
             ret: dict[int, tuple[GalleryPic, list[int]]] = {}  # ret[pid] = (first_pic, dup_pids)
+            # 只包含每组首个图片的索引，新图片归入第一个相同的组
+            first_index = GalleryHashIndex()
             for pic in g.pics[:]:
                 if rehash:
                     pic.calc_hash()
 
-                sim_pid = None
-                for k, v in ret.items():
-                    if pic.is_same(v[0]):
-                        sim_pid = k
-                        break
-
-                if sim_pid is not None:
-                    ret[sim_pid][1].append(pic.pid)
+                sim_pids = first_index.find_same(pic)
+                if sim_pids:
+                    ret[sim_pids[0]][1].append(pic.pid)
                 else:
                     ret[pic.pid] = (pic, [])
+                    first_index.add(pic)
 
             if rehash:
+                self._invalidate_hash_index(g)
                 self._save()
             ret = { k : v[1] for k, v in ret.items() if v[1] }
             return ret
@@ -1,5 +1,7 @@
 from ..utils import *
 import numpy as np
+import aiosqlite
+from collections import OrderedDict
 from .api_provider import ApiProvider, LlmModel
 from .api_provider_manager import api_provider_mgr
 
@@ -311,94 +313,541 @@ async def get_text_embedding(texts: List[str], model_name: str = 'sf-bge-m3') ->
     await provider.aupdate_quota(-cost)
     return embeddings
 
+TEXT_EMBEDDING_CACHE_PATH = "data/llm/text_embedding_cache.sqlite"
+TEXT_EMBEDDING_CACHE_MAX_NUM_CFG = config.item('text_embedding_cache.max_num')
+TEXT_EMBEDDING_CACHE_MEM_NUM_CFG = config.item('text_embedding_cache.mem_num')
+TEXT_EMBEDDING_BATCH_WAIT_MS_CFG = config.item('text_embedding_cache.batch_wait_ms')
+TEXT_EMBEDDING_BATCH_SIZE_CFG = config.item('text_embedding_cache.batch_size')
+
+# 查询文本嵌入缓存
+class TextEmbeddingCache:
+    """
+    按模型区分的查询文本嵌入缓存：内存LRU + sqlite持久化LRU（按最近使用时间淘汰）
+    未命中的文本在短时间窗口内合并为一次嵌入API调用，相同文本的并发查询共享结果
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.conn: aiosqlite.Connection = None
+        self.open_lock = asyncio.Lock()
+        self.mem: OrderedDict[tuple[str, str], np.ndarray] = OrderedDict()
+        self.touched: dict[tuple[str, str], float] = {}     # 待写回数据库的使用时间
+        self.pending: dict[str, dict[str, asyncio.Future]] = {}
+        self.flush_tasks: dict[str, asyncio.Task] = {}
+        self.running_tasks: set[asyncio.Task] = set()
+        self.inserted_since_evict = 0
+        self.stats = { 'mem_hit': 0, 'db_hit': 0, 'miss': 0, 'api_call': 0, 'api_text': 0 }
+
+    async def _open(self) -> aiosqlite.Connection:
+        async with self.open_lock:
+            if self.conn is None:
+                create_parent_folder(self.path)
+                self.conn = await aiosqlite.connect(self.path)
+                await self.conn.execute("PRAGMA journal_mode=WAL")
+                await self.conn.execute("PRAGMA synchronous=NORMAL")
+                await self.conn.execute("""
+                    CREATE TABLE IF NOT EXISTS cache (
+                        model TEXT,
+                        text TEXT,
+                        emb BLOB,
+                        used REAL,
+                        PRIMARY KEY (model, text)
+                    )
+                """)
+                await self.conn.execute("CREATE INDEX IF NOT EXISTS cache_used ON cache (used)")
+                await self.conn.commit()
+        return self.conn
+
+    async def close(self):
+        # 等待进行中的批次写入完成
+        while self.running_tasks:
+            await asyncio.gather(*self.running_tasks, return_exceptions=True)
+        if self.conn is not None:
+            await self._write_touched()
+            conn, self.conn = self.conn, None
+            await conn.close()
+
+    def _put_mem(self, key: tuple[str, str], emb: np.ndarray):
+        self.mem[key] = emb
+        self.mem.move_to_end(key)
+        while len(self.mem) > TEXT_EMBEDDING_CACHE_MEM_NUM_CFG.get(1024):
+            self.mem.popitem(last=False)
+
+    async def _write_touched(self):
+        if not self.touched or self.conn is None:
+            return
+        touched, self.touched = self.touched, {}
+        await self.conn.executemany(
+            "UPDATE cache SET used = ? WHERE model = ? AND text = ?",
+            [(used, model, text) for (model, text), used in touched.items()],
+        )
+        await self.conn.commit()
+
+    async def get(self, texts: List[str], model_name: str) -> List[np.ndarray]:
+        now = time.time()
+        ret: dict[str, np.ndarray] = {}
+        for text in texts:
+            key = (model_name, text)
+            if text not in ret and key in self.mem:
+                self.mem.move_to_end(key)
+                ret[text] = self.mem[key]
+                self.touched[key] = now
+                self.stats['mem_hit'] += 1
+
+        missing = list(dict.fromkeys(t for t in texts if t not in ret))
+        if missing:
+            conn = await self._open()
+            for i in range(0, len(missing), 500):
+                batch = missing[i:i+500]
+                cursor = await conn.execute(
+                    f"SELECT text, emb FROM cache WHERE model = ? AND text IN ({', '.join('?' * len(batch))})",
+                    (model_name, *batch),
+                )
+                for text, emb in await cursor.fetchall():
+                    emb = np.frombuffer(emb, dtype=np.float32)
+                    ret[text] = emb
+                    self._put_mem((model_name, text), emb)
+                    self.touched[(model_name, text)] = now
+                    self.stats['db_hit'] += 1
+                await cursor.close()
+        if len(self.touched) >= 64:
+            await self._write_touched()
+
+        missing = [t for t in missing if t not in ret]
+        if missing:
+            self.stats['miss'] += len(missing)
+            futures = [self._request(model_name, text) for text in missing]
+            for text, emb in zip(missing, await asyncio.gather(*[asyncio.shield(f) for f in futures])):
+                ret[text] = emb
+        return [ret[text] for text in texts]
+
+    def _request(self, model_name: str, text: str) -> asyncio.Future:
+        """
+        把未命中的文本加入待请求批次，返回结果future
+        """
+        pending = self.pending.setdefault(model_name, {})
+        if text in pending:
+            return pending[text]
+        future = pending[text] = asyncio.get_event_loop().create_future()
+        if len(pending) >= TEXT_EMBEDDING_BATCH_SIZE_CFG.get(32):
+            # 批次已满，立即取出发送，之后的文本进入新批次
+            self._run_task(self._flush(model_name, self.pending.pop(model_name)))
+        elif model_name not in self.flush_tasks:
+            self.flush_tasks[model_name] = self._run_task(self._flush_later(model_name))
+        return future
+
+    def _run_task(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self.running_tasks.add(task)
+        task.add_done_callback(self.running_tasks.discard)
+        return task
+
+    async def _flush_later(self, model_name: str):
+        await asyncio.sleep(TEXT_EMBEDDING_BATCH_WAIT_MS_CFG.get(20) / 1000)
+        self.flush_tasks.pop(model_name, None)
+        await self._flush(model_name)
+
+    async def _flush(self, model_name: str, pending: dict[str, asyncio.Future] = None):
+        if pending is None:
+            pending = self.pending.pop(model_name, None)
+        if not pending:
+            return
+        texts = list(pending)
+        try:
+            embs = await get_text_embedding(texts, model_name)
+        except Exception as e:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.stats['api_call'] += 1
+        self.stats['api_text'] += len(texts)
+
+        now = time.time()
+        values = []
+        for text, emb in zip(texts, embs):
+            emb = np.asarray(emb, dtype=np.float32)
+            self._put_mem((model_name, text), emb)
+            values.append((model_name, text, emb.tobytes(), now))
+            if not pending[text].done():
+                pending[text].set_result(emb)
+        try:
+            conn = await self._open()
+            await conn.executemany("INSERT OR REPLACE INTO cache (model, text, emb, used) VALUES (?, ?, ?, ?)", values)
+            self.inserted_since_evict += len(values)
+            # 超过上限时淘汰最久未使用的条目
+            if self.inserted_since_evict >= 64:
+                self.inserted_since_evict = 0
+                await self._write_touched()
+                cursor = await conn.execute("SELECT COUNT(*) FROM cache")
+                num = (await cursor.fetchone())[0]
+                await cursor.close()
+                max_num = TEXT_EMBEDDING_CACHE_MAX_NUM_CFG.get(20000)
+                if num > max_num:
+                    await conn.execute(
+                        "DELETE FROM cache WHERE rowid IN (SELECT rowid FROM cache ORDER BY used LIMIT ?)",
+                        (num - max_num,),
+                    )
+            await conn.commit()
+        except Exception:
+            logger.print_exc(f"写入文本嵌入缓存失败")
+
+    def get_stats(self) -> dict:
+        return self.stats | { 'mem_num': len(self.mem) }
+
+text_embedding_cache = TextEmbeddingCache(TEXT_EMBEDDING_CACHE_PATH)
+
+# 获取查询文本的嵌入（带缓存），返回float32向量列表
+async def get_query_text_embedding(texts: List[str], model_name: str = 'sf-bge-m3') -> List[np.ndarray]:
+    return await text_embedding_cache.get(texts, model_name)
+
+@on_shutdown()
+async def _close_text_embedding_cache():
+    try:
+        await text_embedding_cache.close()
+    except:
+        logger.print_exc(f"关闭文本嵌入缓存失败")
+
+# 查看文本嵌入缓存统计
+_handler = CmdHandler(['/embcache'], logger)
+_handler.check_superuser()
+@_handler.handle()
+async def _(ctx: HandlerContext):
+    stats = text_embedding_cache.get_stats()
+    total = stats['mem_hit'] + stats['db_hit'] + stats['miss']
+    hit = stats['mem_hit'] + stats['db_hit']
+    hit_rate = hit / total * 100 if total else 0
+    msg = f"命中{hit}/{total}({hit_rate:.1f}%) 内存{stats['mem_hit']} 数据库{stats['db_hit']}\n"
+    msg += f"API调用{stats['api_call']}次 共{stats['api_text']}条文本 内存缓存{stats['mem_num']}条"
+    return await ctx.asend_reply_msg(msg)
+
+TEXT_RETRIEVER_ANN_MIN_NUM_CFG = config.item('text_retriever.ann_min_num')
+TEXT_RETRIEVER_ANN_NPROBE_CFG = config.item('text_retriever.ann_nprobe')
+
+# 文本检索库的IVF近似最近邻索引：k-means聚类中心 + 每行所属的聚类
+class IvfIndex:
+    def __init__(self, centroids: np.ndarray, assign: np.ndarray, built_num: int):
+        self.centroids = centroids      # (nlist, dim)
+        self.assign = assign            # (行容量,) 每行所属聚类，-1为未分配
+        self.built_num = built_num      # 构建时的有效行数
+
+    @classmethod
+    def build(cls, embs: np.ndarray, rows: np.ndarray, capacity: int, iters: int = 10) -> 'IvfIndex':
+        """
+        对有效行rows做k-means聚类，聚类数为sqrt(n)
+        """
+        n = len(rows)
+        nlist = max(1, int(math.sqrt(n)))
+        rng = np.random.default_rng(0)
+        sample = rows[rng.choice(n, size=min(n, nlist * 64), replace=False)]
+        data = np.asarray(embs[sample])
+        centroids = data[rng.choice(len(data), size=nlist, replace=False)].copy()
+        for _ in range(iters):
+            labels = cls._nearest(centroids, data)
+            for c in range(nlist):
+                members = data[labels == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+        assign = np.full(capacity, -1, dtype=np.int32)
+        for i in range(0, n, 4096):
+            batch = rows[i:i+4096]
+            assign[batch] = cls._nearest(centroids, np.asarray(embs[batch]))
+        return cls(centroids, assign, n)
+
+    @staticmethod
+    def _nearest(centroids: np.ndarray, data: np.ndarray, k: int = 1) -> np.ndarray:
+        d = (centroids ** 2).sum(axis=1)[None, :] - 2 * data @ centroids.T
+        if k == 1:
+            return d.argmin(axis=1).astype(np.int32)
+        k = min(k, len(centroids))
+        return np.argpartition(d, k - 1, axis=1)[:, :k]
+
+    def add(self, rows: np.ndarray, embs: np.ndarray):
+        if len(rows):
+            self.assign[rows] = self._nearest(self.centroids, embs)
+
+    def resize(self, capacity: int):
+        assign = np.full(capacity, -1, dtype=np.int32)
+        assign[:len(self.assign)] = self.assign
+        self.assign = assign
+
+    def probe(self, q: np.ndarray, nprobe: int, n: int) -> np.ndarray:
+        """
+        获取查询向量最近的nprobe个聚类中的行的mask
+        """
+        lists = self._nearest(self.centroids, q[None, :], nprobe)[0]
+        return np.isin(self.assign[:n], lists)
+
+
 # 文本检索工具
 class TextRetriever:
+    """
+    文本嵌入检索库，数据保存在 data/llm/embeddings/{name}/ 下：
+    - emb.f32: 预分配的float32嵌入矩阵，内存映射读写，容量不足时倍增
+    - keys.jsonl: 只追加的 [key, 行号] 日志，行号为-1表示删除，被删除的行会被复用
+    - ivf.npz: 可选的近似最近邻索引
+    key的第二个空格分隔字段作为标签（如 "{mid} {region} title" 中的region），查询时可以按标签预先过滤
+    """
     def __init__(self, name):
         self.name = name
-        self.embedding_path = os.path.join(f"data/llm/embeddings/{name}.npz")
-        self.keys = []
-        self.key_set = set()
-        self.embeddings = None
-        self.loaded = False
+        self.dir = f"data/llm/embeddings/{name}/"
+        self.emb_path = self.dir + "emb.f32"
+        self.keys_path = self.dir + "keys.jsonl"
+        self.meta_path = self.dir + "meta.json"
+        self.ivf_path = self.dir + "ivf.npz"
+        self.legacy_path = f"data/llm/embeddings/{name}.npz"
         self.lock = asyncio.Lock()
+        self.loaded = False
+        # 正在进行的检索数量，检索使用的嵌入矩阵未复制，期间不复用被删除的行
+        self.search_num = 0
+        self._reset()
+
+    def _reset(self):
+        self.dim: int | None = None
+        self.capacity = 0
+        self.row_num = 0                                # 已使用过的行数（包含被删除的行）
+        self.embs: np.ndarray | None = None             # (capacity, dim) memmap
+        self.sq_norms = np.zeros(0, dtype=np.float32)   # 每行的模长平方
+        self.valid = np.zeros(0, dtype=bool)            # 行是否有效
+        self.tag_masks: dict[str, np.ndarray] = {}      # 标签 -> 行mask
+        self.key_rows: dict[str, int] = {}
+        self.row_keys: dict[int, str] = {}
+        self.free_rows: list[int] = []
+        self.journal_lines = 0
+        self.ivf: IvfIndex | None = None
+
+    @staticmethod
+    def get_key_tag(key: str) -> str | None:
+        parts = key.split()
+        return parts[1] if len(parts) >= 2 else None
+
+    @property
+    def keys(self) -> List[str]:
+        return list(self.key_rows)
+
+    @property
+    def key_set(self):
+        return self.key_rows.keys()
+
+    # ------------------------ 存储 ------------------------ #
+
+    def _open_embs(self, capacity: int):
+        """
+        以内存映射打开嵌入矩阵，文件不足capacity行时扩展
+        """
+        if self.embs is not None:
+            self.embs.flush()
+        create_parent_folder(self.emb_path)
+        size = capacity * self.dim * 4
+        with open(self.emb_path, 'ab') as f:
+            if f.tell() < size:
+                f.truncate(size)
+        self.embs = np.memmap(self.emb_path, dtype=np.float32, mode='r+', shape=(capacity, self.dim))
+        def grow(arr: np.ndarray) -> np.ndarray:
+            ret = np.zeros(capacity, dtype=arr.dtype)
+            ret[:len(arr)] = arr
+            return ret
+        self.sq_norms = grow(self.sq_norms)
+        self.valid = grow(self.valid)
+        self.tag_masks = {tag: grow(mask) for tag, mask in self.tag_masks.items()}
+        if self.ivf:
+            self.ivf.resize(capacity)
+        self.capacity = capacity
+        dump_json({'dim': self.dim, 'capacity': capacity}, self.meta_path)
+
+    def _set_row(self, row: int, key: str | None):
+        self.valid[row] = key is not None
+        for mask in self.tag_masks.values():
+            mask[row] = False
+        if key is not None:
+            self.key_rows[key] = row
+            self.row_keys[row] = key
+            tag = self.get_key_tag(key)
+            if tag is not None:
+                if tag not in self.tag_masks:
+                    self.tag_masks[tag] = np.zeros(self.capacity, dtype=bool)
+                self.tag_masks[tag][row] = True
+        else:
+            self.row_keys.pop(row, None)
+
+    def _load(self):
+        self._reset()
+        if not os.path.exists(self.meta_path):
+            if os.path.exists(self.legacy_path):
+                self._migrate_legacy()
+            self.loaded = True
+            return
+        meta = load_json(self.meta_path)
+        self.dim = meta['dim']
+        self._open_embs(meta['capacity'])
+        if os.path.exists(self.keys_path):
+            with open(self.keys_path, 'rb') as f:
+                for line in f:
+                    try:
+                        key, row = loads_json(line)
+                    except Exception:
+                        # 写入中断的末尾行
+                        break
+                    self.journal_lines += 1
+                    if row >= 0:
+                        if (old_row := self.key_rows.get(key)) is not None and old_row != row:
+                            self._set_row(old_row, None)
+                        self._set_row(row, key)
+                        self.row_num = max(self.row_num, row + 1)
+                    elif key in self.key_rows:
+                        self._set_row(self.key_rows.pop(key), None)
+        self.free_rows = [r for r in range(self.row_num) if not self.valid[r]]
+        rows = np.nonzero(self.valid[:self.row_num])[0]
+        for i in range(0, len(rows), 4096):
+            batch = rows[i:i+4096]
+            self.sq_norms[batch] = (np.asarray(self.embs[batch]) ** 2).sum(axis=1)
+        if os.path.exists(self.ivf_path):
+            try:
+                data = np.load(self.ivf_path)
+                self.ivf = IvfIndex(data['centroids'], data['assign'], int(data['built_num']))
+                self.ivf.resize(self.capacity)
+            except Exception:
+                logger.warning(f"加载检索库 {self.name} 的近似索引失败，将重新构建")
+        self.loaded = True
+        logger.info(f"加载检索库 {self.name} 的 {len(self.key_rows)} 条文本嵌入")
+
+    def _migrate_legacy(self):
+        """
+        从旧的npz格式迁移
+        """
+        try:
+            data = np.load(self.legacy_path)
+            embs = np.asarray(data['embeddings'], dtype=np.float32)
+            keys = data['keys'].tolist()
+        except Exception:
+            logger.warning(f"加载检索库 {self.name} 的文本嵌入失败, 使用空检索库")
+            return
+        if len(keys):
+            self._write(keys, embs)
+        os.replace(self.legacy_path, self.legacy_path + ".bak")
+        logger.info(f"迁移检索库 {self.name} 的 {len(keys)} 条文本嵌入到内存映射存储")
+
+    def _append_journal(self, entries: list[tuple[str, int]]):
+        with open(self.keys_path, 'ab') as f:
+            f.write(b''.join(dump_bytes_json(e) + b'\n' for e in entries))
+            f.flush()
+            os.fsync(f.fileno())
+        self.journal_lines += len(entries)
+        # 日志中的过期条目过多时重写
+        if self.journal_lines > 2 * len(self.key_rows) + 1024:
+            tmp_path = self.keys_path + ".tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(b''.join(dump_bytes_json([k, r]) + b'\n' for k, r in self.key_rows.items()))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.keys_path)
+            self.journal_lines = len(self.key_rows)
+
+    def _write(self, keys: List[str], embs: np.ndarray):
+        """
+        写入一批嵌入，已存在的key原地更新，新key优先复用被删除的行
+        """
+        embs = np.asarray(embs, dtype=np.float32)
+        if self.dim is None:
+            self.dim = embs.shape[1]
+        assert embs.shape[1] == self.dim, f"嵌入维度 {embs.shape[1]} 与检索库 {self.name} 的维度 {self.dim} 不一致"
+        # 同一批中重复的key只保留最后一个，避免为同一个key分配多行
+        last_indices = {key: i for i, key in enumerate(keys)}
+        if len(last_indices) < len(keys):
+            keys = list(last_indices)
+            embs = embs[list(last_indices.values())]
+        rows, entries = [], []
+        for key in keys:
+            row = self.key_rows.get(key)
+            if row is None:
+                if self.free_rows and not self.search_num:
+                    row = self.free_rows.pop()
+                else:
+                    row = self.row_num
+                    self.row_num += 1
+                entries.append((key, row))
+            rows.append(row)
+        if self.row_num > self.capacity:
+            self._open_embs(max(64, self.capacity * 2, self.row_num))
+        rows = np.array(rows, dtype=np.int64)
+        self.embs[rows] = embs
+        self.embs.flush()
+        self.sq_norms[rows] = (embs ** 2).sum(axis=1)
+        for key, row in entries:
+            self._set_row(row, key)
+        if self.ivf:
+            self.ivf.add(rows, embs)
+        if entries:
+            self._append_journal(entries)
+
+    def _delete(self, keys: List[str]):
+        entries = []
+        for key in keys:
+            row = self.key_rows.pop(key)
+            self._set_row(row, None)
+            self.free_rows.append(row)
+            entries.append((key, -1))
+        self._append_journal(entries)
+
+    def _check_ivf(self):
+        """
+        有效行数达到阈值时构建近似索引，数量变化较大时重建
+        """
+        min_num = TEXT_RETRIEVER_ANN_MIN_NUM_CFG.get(0)
+        n = len(self.key_rows)
+        if not min_num or n < min_num:
+            if self.ivf is not None:
+                self.ivf = None
+                if os.path.exists(self.ivf_path):
+                    os.remove(self.ivf_path)
+            return
+        if self.ivf is not None and 0.5 * self.ivf.built_num <= n <= 2 * self.ivf.built_num:
+            return
+        t = time.time()
+        rows = np.nonzero(self.valid[:self.row_num])[0]
+        self.ivf = IvfIndex.build(self.embs, rows, self.capacity)
+        np.savez(self.ivf_path, centroids=self.ivf.centroids, assign=self.ivf.assign, built_num=self.ivf.built_num)
+        logger.info(f"构建检索库 {self.name} 的近似索引: {n}条 {len(self.ivf.centroids)}个聚类 耗时{time.time() - t:.1f}s")
 
     async def save(self):
         assert self.loaded, f"{self.name} 的文本嵌入未加载"
         def _save():
-            os.makedirs(os.path.dirname(self.embedding_path), exist_ok=True)
-            np.savez(self.embedding_path, embeddings=self.embeddings, keys=self.keys)
-            logger.info(f"保存 {self.name} 的 {len(self.keys)} 条文本嵌入")
+            if self.embs is not None:
+                self.embs.flush()
         return await run_in_pool(_save)
 
     async def load(self):
-        def _load():
-            try:
-                data = np.load(self.embedding_path)
-                self.embeddings = data['embeddings']
-                self.keys = data['keys'].tolist()
-                self.key_set = set(self.keys)
-                logger.info(f"加载检索库 {self.name} 的 {len(self.keys)} 条文本嵌入")
-            except:
-                logger.warning(f"加载检索库 {self.name} 的文本嵌入失败, 使用空检索库")
-                self.embeddings = None
-                self.keys = []
-                self.key_set = set()
-            self.loaded = True
-        return await run_in_pool(_load)
+        return await run_in_pool(self._load)
 
     async def check_to_load(self):
         if not self.loaded:
             return await self.load()
-        
+
+    # ------------------------ 更新 ------------------------ #
+
     async def update_embs(self, keys: List[str], texts: List[str], skip_exist=False):
         assert len(keys) == len(texts), "keys 和 texts 的长度不一致"
         async with self.lock:
             await self.check_to_load()
             if skip_exist:
-                not_exist_indices = [i for i, k in enumerate(keys) if k not in self.key_set]
+                not_exist_indices = [i for i, k in enumerate(keys) if k not in self.key_rows]
                 if len(not_exist_indices) == 0:
                     return
                 keys = [keys[i] for i in not_exist_indices]
                 texts = [texts[i] for i in not_exist_indices]
-                embs = await get_text_embedding(texts)
-                if self.embeddings is None:
-                    self.embeddings = embs
-                else:
-                    self.embeddings = np.concatenate([self.embeddings, embs])
-                self.keys.extend(keys)
-                self.key_set.update(keys)
-                logger.info(f"添加 {len(keys)} 条文本嵌入到 {self.name}: {keys}")
-            else:
-                embs = await get_text_embedding(texts)
-                not_exist_indices = [i for i, k in enumerate(keys) if k not in self.key_set]
-                exist_indices = [i for i, k in enumerate(keys) if k in self.key_set]
-                exist_target_indices = [self.keys.index(keys[i]) for i in exist_indices]
-
-                not_exist_keys = [keys[i] for i in not_exist_indices]
-                not_exist_embs = embs[not_exist_indices]
-
-                exist_keys = [keys[i] for i in exist_indices]
-                exist_embs = embs[exist_indices]
-
-                self.embeddings[exist_target_indices] = exist_embs
+            embs = await get_text_embedding(texts)
+            exist_keys = [k for k in keys if k in self.key_rows]
+            await run_in_pool(self._write, keys, embs)
+            await run_in_pool(self._check_ivf)
+            if exist_keys:
                 logger.info(f"更新 {self.name} 中的 {len(exist_keys)} 条文本嵌入: {exist_keys}")
-
-                if self.embeddings is None:
-                    self.embeddings = not_exist_embs
-                else:
-                    self.embeddings = np.concatenate([self.embeddings, not_exist_embs])
-                self.keys.extend(not_exist_keys)
-                self.key_set.update(not_exist_keys)
-                logger.info(f"添加 {len(not_exist_keys)} 条文本嵌入到 {self.name}: {not_exist_keys}")
-
-            await self.save()
+            logger.info(f"添加 {len(keys) - len(exist_keys)} 条文本嵌入到 {self.name}")
 
     async def batch_update_embs(self, keys: List[str], texts: List[str], skip_exist=False, batch_size=32):
         assert len(keys) == len(texts), "keys 和 texts 的长度不一致"
         async with self.lock:
             await self.check_to_load()
         if skip_exist:
-            not_exist_indices = [i for i, k in enumerate(keys) if k not in self.key_set]
+            not_exist_indices = [i for i, k in enumerate(keys) if k not in self.key_rows]
             keys = [keys[i] for i in not_exist_indices]
             texts = [texts[i] for i in not_exist_indices]
         if len(keys) == 0:
@@ -412,63 +861,96 @@ class TextRetriever:
     async def del_embs(self, keys: List[str]):
         async with self.lock:
             await self.check_to_load()
-            not_exist_keys = [k for k in keys if k not in self.key_set]
+            not_exist_keys = [k for k in keys if k not in self.key_rows]
             if len(not_exist_keys):
                 logger.warning(f"尝试删除 {self.name} 中不存在的文本嵌入: {not_exist_keys}")
-                keys = [k for k in keys if k in self.key_set]
+                keys = [k for k in keys if k in self.key_rows]
             if len(keys) == 0:
                 logger.warning(f"没有要删除的文本嵌入")
                 return
-            if len(keys) == len(self.keys):
-                self.embeddings = None
-                self.keys = []
-                self.key_set = set()
-            else:
-                target_indices = [self.keys.index(k) for k in keys]
-                self.embeddings = np.delete(self.embeddings, target_indices, axis=0)
-                self.keys = [k for k in self.keys if k not in keys]
-                self.key_set = set(self.keys)
+            await run_in_pool(self._delete, list(dict.fromkeys(keys)))
+            await run_in_pool(self._check_ivf)
             logger.info(f"从 {self.name} 中移除文本嵌入: {keys}")
-            await self.save()
 
     async def clear(self):
         async with self.lock:
             await self.check_to_load()
-            self.embeddings = None
-            self.keys = []
+            def _clear():
+                self.embs = None
+                for path in (self.emb_path, self.keys_path, self.meta_path, self.ivf_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+                self._reset()
+            await run_in_pool(_clear)
             logger.info(f"清空检索库 {self.name}")
-            await self.save()
 
     def __len__(self):
         assert self.loaded, f"{self.name} 的文本嵌入未加载"
-        return len(self.keys)
-    
+        return len(self.key_rows)
+
     def exists(self, key: str) -> bool:
         assert self.loaded, f"{self.name} 的文本嵌入未加载"
         key = str(key)
-        return key in self.key_set
+        return key in self.key_rows
+
+    # ------------------------ 查询 ------------------------ #
+
+    def _snapshot(self, q_emb: np.ndarray, top_k: int, tags: List[str] | None) -> Tuple[np.ndarray, dict, np.ndarray, np.ndarray]:
+        """
+        在锁内取得检索所需状态的快照（候选行mask、行到key的映射和嵌入矩阵引用），避免检索时与写入并发导致的形状不一致
+        嵌入矩阵不复制，检索期间写入不复用被删除的行，因此快照中的行不会被其他key覆盖
+        """
+        n = self.row_num
+        mask = self.valid[:n].copy()
+        if tags is not None:
+            tag_mask = np.zeros(n, dtype=bool)
+            for tag in tags:
+                if tag in self.tag_masks:
+                    tag_mask |= self.tag_masks[tag][:n]
+            mask &= tag_mask
+        if self.ivf is not None:
+            ann_mask = mask & self.ivf.probe(q_emb, TEXT_RETRIEVER_ANN_NPROBE_CFG.get(16), n)
+            # 探查的聚类中结果不足时退回到精确检索
+            if ann_mask.sum() >= top_k:
+                mask = ann_mask
+        return mask, dict(self.row_keys), self.embs, self.sq_norms
 
-    async def find(self, query: str, top_k: int, filter: Any=None) -> List[Tuple[str, float]]:
+    @staticmethod
+    def _search(q_emb: np.ndarray, top_k: int, filter: Any, mask: np.ndarray, row_keys: dict, embs: np.ndarray, sq_norms: np.ndarray) -> List[Tuple[str, float]]:
+        rows = np.nonzero(mask)[0]
+        if filter:
+            rows = rows[[bool(filter(row_keys[r])) for r in rows]]
+        if len(rows) == 0:
+            return []
+        # |e - q|^2 = |e|^2 - 2e·q + |q|^2
+        d2 = sq_norms[rows] - 2 * (np.asarray(embs[rows]) @ q_emb) + float(q_emb @ q_emb)
+        k = min(top_k, len(rows))
+        top = np.argpartition(d2, k - 1)[:k]
+        top = top[np.argsort(d2[top])]
+        distances = np.sqrt(np.maximum(d2[top], 0))
+        return [(row_keys[rows[i]], float(d)) for i, d in zip(top, distances)]
+
+    async def find(self, query: str, top_k: int, filter: Any=None, tags: List[str]=None) -> List[Tuple[str, float]]:
+        """
+        查找与query最相似的top_k条记录，返回(key, L2距离)列表
+        tags不为None时只在带有这些标签的key中查找（使用预先计算的标签mask），filter为对key的额外过滤函数
+        """
         async with self.lock:
             await self.check_to_load()
         logger.info(f"查找检索库 {self.name} 中与 \"{query}\" 最相似的 {top_k} 条记录")
-        if len(self.keys) == 0:
+        if len(self.key_rows) == 0:
             logger.warning(f"检索库 {self.name} 为空")
             return []
-        q_emb = await get_text_embedding(query)
-        def compute():
-            valid_index = []
-            for i in range(len(self.keys)):
-                if filter and not filter(self.keys[i]):
-                    continue
-                valid_index.append(i)
-            embs = self.embeddings[valid_index]
-            distances = np.linalg.norm(embs - q_emb, axis=1)
-            indexes = np.argsort(distances)[:top_k]
-            return valid_index, indexes, distances
-        valid_index, indexes, distances = await run_in_pool(compute)
-        logger.info(f"检索库 {self.name} 中找到 {len(indexes)} 条记录")
-        return [(self.keys[valid_index[i]], distances[i]) for i in indexes]
+        q_emb = (await get_query_text_embedding([query]))[0]
+        async with self.lock:
+            snapshot = self._snapshot(q_emb, top_k, tags)
+            self.search_num += 1
+        try:
+            ret = await run_in_pool(self._search, q_emb, top_k, filter, *snapshot)
+        finally:
+            self.search_num -= 1
+        logger.info(f"检索库 {self.name} 中找到 {len(ret)} 条记录")
+        return ret
 
 
 text_retrievers = {}
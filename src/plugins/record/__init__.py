@@ -29,6 +29,12 @@ def after_record_hook(func):
     after_record_hook_funcs.append(func)
     return func
 
+# 消息批量插入数据库后的钩子: 异步函数 hook(msgs)，msgs为本次插入的消息dict列表
+after_insert_hook_funcs = []
+def after_insert_hook(func):
+    after_insert_hook_funcs.append(func)
+    return func
+
 
 # 缩减部分类型的消息用于日志输出
 def simplify_msg(msg):
@@ -115,16 +121,38 @@ async def record_message(bot: Bot, event: GroupMessageEvent):
                 except: logger.print_exc(f"记录消息后hook {hook.__name__} 执行失败")
             asyncio.create_task(run_after_hook(hook, bot, event))
 
+# 插入数据库的锁，保证取出的一批消息插入完成后才能开始下一次插入
+_insert_lock = asyncio.Lock()
+# 执行中的插入后hook任务，保持引用避免被回收
+_insert_hook_tasks: set[asyncio.Task] = set()
+
+async def flush_msgs_to_insert():
+    """
+    把待插入的消息立即插入数据库，返回时此前收到的消息都已写入（插入后hook在后台执行）
+    """
+    async with _insert_lock:
+        if not msgs_to_insert:
+            return
+        # 先取出本批消息，插入过程中收到的消息留到下一批
+        msgs = msgs_to_insert[:]
+        msgs_to_insert.clear()
+        try:
+            await insert_msgs(msgs)
+        except Exception as e:
+            logger.print_exc(f"插入 {len(msgs)} 条消息到数据库失败")
+            return
+    for hook in after_insert_hook_funcs:
+        async def run_after_insert_hook(hook, msgs):
+            try: await hook(msgs)
+            except: logger.print_exc(f"插入消息后hook {hook.__name__} 执行失败")
+        task = asyncio.create_task(run_after_insert_hook(hook, msgs))
+        _insert_hook_tasks.add(task)
+        task.add_done_callback(_insert_hook_tasks.discard)
+
 # 插入数据库消息定时任务
 @repeat_with_interval(config.item('insert_msg_loop_interval_seconds'), '插入消息到数据库', logger)
 async def insert_msg_task():
-    try:
-        if msgs_to_insert:
-            await insert_msgs(msgs_to_insert)
-    except Exception as e:
-        logger.print_exc(f"插入 {len(msgs_to_insert)} 条消息到数据库失败")
-    finally:
-        msgs_to_insert.clear()
+    await flush_msgs_to_insert()
 
 # 记录消息
 add = on_message(block=False, priority=-1)
@@ -165,19 +193,15 @@ async def _(ctx: HandlerContext):
     if not user_id:
         return await ctx.asend_reply_msg("请回复用户或指定用户的QQ号")
 
-    recs = await query_msg_by_user_id(ctx.group_id, user_id)
-    recs = sorted(recs, key=lambda x: x['time'])
-    if not recs:
-        return await ctx.asend_reply_msg(f"用户{user_id}在群{ctx.group_id}中没有发过言")
-
     nicknames = []
     cur_name = None
-    for rec in recs:
+    async for rec in iter_msg(ctx.group_id, user_id=int(user_id), fields=['time', 'nickname']):
         name = rec['nickname']
-        time = rec['time'].strftime("%Y-%m-%d")
         if name != cur_name:
             cur_name = name
-            nicknames.append((time, name))
+            nicknames.append((rec['time'].strftime("%Y-%m-%d"), name))
+    if not nicknames:
+        return await ctx.asend_reply_msg(f"用户{user_id}在群{ctx.group_id}中没有发过言")
 
     msg = f"{user_id} 用过的群名片:\n"
     nicknames = nicknames[-50:]
@@ -266,6 +290,22 @@ async def _(ctx: HandlerContext):
     return await ctx.asend_fold_msg_adaptive(msg.strip())
 
 
+# 查询各指令的图片编码统计
+get_image_encode_stats_handler = CmdHandler(["/image_encode_stats", "/encstat"], logger)
+get_image_encode_stats_handler.check_superuser()
+@get_image_encode_stats_handler.handle()
+async def _(ctx: HandlerContext):
+    stats = sorted(get_image_encode_stats().items(), key=lambda x: x[1].total_time, reverse=True)
+    assert_and_reply(stats, "暂无图片编码记录")
+    msg = "【图片编码统计】\n"
+    for cmd, s in stats:
+        avg_time = s.total_time / s.count if s.count else 0
+        avg_size = s.total_size // s.count if s.count else 0
+        msg += f"{cmd}: 编码{s.count}次 复用{s.cached_count}次\n"
+        msg += f"  耗时 平均{avg_time:.3f}s 最大{s.max_time:.3f}s 大小 平均{get_readable_file_size(avg_size)} 最大{get_readable_file_size(s.max_size)}\n"
+    return await ctx.asend_fold_msg_adaptive(msg.strip())
+
+
 # 聊天记录转文本
 forward_to_text = CmdHandler(["/转文本", "/to_text"], logger)
 forward_to_text.check_wblist(gbl).check_cdrate(cd)
@@ -1,87 +1,312 @@
 from ..utils import *
 import aiosqlite
+import heapq
+import itertools
+from contextlib import asynccontextmanager
+from collections import OrderedDict
+from typing import AsyncIterator
 
 config = Config('record')
 logger = get_logger("Record")
 
 
-DB_PATH = "data/record/record.sqlite"
+# 分片前的旧数据库，其中的数据会在后台逐步迁移到月分片，迁移完成后删除
+LEGACY_DB_PATH = "data/record/record.sqlite"
+# 按月分片的数据库，每个月一个文件，较早的月份可以压缩归档
+SHARD_DIR = "data/record/shards/"
+SHARD_DB_PATH = SHARD_DIR + "{}.sqlite"
+ARCHIVED_SHARD_DB_PATH = SHARD_DIR + "{}.sqlite.zst"
 MSG_TABLE_NAME  = "msg_{}"
+MSG_COLUMNS = "id, time, msg_id, user_id, nickname, content"
 
-_conn: aiosqlite.Connection = None         # 连接
-_created_table_group_ids = set()             # 是否创建过表
-
-# 获得连接 
-async def get_conn(group_id: int | list[int]):
-    global _conn, _created_table_group_ids
-    if _conn is None:
-        create_parent_folder(DB_PATH)
-        _conn = await aiosqlite.connect(DB_PATH)
-        logger.info(f"连接sqlite数据库 {DB_PATH} 成功")
-
-    # 创建消息表 (ID, 时间戳, 消息ID, 用户ID, 昵称, json内容)
-    table_created = False
-    if isinstance(group_id, int):
-        group_id = [group_id]
-    for gid in group_id:
-        if gid not in _created_table_group_ids:
-            await _conn.execute(f"""
-                CREATE TABLE IF NOT EXISTS {MSG_TABLE_NAME.format(gid)} (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    time INTEGER,
-                    msg_id INTEGER,
-                    user_id INTEGER,
-                    nickname TEXT,
-                    content TEXT
-                )
-            """)
-            _created_table_group_ids.add(gid)
-            table_created = True
-    if table_created:
-        await _conn.commit()
-
-    return _conn
+SHARD_CONN_MAX_NUM_CFG = config.item('shard_conn_max_num')
+MIGRATE_ROWS_PER_STEP_CFG = config.item('migrate_rows_per_step')
+ARCHIVE_AFTER_MONTHS_CFG = config.item('archive_after_months')
+ARCHIVE_IDLE_HOURS_CFG = config.item('archive_idle_hours')
+STREAM_CHUNK_SIZE_CFG = config.item('stream_chunk_size')
+
+
+class MsgDb:
+    """
+    单个sqlite数据库文件（旧数据库或月分片）的连接
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.conn: aiosqlite.Connection = None
+        self.created_tables: set[int] = set()
+        self.users = 0
+        self.open_lock = asyncio.Lock()
+        self.write_lock = asyncio.Lock()
+
+    async def open(self) -> aiosqlite.Connection:
+        async with self.open_lock:
+            if self.conn is None:
+                create_parent_folder(self.path)
+                self.conn = await aiosqlite.connect(self.path)
+                await self.conn.execute("PRAGMA journal_mode=WAL")
+                await self.conn.execute("PRAGMA synchronous=NORMAL")
+                logger.info(f"连接sqlite数据库 {self.path} 成功")
+        return self.conn
+
+    async def close(self):
+        if self.conn is not None:
+            conn, self.conn = self.conn, None
+            self.created_tables.clear()
+            await conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            await conn.close()
+            logger.info(f"关闭sqlite数据库 {self.path}")
+
+    async def ensure_table(self, group_id: int, create: bool) -> bool:
+        """
+        确保群的消息表存在并建立索引，create为False时表不存在返回False
+        旧数据库中的表会在第一次访问时在线建立索引
+        """
+        if group_id in self.created_tables:
+            return True
+        table = MSG_TABLE_NAME.format(group_id)
+        async with self.write_lock:
+            if group_id in self.created_tables:
+                return True
+            if create:
+                # 创建消息表 (ID, 时间戳, 消息ID, 用户ID, 昵称, json内容)
+                await self.conn.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {table} (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        time INTEGER,
+                        msg_id INTEGER,
+                        user_id INTEGER,
+                        nickname TEXT,
+                        content TEXT
+                    )
+                """)
+            else:
+                cursor = await self.conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,))
+                row = await cursor.fetchone()
+                await cursor.close()
+                if row is None:
+                    return False
+            t = time.time()
+            await self.conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_time ON {table} (time)")
+            await self.conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_user_time ON {table} (user_id, time)")
+            await self.conn.commit()
+            if time.time() - t > 1:
+                logger.info(f"为 {self.path} 中的 {table} 表建立索引 耗时{time.time() - t:.1f}s")
+            self.created_tables.add(group_id)
+            return True
+
+_dbs: OrderedDict[str, MsgDb] = OrderedDict()
+
+@asynccontextmanager
+async def use_db(path: str):
+    """
+    获取数据库连接，连接数超过上限时关闭最久未使用的空闲连接
+    """
+    db = _dbs.get(path)
+    if db is None:
+        db = _dbs[path] = MsgDb(path)
+    _dbs.move_to_end(path)
+    db.users += 1
+    try:
+        await db.open()
+        yield db
+    finally:
+        db.users -= 1
+        open_dbs = [d for d in _dbs.values() if d.conn is not None]
+        for d in open_dbs[:max(0, len(open_dbs) - SHARD_CONN_MAX_NUM_CFG.get(8))]:
+            if d.users == 0:
+                await d.close()
+
+
+# ============================ 分片 ============================ #
+
+_shard_months: set[int] | None = None
+_archived_months: set[int] | None = None
+_archive_lock = asyncio.Lock()
+
+def get_month(t: datetime) -> int:
+    """
+    获取时间所在的月份（YYYYMM）
+    """
+    return t.year * 100 + t.month
+
+def get_month_range(month: int) -> tuple[float, float]:
+    """
+    获取月份的时间戳范围 [start, end)
+    """
+    y, m = divmod(month, 100)
+    start = datetime(y, m, 1)
+    end = datetime(y + 1, 1, 1) if m == 12 else datetime(y, m + 1, 1)
+    return start.timestamp(), end.timestamp()
+
+def _load_shard_months():
+    global _shard_months, _archived_months
+    if _shard_months is not None:
+        return
+    _shard_months, _archived_months = set(), set()
+    if os.path.isdir(SHARD_DIR):
+        for name in os.listdir(SHARD_DIR):
+            month, _, ext = name.partition('.')
+            if not month.isdigit():
+                continue
+            if ext == 'sqlite':
+                _shard_months.add(int(month))
+            elif ext == 'sqlite.zst':
+                _archived_months.add(int(month))
+
+def get_source_paths(start_time: datetime = None, end_time: datetime = None) -> list[str]:
+    """
+    获取覆盖时间范围的数据库路径，旧数据库在最前，之后按月份升序
+    包含已归档的月份，实际查询时才解压
+    """
+    _load_shard_months()
+    start_month = get_month(start_time) if start_time else 0
+    end_month = get_month(end_time) if end_time else 999999
+    paths = []
+    if os.path.exists(LEGACY_DB_PATH):
+        paths.append(LEGACY_DB_PATH)
+    for month in sorted(_shard_months | _archived_months):
+        if start_month <= month <= end_month:
+            paths.append(SHARD_DB_PATH.format(month))
+    return paths
+
+def is_month_archived(month: int) -> bool:
+    """
+    月份的分片是否已压缩归档（查询时会先解压）
+    """
+    _load_shard_months()
+    return month in _archived_months
+
+# 各月分片最近一次被查询的时间，最近被查询过的分片暂不归档
+_shard_read_times: dict[int, float] = {}
+
+@asynccontextmanager
+async def use_read_db(path: str):
+    """
+    获取用于查询的数据库连接，已归档的月分片先解压
+    """
+    month = os.path.basename(path).partition('.')[0]
+    if path.startswith(SHARD_DIR) and month.isdigit():
+        month = int(month)
+        _shard_read_times[month] = time.time()
+        if is_month_archived(month):
+            logger.info(f"查询已归档的消息分片 {month}，解压后查询")
+            await unarchive_shard(month)
+    async with use_db(path) as db:
+        yield db
+
+async def _get_writable_shard_path(month: int) -> str:
+    """
+    获取用于写入的月分片路径，已归档的月份会先解压
+    """
+    _load_shard_months()
+    if month not in _shard_months:
+        if month in _archived_months:
+            await unarchive_shard(month)
+        _shard_months.add(month)
+    return SHARD_DB_PATH.format(month)
+
+def _compress_file(src: str, dst: str):
+    tmp = dst + '.tmp'
+    with open(src, 'rb') as fin, open(tmp, 'wb') as fout:
+        zstandard.ZstdCompressor(level=10).copy_stream(fin, fout)
+    os.replace(tmp, dst)
+
+def _decompress_file(src: str, dst: str):
+    tmp = dst + '.tmp'
+    with open(src, 'rb') as fin, open(tmp, 'wb') as fout:
+        zstandard.ZstdDecompressor().copy_stream(fin, fout)
+    os.replace(tmp, dst)
+
+async def archive_shard(month: int) -> bool:
+    """
+    压缩归档某个月的分片，正在使用时返回False
+    """
+    async with _archive_lock:
+        _load_shard_months()
+        path = SHARD_DB_PATH.format(month)
+        if month not in _shard_months:
+            return False
+        db = _dbs.get(path)
+        if db is not None and db.users > 0:
+            return False
+        _shard_months.discard(month)
+        # 打开后再关闭以将WAL中的内容写回数据库文件
+        db = _dbs.pop(path, None) or MsgDb(path)
+        await db.open()
+        await db.close()
+        try:
+            size = os.path.getsize(path)
+            await run_in_pool(_compress_file, path, ARCHIVED_SHARD_DB_PATH.format(month))
+            for p in (path, path + '-wal', path + '-shm'):
+                if os.path.exists(p):
+                    os.remove(p)
+        except:
+            _shard_months.add(month)
+            raise
+        _archived_months.add(month)
+        logger.info(f"归档消息分片 {month} 成功 ({get_readable_file_size(size)} -> {get_readable_file_size(os.path.getsize(ARCHIVED_SHARD_DB_PATH.format(month)))})")
+        return True
+
+async def unarchive_shard(month: int) -> bool:
+    """
+    解压已归档的分片，使其重新可以查询和写入
+    """
+    async with _archive_lock:
+        _load_shard_months()
+        if month not in _archived_months:
+            return False
+        zst_path = ARCHIVED_SHARD_DB_PATH.format(month)
+        await run_in_pool(_decompress_file, zst_path, SHARD_DB_PATH.format(month))
+        os.remove(zst_path)
+        _archived_months.discard(month)
+        _shard_months.add(month)
+        logger.info(f"解压消息分片 {month} 成功")
+        return True
+
+
+# ============================ 插入 ============================ #
 
 # 插入到消息表
 async def insert_msg(group_id, time: datetime, msg_id: int, user_id: int, nickname: str, msg: dict):
-    time = time.timestamp()
-    content = dumps_json(msg)
-
-    conn = await get_conn(group_id)
-    insert_query = f'''
-        INSERT INTO {MSG_TABLE_NAME.format(group_id)} (time, msg_id, user_id, nickname, content)
-        VALUES (?, ?, ?, ?, ?)
-    '''
-    await conn.execute(insert_query, (time, msg_id, user_id, nickname, content))
-    await conn.commit()
+    await insert_msgs([dict(
+        group_id=group_id,
+        time=time,
+        msg_id=msg_id,
+        user_id=user_id,
+        nickname=nickname,
+        msg=msg,
+    )])
     logger.debug(f"插入消息 {msg_id} 到 {MSG_TABLE_NAME.format(group_id)} 表")
 
 # 插入多条消息到消息表
 async def insert_msgs(msgs: list):
-    group_id_msgs = {}
+    month_group_values: dict[int, dict[int, list]] = {}
     for msg in msgs:
-        group_id = msg['group_id']
-        group_id_msgs.setdefault(group_id, []).append(msg)
-    
-    conn = await get_conn(list(group_id_msgs.keys()))
-
-    for group_id, group_msgs in group_id_msgs.items():
-        insert_query = f'''
-            INSERT INTO {MSG_TABLE_NAME.format(group_id)} (time, msg_id, user_id, nickname, content)
-            VALUES (?, ?, ?, ?, ?)
-        '''
-        values = []
-        for msg in group_msgs:
-            time = msg['time'].timestamp()
-            msg_id = msg['msg_id']
-            user_id = msg['user_id']
-            nickname = msg['nickname']
-            content = dumps_json(msg['msg'])
-            values.append((time, msg_id, user_id, nickname, content))
-        await conn.executemany(insert_query, values)
+        values = month_group_values.setdefault(get_month(msg['time']), {}).setdefault(msg['group_id'], [])
+        values.append((
+            msg['time'].timestamp(),
+            msg['msg_id'],
+            msg['user_id'],
+            msg['nickname'],
+            dumps_json(msg['msg']),
+        ))
+
+    for month, group_values in month_group_values.items():
+        path = await _get_writable_shard_path(month)
+        async with use_db(path) as db:
+            for group_id in group_values:
+                await db.ensure_table(group_id, create=True)
+            async with db.write_lock:
+                for group_id, values in group_values.items():
+                    insert_query = f'''
+                        INSERT INTO {MSG_TABLE_NAME.format(group_id)} (time, msg_id, user_id, nickname, content)
+                        VALUES (?, ?, ?, ?, ?)
+                    '''
+                    await db.conn.executemany(insert_query, values)
+                await db.conn.commit()
 
-    await conn.commit()
 
+# ============================ 查询 ============================ #
 
 # 消息表row转换为返回值
 def msg_row_to_ret(row):
@@ -94,94 +319,379 @@ def msg_row_to_ret(row):
         "msg": loads_json(row[5])
     }
 
+async def _query_rows(path: str, group_id: int, where: str = "", params: tuple = (), suffix: str = "") -> list[tuple]:
+    """
+    在单个数据库中查询某个群的消息行，表不存在时返回空列表
+    """
+    async with use_read_db(path) as db:
+        if not await db.ensure_table(group_id, create=False):
+            return []
+        query = f'''
+            SELECT {MSG_COLUMNS} FROM {MSG_TABLE_NAME.format(group_id)}
+            {where} {suffix}
+        '''
+        cursor = await db.conn.execute(query, params)
+        rows = await cursor.fetchall()
+        await cursor.close()
+        return rows
+
+async def _query_rows_merged(group_id: int, paths: list[str], where: str = "", params: tuple = ()) -> list[tuple]:
+    """
+    在多个数据库中查询并按时间升序合并
+    """
+    results = [await _query_rows(path, group_id, where, params, "ORDER BY time") for path in paths]
+    results = [rows for rows in results if rows]
+    if len(results) <= 1:
+        return results[0] if results else []
+    return list(heapq.merge(*results, key=lambda row: row[1]))
+
+def _get_range_timestamps(start_time: datetime, end_time: datetime) -> tuple[datetime, datetime]:
+    if start_time is None: start_time = datetime.fromtimestamp(0)
+    if end_time is None: end_time = datetime.fromtimestamp(9999999999)
+    return start_time, end_time
+
 # 获取消息表中的所有消息
 async def query_all_msg(group_id: int):
-    conn = await get_conn(group_id)
-    query = f'''
-        SELECT * FROM {MSG_TABLE_NAME.format(group_id)}
-    '''
-    cursor = await conn.execute(query)
-    rows = await cursor.fetchall()
-    await cursor.close()
+    rows = await _query_rows_merged(group_id, get_source_paths())
     logger.debug(f"获取 {MSG_TABLE_NAME.format(group_id)} 表中的所有消息 {len(rows)} 条")
     return [msg_row_to_ret(row) for row in rows]
 
 # 按时间范围获取消息表中的消息 None则不限制
 async def query_msg_by_range(group_id: int, start_time: datetime, end_time: datetime):
-    if start_time is None: start_time = datetime.fromtimestamp(0)
-    if end_time is None: end_time = datetime.fromtimestamp(9999999999)
-    conn = await get_conn(group_id)
-    query = f'''
-        SELECT * FROM {MSG_TABLE_NAME.format(group_id)}
-        WHERE time >= ? AND time <= ?
-    '''
-    cursor = await conn.execute(query, (start_time.timestamp(), end_time.timestamp()))
-    rows = await cursor.fetchall()
-    await cursor.close()
+    paths = get_source_paths(start_time, end_time)
+    start_time, end_time = _get_range_timestamps(start_time, end_time)
+    rows = await _query_rows_merged(group_id, paths, "WHERE time >= ? AND time <= ?", (start_time.timestamp(), end_time.timestamp()))
     logger.debug(f"获取 {MSG_TABLE_NAME.format(group_id)} 表中的 从 {start_time} 到 {end_time} 的消息 {len(rows)} 条")
     return [msg_row_to_ret(row) for row in rows]
 
+async def _query_latest_rows(group_id: int, time: datetime | None, limit: int) -> list[tuple]:
+    """
+    获取指定时间之前（None则不限制）的最近若干条消息行，按时间降序
+    """
+    where, params = ("WHERE time <= ?", (time.timestamp(),)) if time else ("", ())
+    paths = get_source_paths(end_time=time)
+    shard_paths = [p for p in paths if p != LEGACY_DB_PATH]
+    results = []
+    # 月分片之间时间不重叠，从最新的分片开始查询，数量足够时更早的分片不可能有更新的消息
+    count = 0
+    for path in reversed(shard_paths):
+        rows = await _query_rows(path, group_id, where, params + (limit,), "ORDER BY time DESC LIMIT ?")
+        results.append(rows)
+        count += len(rows)
+        if count >= limit:
+            break
+    # 旧数据库中的数据可能与迁移后的分片重叠，总是查询
+    if LEGACY_DB_PATH in paths:
+        results.append(await _query_rows(LEGACY_DB_PATH, group_id, where, params + (limit,), "ORDER BY time DESC LIMIT ?"))
+    results = [rows for rows in results if rows]
+    if len(results) == 1:
+        return results[0][:limit]
+    return list(itertools.islice(heapq.merge(*results, key=lambda row: row[1], reverse=True), limit))
+
 # 获取最近的若干条消息
 async def query_recent_msg(group_id: int, limit: int):
-    conn = await get_conn(group_id)
-    query = f'''
-        SELECT * FROM {MSG_TABLE_NAME.format(group_id)}
-        ORDER BY time DESC
-        LIMIT ?
-    '''
-    cursor = await conn.execute(query, (limit,))
-    rows = await cursor.fetchall()
-    await cursor.close()
+    rows = await _query_latest_rows(group_id, None, limit)
     logger.debug(f"获取 {MSG_TABLE_NAME.format(group_id)} 表中的 最近 {limit} 条消息 {len(rows)} 条")
     return [msg_row_to_ret(row) for row in rows]
 
 # 按时间范围计数
 async def query_msg_count(group_id: int, start_time: datetime, end_time: datetime, user_id: int=None):
-    if start_time is None: start_time = datetime.fromtimestamp(0)
-    if end_time is None: end_time = datetime.fromtimestamp(9999999999)
-    conn = await get_conn(group_id)
+    paths = get_source_paths(start_time, end_time)
+    start_time, end_time = _get_range_timestamps(start_time, end_time)
     if user_id is None:
-        query = f'''
-            SELECT COUNT(*) FROM {MSG_TABLE_NAME.format(group_id)}
-            WHERE time >= ? AND time <= ?
-        '''
-        cursor = await conn.execute(query, (start_time.timestamp(), end_time.timestamp()))
+        where = "WHERE time >= ? AND time <= ?"
+        params = (start_time.timestamp(), end_time.timestamp())
     else:
-        query = f'''
-            SELECT COUNT(*) FROM {MSG_TABLE_NAME.format(group_id)}
-            WHERE time >= ? AND time <= ? AND user_id = ?
-        '''
-        cursor = await conn.execute(query, (start_time.timestamp(), end_time.timestamp(), user_id))
-    rows = await cursor.fetchall()
-    await cursor.close()
+        where = "WHERE user_id = ? AND time >= ? AND time <= ?"
+        params = (user_id, start_time.timestamp(), end_time.timestamp())
+    count = 0
+    for path in paths:
+        async with use_read_db(path) as db:
+            if not await db.ensure_table(group_id, create=False):
+                continue
+            cursor = await db.conn.execute(f"SELECT COUNT(*) FROM {MSG_TABLE_NAME.format(group_id)} {where}", params)
+            rows = await cursor.fetchall()
+            await cursor.close()
+            count += rows[0][0]
     logger.debug(f"获取 {MSG_TABLE_NAME.format(group_id)} 表中的 从 {start_time} 到 {end_time} 的消息数")
-    return rows[0][0]
+    return count
 
 # 按用户名获取消息表中的消息
 async def query_msg_by_user_id(group_id: int, user_id: int):
-    conn = await get_conn(group_id)
-    query = f'''
-        SELECT * FROM {MSG_TABLE_NAME.format(group_id)}
-        WHERE user_id = ?
-    '''
-    cursor = await conn.execute(query, (user_id,))
-    rows = await cursor.fetchall()
-    await cursor.close()
+    rows = await _query_rows_merged(group_id, get_source_paths(), "WHERE user_id = ?", (user_id,))
     logger.debug(f"获取 {MSG_TABLE_NAME.format(group_id)} 表中的 用户 {user_id} 的消息 {len(rows)} 条")
     return [msg_row_to_ret(row) for row in rows]
 
 # 获取指定时间之前的若干条消息
 async def query_msg_before(group_id: int, time: datetime, limit: int):
-    conn = await get_conn(group_id)
-    query = f'''
-        SELECT * FROM {MSG_TABLE_NAME.format(group_id)}
-        WHERE time <= ?
-        ORDER BY time DESC
-        LIMIT ?
-    '''
-    cursor = await conn.execute(query, (time.timestamp(), limit))
-    rows = await cursor.fetchall()
-    await cursor.close()
+    rows = await _query_latest_rows(group_id, time, limit)
     logger.debug(f"获取 {MSG_TABLE_NAME.format(group_id)} 表中的 时间在 {time} 之前的 {limit} 条消息 {len(rows)} 条")
     return [msg_row_to_ret(row) for row in rows]
 
+
+# ============================ 流式查询 ============================ #
+
+# 返回值字段 -> 消息表列
+MSG_FIELD_COLUMNS = {
+    "id": "id",
+    "time": "time",
+    "msg_id": "msg_id",
+    "user_id": "user_id",
+    "nickname": "nickname",
+    "msg": "content",
+}
+
+class LazyMsgDict(dict):
+    """
+    流式查询返回的消息dict，msg字段在第一次通过下标或get访问时才解码
+    """
+    __slots__ = ('_content',)
+
+    def __init__(self, content: str | None = None, **kwargs):
+        super().__init__(**kwargs)
+        self._content = content
+
+    def __missing__(self, key):
+        if key == 'msg' and self._content is not None:
+            msg = self['msg'] = loads_json(self._content)
+            self._content = None
+            return msg
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try: return self[key]
+        except KeyError: return default
+
+async def _iter_rows(path: str, group_id: int, columns: str, conds: list[str], params: tuple, chunk_size: int) -> AsyncIterator[tuple]:
+    """
+    在单个数据库中按 (time, id) 升序分块查询消息行，每块单独查询，迭代过程中不占用连接
+    columns的前两列必须为id和time
+    """
+    last = None
+    while True:
+        where, where_params = list(conds), params
+        if last is not None:
+            where.append("(time > ? OR (time = ? AND id > ?))")
+            where_params += (last[1], last[1], last[0])
+        where = f"WHERE {' AND '.join(where)}" if where else ""
+        async with use_read_db(path) as db:
+            if not await db.ensure_table(group_id, create=False):
+                return
+            cursor = await db.conn.execute(f"""
+                SELECT {columns} FROM {MSG_TABLE_NAME.format(group_id)}
+                {where} ORDER BY time, id LIMIT ?
+            """, where_params + (chunk_size,))
+            rows = await cursor.fetchall()
+            await cursor.close()
+        for row in rows:
+            yield row
+        if len(rows) < chunk_size:
+            return
+        last = rows[-1]
+
+async def _merge_rows_by_time(iters: list[AsyncIterator[tuple]]) -> AsyncIterator[tuple]:
+    """
+    按时间升序合并多个数据库的消息行迭代器
+    """
+    heap = []
+    for i, it in enumerate(iters):
+        row = await anext(it, None)
+        if row is not None:
+            heap.append((row[1], i, row))
+    heapq.heapify(heap)
+    while heap:
+        _, i, row = heap[0]
+        yield row
+        nxt = await anext(iters[i], None)
+        if nxt is None:
+            heapq.heappop(heap)
+        else:
+            heapq.heapreplace(heap, (nxt[1], i, nxt))
+
+async def iter_msg(
+    group_id: int,
+    start_time: datetime = None,
+    end_time: datetime = None,
+    user_id: int = None,
+    fields: list[str] = None,
+    chunk_size: int = None,
+) -> AsyncIterator[dict]:
+    """
+    按时间升序流式获取消息，时间范围为None则不限制
+    fields指定返回的字段（默认全部，可选 id/time/msg_id/user_id/nickname/msg），
+    msg字段在访问时才解码，数据库每次只读取chunk_size条
+    """
+    if fields is None:
+        fields = list(MSG_FIELD_COLUMNS)
+    for field in fields:
+        assert field in MSG_FIELD_COLUMNS, f"未知的消息字段 {field}"
+    if chunk_size is None:
+        chunk_size = STREAM_CHUNK_SIZE_CFG.get(2000)
+    extra_fields = [f for f in fields if f not in ("id", "time")]
+    columns = ", ".join(["id", "time"] + [MSG_FIELD_COLUMNS[f] for f in extra_fields])
+    with_id, with_time = "id" in fields, "time" in fields
+
+    conds, params = [], ()
+    if start_time is not None:
+        conds.append("time >= ?")
+        params += (start_time.timestamp(),)
+    if end_time is not None:
+        conds.append("time <= ?")
+        params += (end_time.timestamp(),)
+    if user_id is not None:
+        conds.append("user_id = ?")
+        params += (user_id,)
+
+    paths = get_source_paths(start_time, end_time)
+    if not paths:
+        return
+    iters = [_iter_rows(path, group_id, columns, conds, params, chunk_size) for path in paths]
+    rows = iters[0] if len(iters) == 1 else _merge_rows_by_time(iters)
+    async for row in rows:
+        ret = LazyMsgDict()
+        if with_id: ret["id"] = row[0]
+        if with_time: ret["time"] = datetime.fromtimestamp(row[1])
+        for field, value in zip(extra_fields, row[2:]):
+            if field == "msg":
+                ret._content = value
+            else:
+                ret[field] = value
+        yield ret
+
+async def iter_msg_chunks(
+    group_id: int,
+    start_time: datetime = None,
+    end_time: datetime = None,
+    user_id: int = None,
+    fields: list[str] = None,
+    chunk_size: int = None,
+) -> AsyncIterator[list[dict]]:
+    """
+    同iter_msg，但每次返回最多chunk_size条消息的列表
+    """
+    if chunk_size is None:
+        chunk_size = STREAM_CHUNK_SIZE_CFG.get(2000)
+    chunk = []
+    async for msg in iter_msg(group_id, start_time, end_time, user_id, fields, chunk_size):
+        chunk.append(msg)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# ============================ 迁移和归档 ============================ #
+
+_legacy_tables: list[int] | None = None
+
+async def _get_legacy_tables(db: MsgDb) -> list[int]:
+    global _legacy_tables
+    if _legacy_tables is None:
+        cursor = await db.conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name LIKE 'msg_%'")
+        rows = await cursor.fetchall()
+        await cursor.close()
+        _legacy_tables = [int(row[0][4:]) for row in rows if row[0][4:].isdigit()]
+    return _legacy_tables
+
+async def _remove_legacy_db():
+    db = _dbs.pop(LEGACY_DB_PATH, None)
+    if db is not None:
+        await db.close()
+    for p in (LEGACY_DB_PATH, LEGACY_DB_PATH + '-wal', LEGACY_DB_PATH + '-shm'):
+        if os.path.exists(p):
+            os.remove(p)
+    logger.info(f"旧消息数据库已全部迁移到月分片，删除 {LEGACY_DB_PATH}")
+
+async def migrate_legacy_step() -> int:
+    """
+    将旧数据库中某个群最早一个月的一批消息迁移到对应的月分片，返回迁移的条数
+    分片中记录每个群已迁移的最大旧ID，与消息在同一事务中提交，
+    在删除旧数据前崩溃时不会重复迁移
+    """
+    batch = MIGRATE_ROWS_PER_STEP_CFG.get(20000)
+    if not batch or not os.path.exists(LEGACY_DB_PATH):
+        return 0
+    async with use_db(LEGACY_DB_PATH) as legacy:
+        tables = await _get_legacy_tables(legacy)
+        while tables:
+            group_id = tables[0]
+            table = MSG_TABLE_NAME.format(group_id)
+            await legacy.ensure_table(group_id, create=False)
+            cursor = await legacy.conn.execute(f"SELECT MIN(time) FROM {table}")
+            min_time = (await cursor.fetchone())[0]
+            await cursor.close()
+            if min_time is not None:
+                break
+            # 迁移完成的表
+            async with legacy.write_lock:
+                await legacy.conn.execute(f"DROP TABLE {table}")
+                await legacy.conn.commit()
+            legacy.created_tables.discard(group_id)
+            tables.pop(0)
+            logger.info(f"旧消息数据库中的 {table} 表迁移完成")
+    if not tables:
+        if legacy.users == 0:
+            await _remove_legacy_db()
+        return 0
+
+    month = get_month(datetime.fromtimestamp(min_time))
+    start_ts, end_ts = get_month_range(month)
+    path = await _get_writable_shard_path(month)
+    async with use_db(path) as shard, use_db(LEGACY_DB_PATH) as legacy:
+        await shard.ensure_table(group_id, create=True)
+        async with shard.write_lock:
+            await shard.conn.execute("CREATE TABLE IF NOT EXISTS legacy_migration (group_id INTEGER PRIMARY KEY, last_id INTEGER)")
+            cursor = await shard.conn.execute("SELECT last_id FROM legacy_migration WHERE group_id = ?", (group_id,))
+            row = await cursor.fetchone()
+            await cursor.close()
+            last_id = row[0] if row else 0
+            cursor = await legacy.conn.execute(f'''
+                SELECT {MSG_COLUMNS} FROM {table}
+                WHERE time >= ? AND time < ? AND id > ?
+                ORDER BY id LIMIT ?
+            ''', (start_ts, end_ts, last_id, batch))
+            rows = await cursor.fetchall()
+            await cursor.close()
+            if rows:
+                await shard.conn.executemany(f'''
+                    INSERT INTO {table} (time, msg_id, user_id, nickname, content)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', [row[1:] for row in rows])
+                last_id = rows[-1][0]
+                await shard.conn.execute("INSERT OR REPLACE INTO legacy_migration (group_id, last_id) VALUES (?, ?)", (group_id, last_id))
+                await shard.conn.commit()
+        async with legacy.write_lock:
+            await legacy.conn.execute(f"DELETE FROM {table} WHERE time >= ? AND time < ? AND id <= ?", (start_ts, end_ts, last_id))
+            await legacy.conn.commit()
+    logger.debug(f"迁移 {table} 表 {month} 的消息 {len(rows)} 条到月分片")
+    return len(rows)
+
+@repeat_with_interval(config.item('migrate_interval_seconds'), '迁移旧消息记录到月分片', logger)
+async def migrate_legacy_task():
+    await migrate_legacy_step()
+
+@repeat_with_interval(60 * 60, '归档消息记录月分片', logger)
+async def archive_shards_task():
+    months = ARCHIVE_AFTER_MONTHS_CFG.get(0)
+    # 旧数据迁移完成前较早的分片仍会被写入
+    if not months or os.path.exists(LEGACY_DB_PATH):
+        return
+    _load_shard_months()
+    now = datetime.now()
+    y, m = now.year, now.month - months
+    while m <= 0:
+        y, m = y - 1, m + 12
+    idle_seconds = ARCHIVE_IDLE_HOURS_CFG.get(24) * 3600
+    for month in sorted(_shard_months):
+        # 因查询而解压的分片在一段时间内不再被查询后才重新归档
+        if month < y * 100 + m and time.time() - _shard_read_times.get(month, 0) >= idle_seconds:
+            await archive_shard(month)
+
+@on_shutdown()
+async def _close_record_dbs():
+    for db in list(_dbs.values()):
+        try:
+            await db.close()
+        except:
+            logger.print_exc(f"关闭sqlite数据库 {db.path} 失败")
@@ -1,6 +1,8 @@
 from ..utils import *
 from .common import *
 import threading
+import mmap
+import numpy as np
 
 asset_config = Config('sekai.asset')
 ASSET_DEBUG_CFG = asset_config.item('debug')
@@ -63,6 +65,7 @@ class RegionMasterDbManager:
         self.latest_source = None
         self.version_update_interval = version_update_interval
         self.version_update_time = None
+        self.update_lock = asyncio.Lock()
 
     async def update(self):
         """
@@ -84,12 +87,21 @@ class RegionMasterDbManager:
                     self.latest_source.asset_version, last_asset_version
                 ))
     
+    def is_expired(self) -> bool:
+        """
+        版本信息是否需要重新获取
+        """
+        return not self.latest_source or datetime.now() - self.version_update_time > self.version_update_interval
+
     async def get_latest_source(self) -> RegionMasterDbSource:
         """
         获取最新的MasterDB
         """
-        if not self.latest_source or datetime.now() - self.version_update_time > self.version_update_interval:
-            await self.update()
+        if self.is_expired():
+            # 多个MasterData同时检查时只更新一次
+            async with self.update_lock:
+                if self.is_expired():
+                    await self.update()
         return self.latest_source
 
     async def get_all_sources(self, force_update=False) -> List[RegionMasterDbSource]:
@@ -124,24 +136,185 @@ class RegionMasterDbManager:
             )
         return cls._all_mgrs[region]
             
+MASTER_DB_COMPILED_FORMAT_VERSION = 1
+MASTERDATA_COMPILED_CFG = asset_config.item('compiled_masterdata')
+
+class CompiledMasterData:
+    """
+    编译后的MasterData，在下载或首次从json缓存加载时写入，之后以内存映射方式打开，
+    多个进程打开同一份文件时共享页缓存。按键查找时二分查找预排序的键数组，只解码命中的行
+    目录结构:
+    - meta.json: 格式版本、数据版本、行数、索引键和排序键
+    - rows.bin / offsets.npy: 逐行json拼接的行数据和行偏移(n+1)
+    - index.{key}.keys.npy / index.{key}.rows.npy: 排序后的键（整数键为int64，字符串键为定长字符串）和对应行号
+    - sort.{key}.npy: 按排序键排序后的行号
+    """
+    def __init__(self, path: str, meta: dict):
+        self.path = path
+        self.meta = meta
+        self.version: str = meta['version']
+        self.num: int = meta['num']
+        self.offsets: np.ndarray = np.load(pjoin(path, "offsets.npy"), mmap_mode='r')
+        self.rows: mmap.mmap | bytes = b""
+        if self.offsets[-1] > 0:
+            with open(pjoin(path, "rows.bin"), "rb") as f:
+                self.rows = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.indexes: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        for key in meta['index_keys']:
+            self.indexes[key] = (
+                np.load(pjoin(path, f"index.{key}.keys.npy"), mmap_mode='r'),
+                np.load(pjoin(path, f"index.{key}.rows.npy"), mmap_mode='r'),
+            )
+        self.sorts: Dict[str, np.ndarray] = {}
+        for key in meta['sort_keys']:
+            self.sorts[key] = np.load(pjoin(path, f"sort.{key}.npy"), mmap_mode='r')
+
+    @staticmethod
+    def compile(path: str, data: List[dict], version: str, index_keys: List[str], sort_keys: List[str]):
+        """
+        把数据编译到path目录，先写入临时目录再替换
+        """
+        tmp_path = path + ".tmp"
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+
+        offsets = np.zeros(len(data) + 1, dtype=np.int64)
+        with open(pjoin(tmp_path, "rows.bin"), "wb") as f:
+            for i, item in enumerate(data):
+                row = orjson.dumps(item)
+                f.write(row)
+                offsets[i + 1] = offsets[i] + len(row)
+        np.save(pjoin(tmp_path, "offsets.npy"), offsets)
+
+        compiled_index_keys = []
+        for key in index_keys:
+            pairs = [(item[key], i) for i, item in enumerate(data) if key in item]
+            values = [v for v, _ in pairs]
+            # 只编译类型一致的整数或字符串键，其他情况查找时回退到dict索引
+            if all(type(v) is int for v in values):
+                keys = np.array(values, dtype=np.int64)
+            elif all(type(v) is str for v in values):
+                keys = np.array(values, dtype=str)
+            else:
+                continue
+            rows = np.array([i for _, i in pairs], dtype=np.int64)
+            order = np.argsort(keys, kind='stable')
+            np.save(pjoin(tmp_path, f"index.{key}.keys.npy"), keys[order])
+            np.save(pjoin(tmp_path, f"index.{key}.rows.npy"), rows[order])
+            compiled_index_keys.append(key)
+
+        for key in sort_keys:
+            order = sorted(range(len(data)), key=lambda i: data[i].get(key))
+            np.save(pjoin(tmp_path, f"sort.{key}.npy"), np.array(order, dtype=np.int64))
+
+        dump_json({
+            'format_version': MASTER_DB_COMPILED_FORMAT_VERSION,
+            'version': version,
+            'num': len(data),
+            'config_index_keys': list(index_keys),
+            'index_keys': compiled_index_keys,
+            'sort_keys': list(sort_keys),
+        }, pjoin(tmp_path, "meta.json"))
+
+        # 已打开的旧文件在删除后仍然可以通过内存映射访问
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.rename(tmp_path, path)
+
+    @classmethod
+    def open(cls, path: str, version: str, index_keys: List[str], sort_keys: List[str]) -> Optional["CompiledMasterData"]:
+        """
+        打开编译后的数据，不存在或与当前版本、索引配置不一致时返回None
+        """
+        meta_path = pjoin(path, "meta.json")
+        if not os.path.exists(meta_path):
+            return None
+        meta = load_json(meta_path)
+        if meta.get('format_version') != MASTER_DB_COMPILED_FORMAT_VERSION \
+            or meta.get('version') != version \
+            or meta.get('config_index_keys') != list(index_keys) \
+            or meta.get('sort_keys') != list(sort_keys):
+            return None
+        return cls(path, meta)
+
+    def decode_row(self, i: int) -> dict:
+        return orjson.loads(self.rows[self.offsets[i]:self.offsets[i + 1]])
+
+    def decode_all(self) -> List[dict]:
+        offsets = self.offsets.tolist()
+        rows = self.rows
+        return [orjson.loads(rows[offsets[i]:offsets[i + 1]]) for i in range(self.num)]
+
+    def lookup(self, key: str, value: Any) -> Optional[np.ndarray]:
+        """
+        获取item[key]=value的行号（升序），key没有编译索引时返回None
+        """
+        if key not in self.indexes:
+            return None
+        keys, rows = self.indexes[key]
+        if keys.dtype.kind == 'i':
+            if isinstance(value, float) and value.is_integer():
+                value = int(value)
+            if type(value) is not int:
+                return rows[:0]
+        elif not isinstance(value, str):
+            return rows[:0]
+        l = np.searchsorted(keys, value, side='left')
+        r = np.searchsorted(keys, value, side='right')
+        return rows[l:r]
+
+
+
+@dataclass
+class MasterDataSnapshot:
+    """
+    某个区服MasterData的快照，更新时整体替换，读取时不需要加锁
+    完整数据、索引和排序在快照内按需构建并缓存
+    """
+    version: str
+    data: Any = None                                                # 使用编译数据时，完整数据在第一次获取时才解码
+    compiled: Optional[CompiledMasterData] = None
+    row_cache: Dict[int, Any] = field(default_factory=dict)        # 完整数据解码前按行解码的元素
+    indexed: Dict[str, Dict[Any, List[Any]]] = field(default_factory=dict)  # indexed['id'][id] = [item1, item2, ...]
+    sorted: Dict[str, List[Any]] = field(default_factory=dict)     # sorted[key] = [item1, item2, ...]
+
+@dataclass
+class MasterDataMetrics:
+    """
+    单个区服MasterData的访问统计
+    """
+    load_num: int = 0           # 从本地缓存加载或下载的次数
+    load_time: float = 0.       # 加载耗时（秒）
+    download_num: int = 0       # 下载次数
+    get_num: int = 0            # 获取完整数据/索引/排序的次数
+    lookup_num: int = 0         # 使用编译索引查找的次数
+    decode_row_num: int = 0     # 按行解码的行数
+    decode_all_num: int = 0     # 解码完整数据的次数
+    wait_num: int = 0           # 等待首次加载的次数
+    stale_num: int = 0          # 版本过期时返回旧数据并在后台更新的次数
+
+MASTERDATA_REFRESH_RETRY_INTERVAL_CFG = asset_config.item('masterdata_refresh_retry_interval')
+
 class MasterDataManager:
     """
     MasterData管理器，管理多个服务器的同一个MasterData资源
     使用 ```get(name)``` 方法获取对应资源的实例
+    读取使用当前快照，版本过期时先返回旧数据，在后台更新后替换快照
     """
     _all_mgrs = {}
 
     def __init__(self, name: str, build_indices: Optional[bool] = None):
         self.name = name
-        self.version = {}
-        self.data: Dict[str, Any] = {}
+        self.snapshots: Dict[str, MasterDataSnapshot] = {}
+        self.refresh_tasks: Dict[str, asyncio.Task] = {}
+        self.refresh_retry_time: Dict[str, datetime] = {}
+        self.metrics: Dict[str, MasterDataMetrics] = {}
         self.update_hooks = []
         self.map_fn = {}
         self.download_fn = {}
         self._set_index_keys(DEFAULT_INDEX_KEYS)
-        self.indexed_data: Dict[str, Dict[str, Dict[str, Any]]] = {}    # indexed_data[region]['id'][id] = [item1, item2, ...]
         self._set_sort_keys(DEFAULT_SORT_KEYS)
-        self.sorted_data: Dict[str, Dict[str, List[Any]]] = {}          # sorted_data[region][key] = [item1, item2, ...]
         self.lock = asyncio.Lock()
 
     def _set_index_keys(self, index_keys: Union[str, List[str], Dict[str, List[str]]]):
@@ -162,44 +335,109 @@ class MasterDataManager:
         create_folder(pjoin(MASTER_DB_CACHE_DIR, region))
         return pjoin(MASTER_DB_CACHE_DIR, region, f"{self.name}.json")
 
-    def _build_indexed_data(self, region: str):
+    def get_compiled_path(self, region: str) -> str:
+        create_folder(pjoin(MASTER_DB_CACHE_DIR, region))
+        return pjoin(MASTER_DB_CACHE_DIR, region, f"{self.name}.compiled")
+
+    def get_metrics(self, region: str) -> MasterDataMetrics:
+        if region not in self.metrics:
+            self.metrics[region] = MasterDataMetrics()
+        return self.metrics[region]
+
+    def _build_indexed_data(self, region: str, snapshot: MasterDataSnapshot, key: str):
         try:
-            if self.data.get(region, None) is None:
+            data = snapshot.data
+            if data is None:
                 logger.warning(f"MasterData [{region}.{self.name}] 构建索引发生在数据加载前")
                 return
-            if not self.data[region] or not isinstance(self.data[region], list):
+            if not data or not isinstance(data, list):
                 return
-            logger.debug(f"MasterData [{region}.{self.name}] 开始构建索引")
-            self.indexed_data[region] = {}
-            for key in self.index_keys.get(region, []):
-                ind = {}
-                for item in self.data[region]:
-                    if key not in item: 
-                        continue
-                    k = item[key]
-                    ind.setdefault(k, []).append(item)
-                if ind:
-                    self.indexed_data[region][key] = ind
-            logger.debug(f"MasterData [{region}.{self.name}] 构建索引成功")
+            logger.debug(f"MasterData [{region}.{self.name}] 开始构建 {key} 索引")
+            ind = {}
+            for item in data:
+                if key not in item: 
+                    continue
+                k = item[key]
+                ind.setdefault(k, []).append(item)
+            snapshot.indexed[key] = ind
+            logger.debug(f"MasterData [{region}.{self.name}] 构建 {key} 索引成功")
         except:
-            logger.print_exc(f"MasterData [{region}.{self.name}] 构建索引失败")
+            logger.print_exc(f"MasterData [{region}.{self.name}] 构建 {key} 索引失败")
 
-    def _build_sorted_data(self, region: str):
+    def _build_sorted_data(self, region: str, snapshot: MasterDataSnapshot, key: str):
         try:
-            if self.data.get(region, None) is None:
+            data = snapshot.data
+            if data is None:
                 logger.warning(f"MasterData [{region}.{self.name}] 构建排序发生在数据加载前")
                 return
-            if not self.data[region] or not isinstance(self.data[region], list):
+            if not data or not isinstance(data, list):
                 return
-            logger.debug(f"MasterData [{region}.{self.name}] 开始构建排序")
-            self.sorted_data[region] = {}
-            for key in self.sort_keys.get(region, []):
-                sorted_list = sorted(self.data[region], key=lambda x: x.get(key))
-                if sorted_list:
-                    self.sorted_data[region][key] = sorted_list
-            logger.debug(f"MasterData [{region}.{self.name}] 构建排序成功")
+            logger.debug(f"MasterData [{region}.{self.name}] 开始构建 {key} 排序")
+            if snapshot.compiled is not None and key in snapshot.compiled.sorts:
+                sorted_list = [data[i] for i in snapshot.compiled.sorts[key].tolist()]
+            else:
+                sorted_list = sorted(data, key=lambda x: x.get(key))
+            if sorted_list:
+                snapshot.sorted[key] = sorted_list
+            logger.debug(f"MasterData [{region}.{self.name}] 构建 {key} 排序成功")
+        except:
+            logger.print_exc(f"MasterData [{region}.{self.name}] 构建 {key} 排序失败")
+
+    async def _compile(self, region: str, version: str, data: Any) -> Optional[CompiledMasterData]:
+        """
+        编译数据并打开，数据不是dict列表、有映射函数或未启用时返回None
+        """
+        if not MASTERDATA_COMPILED_CFG.get(True):
+            return None
+        if self.map_fn.get('all', self.map_fn.get(region)):
+            return None
+        if not isinstance(data, list) or not all(isinstance(item, dict) for item in data):
+            return None
+        try:
+            path = self.get_compiled_path(region)
+            index_keys = self.index_keys.get(region, [])
+            sort_keys = self.sort_keys.get(region, [])
+            await run_in_pool(CompiledMasterData.compile, path, data, version, index_keys, sort_keys)
+            return await run_in_pool(CompiledMasterData.open, path, version, index_keys, sort_keys)
         except:
-            logger.print_exc(f"MasterData [{region}.{self.name}] 构建排序失败")
+            logger.print_exc(f"MasterData [{region}.{self.name}] 编译失败")
+            return None
+
+    async def _make_snapshot(self, region: str, version: str, data: Any, compiled: Optional[CompiledMasterData]) -> MasterDataSnapshot:
+        """
+        创建新的快照，有编译数据时丢弃已解码的数据，之后按需解码
+        """
+        if compiled is not None:
+            return MasterDataSnapshot(version=version, compiled=compiled)
+        map_fn = self.map_fn.get('all', self.map_fn.get(region))
+        if map_fn:
+            data = await run_in_pool(map_fn, data)
+            logger.info(f"MasterData [{region}.{self.name}] 映射函数执行完成")
+        return MasterDataSnapshot(version=version, data=data)
+
+    async def _materialize(self, region: str, snapshot: MasterDataSnapshot) -> Any:
+        """
+        获取快照的完整数据，使用编译数据时在第一次获取时解码
+        """
+        if snapshot.data is not None or snapshot.compiled is None:
+            return snapshot.data
+        data = await run_in_pool(snapshot.compiled.decode_all)
+        if snapshot.data is None:
+            # 保持已按行解码的元素与完整数据中的为同一对象
+            for i, item in snapshot.row_cache.items():
+                data[i] = item
+            snapshot.row_cache = {}
+            snapshot.data = data
+            self.get_metrics(region).decode_all_num += 1
+        return snapshot.data
+
+    def _get_row(self, region: str, snapshot: MasterDataSnapshot, i: int) -> Any:
+        if snapshot.data is not None:
+            return snapshot.data[i]
+        if i not in snapshot.row_cache:
+            snapshot.row_cache[i] = snapshot.compiled.decode_row(i)
+            self.get_metrics(region).decode_row_num += 1
+        return snapshot.row_cache[i]
 
     async def _load_from_cache(self, region: str):
         """
@@ -207,17 +445,23 @@ class MasterDataManager:
         """
         cache_path = self.get_cache_path(region)
         assert os.path.exists(cache_path), "缓存不存在"
-        versions = file_db.get_copy("master_data_cache_versions", {}).get(region, {})
+        versions = file_db.get_snapshot("master_data_cache_versions", {}).get(region, {})
         assert self.name in versions, "缓存版本无效"
-        self.version[region] = versions[self.name]
-        self.data[region] = await aload_json(cache_path)
+        version = versions[self.name]
+        compiled = None
+        if MASTERDATA_COMPILED_CFG.get(True) and not self.map_fn.get('all', self.map_fn.get(region)):
+            compiled = await run_in_pool(
+                CompiledMasterData.open, self.get_compiled_path(region), version,
+                self.index_keys.get(region, []), self.sort_keys.get(region, []),
+            )
+        if compiled is not None:
+            self.snapshots[region] = await self._make_snapshot(region, version, None, compiled)
+            logger.info(f"MasterData [{region}.{self.name}] 从本地编译数据加载成功")
+            return
+        data = await aload_json(cache_path)
         logger.info(f"MasterData [{region}.{self.name}] 从本地加载成功")
-        map_fn = self.map_fn.get('all', self.map_fn.get(region))
-        if map_fn:
-            self.data[region] = await run_in_pool(map_fn, self.data[region])
-            logger.info(f"MasterData [{region}.{self.name}] 映射函数执行完成")
-        await run_in_pool(self._build_indexed_data, region)
-        await run_in_pool(self._build_sorted_data, region)
+        compiled = await self._compile(region, version, data)
+        self.snapshots[region] = await self._make_snapshot(region, version, data, compiled)
 
     async def _download_from_db(self, region: str, source: RegionMasterDbSource):
         """
@@ -233,32 +477,29 @@ class MasterDataManager:
         timeout = asset_config.get('default_masterdata_download_timeout')
         async def _download():
             if not download_fn:
-                self.data[region] = await download_json(url)
+                return await download_json(url)
             else:
-                self.data[region] = await download_fn(source.base_url)
+                return await download_fn(source.base_url)
         try:
-            await asyncio.wait_for(_download(), timeout)
+            data = await asyncio.wait_for(_download(), timeout)
         except asyncio.TimeoutError:
             logger.warning(f"下载 MasterData [{region}.{self.name}] 超时")
             return
-        self.version[region] = source.version
+        version = source.version
+        self.get_metrics(region).download_num += 1
 
         # 缓存到本地
         versions = file_db.get("master_data_cache_versions", {})
         if region not in versions:
             versions[region] = {}
-        versions[region][self.name] = self.version[region]
+        versions[region][self.name] = version
         file_db.set("master_data_cache_versions", versions)
-        await adump_json(self.data[region], cache_path)
+        await adump_json(data, cache_path)
         logger.info(f"MasterData [{region}.{self.name}] 更新成功")
 
-        # 执行映射函数
-        map_fn = self.map_fn.get('all', self.map_fn.get(region))
-        if map_fn:
-            self.data[region] = await run_in_pool(map_fn, self.data[region])
-            logger.info(f"MasterData [{region}.{self.name}] 映射函数执行完成")
-        await run_in_pool(self._build_indexed_data, region)
-        await run_in_pool(self._build_sorted_data, region)
+        # 编译并替换快照（包含映射函数）
+        compiled = await self._compile(region, version, data)
+        self.snapshots[region] = await self._make_snapshot(region, version, data, compiled)
 
         # 执行更新后回调
         for name, hook, regions in self.update_hooks:
@@ -273,50 +514,151 @@ class MasterDataManager:
             except Exception as e:
                 logger.print_exc(f"MasterData [{region}.{self.name}] 更新后回调 [{name}] 执行失败")
 
-    async def _update_before_get(self, region: str):
+    def _is_outdated(self, region: str, snapshot: MasterDataSnapshot) -> bool:
+        """
+        快照是否可能需要更新（数据源版本信息过期或有更新的版本）
+        """
+        db_mgr = RegionMasterDbManager.get(region)
+        if db_mgr.is_expired():
+            return True
+        return get_version_order(snapshot.version) < get_version_order(db_mgr.latest_source.version)
+
+    async def _refresh(self, region: str, load_only: bool = False):
+        """
+        加载或更新快照，load_only时只从本地缓存加载（本地缓存不存在时仍然会下载）
+        """
         async with self.lock:
+            start_time = time.time()
+            loaded = False
             # 从缓存加载
-            if self.data.get(region) is None:
+            if region not in self.snapshots:
                 try: 
                     await self._load_from_cache(region)
+                    loaded = True
                 except Exception as e:
                     logger.warning(f"MasterData [{region}.{self.name}] 从本地缓存加载失败: {e}")
             # 检查是否更新
-            db_mgr = RegionMasterDbManager.get(region)
-            source = await db_mgr.get_latest_source()
-            if get_version_order(self.version.get(region, DEFAULT_VERSION)) < get_version_order(source.version):
-                await self._download_from_db(region, source)
-            # 检查是否存在，如果仍然不存在则报错
-            if self.data.get(region) is None:
+            if not (load_only and region in self.snapshots):
+                db_mgr = RegionMasterDbManager.get(region)
+                source = await db_mgr.get_latest_source()
+                snapshot = self.snapshots.get(region)
+                if not snapshot or get_version_order(snapshot.version) < get_version_order(source.version):
+                    await self._download_from_db(region, source)
+                    loaded = True
+                snapshot = self.snapshots.get(region)
+                if snapshot and get_version_order(snapshot.version) < get_version_order(source.version):
+                    self._delay_refresh_retry(region)
+            if loaded:
+                metrics = self.get_metrics(region)
+                metrics.load_num += 1
+                metrics.load_time += time.time() - start_time
+
+    def _delay_refresh_retry(self, region: str):
+        """
+        更新失败后一段时间内不再在后台重试
+        """
+        retry_interval = MASTERDATA_REFRESH_RETRY_INTERVAL_CFG.get(60)
+        self.refresh_retry_time[region] = datetime.now() + timedelta(seconds=retry_interval)
+
+    def _schedule_refresh(self, region: str):
+        """
+        在后台更新快照，同一时间只有一个更新任务
+        """
+        task = self.refresh_tasks.get(region)
+        if task is not None and not task.done():
+            return
+        if datetime.now() < self.refresh_retry_time.get(region, datetime.min):
+            return
+        async def refresh():
+            try:
+                await self._refresh(region)
+            except Exception as e:
+                logger.warning(f"MasterData [{region}.{self.name}] 后台更新失败: {get_exc_desc(e)}")
+                self._delay_refresh_retry(region)
+        self.refresh_tasks[region] = asyncio.create_task(refresh())
+
+    async def get_snapshot(self, region: str) -> MasterDataSnapshot:
+        """
+        获取当前快照，只有首次加载时需要等待
+        """
+        snapshot = self.snapshots.get(region)
+        if snapshot is None:
+            self.get_metrics(region).wait_num += 1
+            await self._refresh(region, load_only=True)
+            snapshot = self.snapshots.get(region)
+            if snapshot is None:
                 raise Exception(f"获取 MasterData [{region}.{self.name}] 的数据失败")
+        if self._is_outdated(region, snapshot):
+            self.get_metrics(region).stale_num += 1
+            self._schedule_refresh(region)
+        return snapshot
 
     async def get_data(self, region: str):
         """
         获取数据
         """
-        await self._update_before_get(region)
-        return self.data[region]
+        snapshot = await self.get_snapshot(region)
+        self.get_metrics(region).get_num += 1
+        return await self._materialize(region, snapshot)
     
     async def get_path(self, region: str):
         """
         获取数据文件路径
         """
-        await self._update_before_get(region)
+        await self.get_snapshot(region)
         return self.get_cache_path(region)
     
     async def get_indexed(self, region: str, key: str) -> Dict[str, Any]:
         """
         获取索引，如果key没有索引，返回None
         """
-        await self._update_before_get(region)
-        return self.indexed_data.get(region, {}).get(key)
+        snapshot = await self.get_snapshot(region)
+        self.get_metrics(region).get_num += 1
+        if key not in self.index_keys.get(region, []):
+            return None
+        if key not in snapshot.indexed:
+            await self._materialize(region, snapshot)
+            await run_in_pool(self._build_indexed_data, region, snapshot, key)
+        return snapshot.indexed.get(key) or None
     
     async def get_sorted(self, region: str, key: str) -> List[Any]:
         """
         获取排序后的数据，如果key没有排序，返回None
         """
-        await self._update_before_get(region)
-        return self.sorted_data.get(region, {}).get(key)
+        snapshot = await self.get_snapshot(region)
+        self.get_metrics(region).get_num += 1
+        if key not in self.sort_keys.get(region, []):
+            return None
+        if key not in snapshot.sorted:
+            await self._materialize(region, snapshot)
+            await run_in_pool(self._build_sorted_data, region, snapshot, key)
+        return snapshot.sorted.get(key)
+
+    async def find_compiled(self, region: str, key: str, values: List[Any]) -> Optional[List[Any]]:
+        """
+        使用编译索引查找item[key]在values中的元素，按values的顺序返回，同一个值的元素保持原顺序
+        没有编译数据或key没有编译索引时返回None
+        """
+        snapshot = await self.get_snapshot(region)
+        compiled = snapshot.compiled
+        if compiled is None or key not in compiled.indexes:
+            return None
+        self.get_metrics(region).lookup_num += 1
+        ret = []
+        for value in values:
+            ret.extend(self._get_row(region, snapshot, i) for i in compiled.lookup(key, value).tolist())
+        return ret
+
+    @classmethod
+    def get_all_metrics(cls) -> List[Tuple[str, str, MasterDataMetrics]]:
+        """
+        获取所有MasterData的访问统计 (名称, 区服, 统计)
+        """
+        return [
+            (name, region, metrics)
+            for name, mgr in cls._all_mgrs.items()
+            for region, metrics in mgr.metrics.items()
+        ]
 
     @classmethod
     def get(cls, name: str) -> "MasterDataManager":
@@ -329,7 +671,7 @@ class MasterDataManager:
         """
         注册更新后回调
         """
-        cls.get(name).update_hooks.append((hook_name, regions, hook))
+        cls.get(name).update_hooks.append((hook_name, hook, regions))
 
     @classmethod
     def updated_hook(cls, name: str, hook_name: str, regions='all'):
@@ -426,10 +768,12 @@ class RegionMasterDataWrapper:
         """
         查找item[key]=value的元素，mode=first/last/all
         """
-        # 使用indices优化
-        ind = await self.get_indexed(key)
-        if ind is not None:
-            ret = ind.get(value)
+        # 使用编译索引或indices优化
+        ret = await self.mgr.find_compiled(self.region, key, [value])
+        ind = await self.get_indexed(key) if ret is None else None
+        if ret is not None or ind is not None:
+            if ret is None:
+                ret = ind.get(value)
             if not ret: 
                 if mode == 'all': return []
                 else: return None
@@ -445,6 +789,10 @@ class RegionMasterDataWrapper:
         """
         收集item[key]在values中的所有元素
         """
+        # 使用编译索引
+        ret = await self.mgr.find_compiled(self.region, key, list(values))
+        if ret is not None:
+            return ret
         # 使用索引
         ind = await self.get_indexed(key)
         if ind is not None:
@@ -1012,6 +1360,8 @@ class RegionRipAssetManger:
                 if img_hash in self._img_cache_map:
                     img = self._img_cache_map[img_hash]
                 else:
+                    # 缓存的图片是共享且不会被修改的，附加指纹避免绘图缓存计算哈希时重复读取像素
+                    set_image_fingerprint(img, f"pixel:{img_hash}")
                     self._img_cache_map[img_hash] = img
                 self.cached_images[path] = img
             return img
@@ -1084,10 +1434,13 @@ class StaticImageRes:
                 img, time = self.images.get(path, (None, None))
                 mtime = int(os.path.getmtime(fullpath) * 1000)
                 if mtime != time:
-                    self.images[path] = (open_image(fullpath).convert('RGBA'), mtime)
+                    img = open_image(fullpath).convert('RGBA')
+                    self.images[path] = (set_image_fingerprint(img, f"static:{fullpath}:{mtime}"), mtime)
                 img, time = self.images[path]
                 if size:
-                    img = resize_by_optional_size(img, size)
+                    resized = resize_by_optional_size(img, size)
+                    if resized is not img:
+                        img = set_image_fingerprint(resized, f"{get_image_fingerprint(img)}>{resized.size}")
                 self.images[path] = (img, time) 
                 return self.images[path][0]
         except:
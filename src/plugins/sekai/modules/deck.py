@@ -143,6 +143,12 @@ def build_multiparts_payload(payloads: list[bytes]) -> bytes:
     payload = b''.join(payloads)
     return compress_zstd(payload)
 
+class DeckRecUserdataNotCached(Exception):
+    """
+    组卡后端没有对应的用户数据缓存
+    """
+    pass
+
 
 # ======================= 参数获取 ======================= #
 
@@ -1108,6 +1114,8 @@ async def do_deck_recommend_batch(
     # 通用请求函数
     async def req(payload: bytes, url: str) -> dict:
         async with get_client_session().post(url, data=payload) as resp:
+            if resp.status == 404 and url.endswith("/recommend"):
+                raise DeckRecUserdataNotCached("组卡服务端找不到对应的用户数据缓存")
             if resp.status != 200:
                 msg = f"{resp.status}: "
                 try:
@@ -1119,19 +1127,36 @@ async def do_deck_recommend_batch(
                 raise ReplyException(msg)
             return await resp.json()
 
-    # 用户数据负载
+    # 用户数据负载，后端按内容哈希缓存，已缓存时不重复上传
+    userdata_hash = get_md5(user_data)
     userdata_payload = []
     add_payload_segment(userdata_payload, user_data)
     userdata_payload = build_multiparts_payload(userdata_payload)
 
+    async def upload_userdata(url: str, check_cached: bool):
+        if check_cached:
+            async with get_client_session().head(url + f"/userdata/{userdata_hash}") as resp:
+                if resp.status == 200:
+                    return
+        await req(userdata_payload, url + "/cache_userdata")
+
     # 组卡请求数据，以及原始options_list的索引映射（用于结果归类）
-    recommend_data = { 'region': ctx.region, 'batch_options': [] }
+    # 单个组卡优先于批量组卡（歌曲比较等）执行，多算法组卡在最快的算法返回后限时等待其他算法
+    recommend_data = { 
+        'region': ctx.region, 
+        'batch_options': [], 
+        'priority': 0 if len(options_list) == 1 else 1,
+        'early_return_groups': [],
+    }
     original_indices = []
     for i, options in enumerate(options_list):
         if options.algorithm == "all": 
             algs = RECOMMEND_ALGS_CFG.get()
         else:
             algs = [options.algorithm]
+        if len(algs) > 1:
+            start = len(recommend_data['batch_options'])
+            recommend_data['early_return_groups'].append(list(range(start, start + len(algs))))
         for alg in algs:
             opt = options.to_dict()
             opt['algorithm'] = alg
@@ -1144,12 +1169,18 @@ async def do_deck_recommend_batch(
     for url, url_index in zip(urls, url_indices):
         # 向该后端缓存用户数据段
         try:
-            res = await req(userdata_payload, url + "/cache_userdata")
-            recommend_data['userdata_hash'] = res.get('userdata_hash')
+            await upload_userdata(url, check_cached=True)
+            recommend_data['userdata_hash'] = userdata_hash
             payload = []
             add_payload_segment(payload, dumps_json(recommend_data, indent=False).encode('utf-8'))
+            payload = build_multiparts_payload(payload)
             with ProfileTimer("deckrec.request"):
-                result_list = await req(build_multiparts_payload(payload), url + "/recommend")
+                try:
+                    result_list = await req(payload, url + "/recommend")
+                except DeckRecUserdataNotCached:
+                    # 检查后到请求前缓存被淘汰，重新上传后重试
+                    await upload_userdata(url, check_cached=False)
+                    result_list = await req(payload, url + "/recommend")
             break
         except Exception as e:
             logger.warning(f"组卡请求 {url} 失败: {get_exc_desc(e)}")
@@ -1165,7 +1196,9 @@ async def do_deck_recommend_batch(
     # 结果归类整理
     result_dict = {}
     for original_index, result in zip(original_indices, result_list):
-        result_dict.setdefault(original_index, []).append(result)
+        # 未在等待时间内完成的算法结果为空
+        if result is not None:
+            result_dict.setdefault(original_index, []).append(result)
     
     ret = []
     for index in range(len(options_list)):
@@ -312,6 +312,20 @@ async def _(ctx: SekaiHandlerContext):
     return await ctx.asend_reply_msg('使用"/挑战信息"和"/加成信息"查询相关内容')
 
 
+# MasterData访问统计
+pjsk_md_stats = CmdHandler(["/pjsk md stats", "/md统计"], logger)
+pjsk_md_stats.check_cdrate(cd).check_wblist(gbl).check_superuser()
+@pjsk_md_stats.handle()
+async def _(ctx: HandlerContext):
+    items = MasterDataManager.get_all_metrics()
+    assert_and_reply(items, "暂无MasterData访问记录")
+    items.sort(key=lambda x: x[2].get_num + x[2].lookup_num, reverse=True)
+    msg = "MasterData访问统计 (获取/查找/解码行/过期/加载耗时):\n"
+    for name, region, m in items[:20]:
+        msg += f"{region}.{name}: {m.get_num}/{m.lookup_num}/{m.decode_row_num}/{m.stale_num}/{m.load_time:.2f}s\n"
+    return await ctx.asend_reply_msg(msg.strip())
+
+
 # ======================= 定时通知 ======================= #
 
 # masterdata更新通知
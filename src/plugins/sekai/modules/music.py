@@ -18,6 +18,7 @@ from .profile import (
 from .event import extract_ban_event
 from .resbox import get_res_icon
 import rapidfuzz
+import numpy as np
 import pandas as pd
 
 
@@ -372,21 +373,157 @@ class MusicSearchResult:
     err_msg: str = None
 
 alias_mid_for_search: Dict[str, List[int]] = {}
+# 别名变化时递增，用于判断搜索索引是否过期
+alias_version_for_search: int = 0
 
 @MusicAliasDB.on_add()
 def add_music_alias_for_search(mid: int, alias: str):
-    global alias_mid_for_search
+    global alias_mid_for_search, alias_version_for_search
     alias = clean_name(alias)
     alias_mid_for_search.setdefault(alias, []).append(mid)
+    alias_version_for_search += 1
 
 @MusicAliasDB.on_remove()
 def remove_music_alias_for_search(mid: int, alias: str):
-    global alias_mid_for_search
+    global alias_mid_for_search, alias_version_for_search
     alias = clean_name(alias)
     if alias in alias_mid_for_search:
         alias_mid_for_search[alias].remove(mid)
         if not alias_mid_for_search[alias]:
             del alias_mid_for_search[alias]
+    alias_version_for_search += 1
+
+class MusicSearchIndex:
+    """
+    单个区服的歌曲搜索索引，包含清洗后的曲名/读音/翻译/别名、每首歌的难度位图以及名称的字符倒排索引
+    """
+    def __init__(self, signature: tuple, musics: List[dict], diffs: List[dict], cn_titles: dict, en_titles: dict, aliases: Dict[int, List[str]]):
+        self.signature = signature
+        self.musics = musics
+        diff_bits = { names[0]: 1 << i for i, names in enumerate(DIFF_NAMES) }
+        mid_diff_mask: Dict[int, int] = {}
+        for diff in diffs:
+            mid_diff_mask[diff['musicId']] = mid_diff_mask.get(diff['musicId'], 0) | diff_bits.get(diff['musicDifficulty'], 0)
+        self.diff_masks = np.array([mid_diff_mask.get(m['id'], 0) for m in musics], dtype=np.int64)
+
+        # 曲名（含翻译）精确匹配，保留musics中靠前的歌曲
+        self.title_idx: Dict[str, int] = {}
+        # 所有名称，同一首歌的名称连续存放
+        self.names: List[str] = []
+        name_music_idx: List[int] = []
+        self.music_name_start = np.zeros(len(musics), dtype=np.int64)
+        for i, music in enumerate(musics):
+            mid = music['id']
+            titles = [music['title'], cn_titles.get(str(mid)), en_titles.get(str(mid))]
+            for title in titles:
+                if title:
+                    self.title_idx.setdefault(clean_name(title), i)
+            names = set(titles + [music['pronunciation']] + aliases.get(mid, []))
+            names.discard(None)
+            self.music_name_start[i] = len(self.names)
+            for name in dict.fromkeys(clean_name(name) for name in names):
+                self.names.append(name)
+                name_music_idx.append(i)
+        self.name_music_idx = np.array(name_music_idx, dtype=np.int64)
+        self.name_lens = np.array([len(name) for name in self.names], dtype=np.float32)
+
+        # 字符 -> 包含该字符的名称下标集合，用于快速筛选子串匹配的候选
+        self.char_index: Dict[str, Set[int]] = {}
+        for i, name in enumerate(self.names):
+            for c in set(name):
+                self.char_index.setdefault(c, set()).add(i)
+
+    def find_title(self, clean_q: str) -> Optional[dict]:
+        i = self.title_idx.get(clean_q)
+        return self.musics[i] if i is not None else None
+
+    def _substring_name_ids(self, clean_q: str) -> List[int]:
+        """
+        获取包含clean_q的名称下标
+        """
+        if not clean_q:
+            return list(range(len(self.names)))
+        sets = []
+        for c in set(clean_q):
+            if c not in self.char_index:
+                return []
+            sets.append(self.char_index[c])
+        sets.sort(key=len)
+        cands = set.intersection(*sets) if len(sets) > 1 else sets[0]
+        return [i for i in cands if clean_q in self.names[i]]
+
+    def search(self, clean_q: str, diff: str = None, sim_threshold: float = 0.7, max_num: int = 4) -> List[Tuple[dict, float]]:
+        """
+        子串/编辑距离匹配，每首歌的相似度取其所有名称的最大值：
+        子串匹配时为 1 + 查询长度 / 名称长度（目标串越短越好），否则为编辑距离相似度
+        返回相似度大于阈值的前max_num首歌曲及相似度
+        """
+        if not self.names:
+            return []
+        sims = rapidfuzz.process.cdist(
+            [clean_q], self.names,
+            scorer=rapidfuzz.fuzz.ratio,
+            score_cutoff=max(0., sim_threshold * 100),
+            dtype=np.float32,
+        )[0] / 100.0
+        sub_ids = self._substring_name_ids(clean_q)
+        if sub_ids:
+            sub_ids = np.array(sub_ids, dtype=np.int64)
+            lens = self.name_lens[sub_ids]
+            sims[sub_ids] = 1.0 + np.divide(len(clean_q), lens, out=np.zeros_like(lens), where=lens > 0)
+
+        music_sims = np.full(len(self.musics), -np.inf, dtype=np.float32)
+        np.maximum.at(music_sims, self.name_music_idx, sims)
+        if diff:
+            for i, names in enumerate(DIFF_NAMES):
+                if names[0] == diff:
+                    music_sims[(self.diff_masks >> i & 1) == 0] = -np.inf
+                    break
+            else:
+                return []
+        idxs = np.nonzero(music_sims > sim_threshold)[0]
+        idxs = idxs[np.argsort(-music_sims[idxs], kind='stable')][:max_num]
+        return [(self.musics[i], float(music_sims[i])) for i in idxs]
+
+_music_search_indexes: Dict[str, MusicSearchIndex] = {}
+_music_search_index_locks: Dict[str, asyncio.Lock] = {}
+
+async def get_music_search_index(ctx: SekaiHandlerContext) -> MusicSearchIndex:
+    """
+    获取区服的歌曲搜索索引，MasterData、翻译或别名变化后在下次获取时重建
+    """
+    musics = await ctx.md.musics.get()
+    diffs = await ctx.md.music_diffs.get()
+    cn_titles = await music_cn_titles.get()
+    en_titles = await music_en_titles.get()
+    # MasterData更新后数据列表会被替换，因此用对象本身判断
+    signature = (musics, diffs, music_cn_titles.hash, music_en_titles.hash, alias_version_for_search)
+
+    def is_valid(index: Optional[MusicSearchIndex]) -> bool:
+        if index is None:
+            return False
+        return index.signature[0] is musics and index.signature[1] is diffs and index.signature[2:] == signature[2:]
+
+    index = _music_search_indexes.get(ctx.region)
+    if is_valid(index):
+        return index
+    async with _music_search_index_locks.setdefault(ctx.region, asyncio.Lock()):
+        index = _music_search_indexes.get(ctx.region)
+        if is_valid(index):
+            return index
+        start_time = time.time()
+        alias_db = MusicAliasDB.get_instance()
+        aliases = { music['id']: alias_db.get_aliases(music['id']) for music in musics }
+        index = await run_in_pool(MusicSearchIndex, signature, musics, diffs, cn_titles, en_titles, aliases)
+        _music_search_indexes[ctx.region] = index
+        logger.info(f"构建 {ctx.region} 歌曲搜索索引完成: {len(musics)}首歌曲 {len(index.names)}个名称 耗时{time.time() - start_time:.3f}s")
+        return index
+
+@MasterDataManager.updated_hook("musics", "清除歌曲搜索索引")
+@MasterDataManager.updated_hook("musicDifficulties", "清除歌曲搜索索引")
+async def _clear_music_search_index(region: str):
+    # 回调在MasterData的锁内执行，不能在这里获取数据重建，留到下次搜索时重建
+    _music_search_indexes.pop(region, None)
 
 # 根据参数查询曲目
 async def search_music(ctx: SekaiHandlerContext, query: str, options: MusicSearchOptions = None) -> MusicSearchResult:
@@ -406,8 +543,6 @@ async def search_music(ctx: SekaiHandlerContext, query: str, options: MusicSearc
     diff = options.diff
     musics = await ctx.md.musics.get()
 
-    alias_db = MusicAliasDB.get_instance()
-
     ret_musics: List[dict] = []
     sims: List[float] = None
     search_type: str = None
@@ -501,19 +636,14 @@ async def search_music(ctx: SekaiHandlerContext, query: str, options: MusicSearc
     # 曲名精确匹配
     if not search_type and options.use_title:
         start_time = time.time()
-        for music in musics:
-            titles = [clean_name(music['title'])]
-            if cn_title := await get_music_trans_title(music['id'], 'cn'):
-                titles.append(clean_name(cn_title))
-            if en_title := await get_music_trans_title(music['id'], 'en'):
-                titles.append(clean_name(en_title))
-            if clean_q in titles:
-                search_type = "title"
-                if diff and not await check_music_has_diff(ctx, music['id'], diff):
-                    err_msg = f"名称为\"{query}\"的{region_name}歌曲没有{diff}难度"
-                else:
-                    ret_musics.append(music)
-                break
+        search_index = await get_music_search_index(ctx)
+        music = search_index.find_title(clean_q)
+        if music:
+            search_type = "title"
+            if diff and not await check_music_has_diff(ctx, music['id'], diff):
+                err_msg = f"名称为\"{query}\"的{region_name}歌曲没有{diff}难度"
+            else:
+                ret_musics.append(music)
         if options.debug:
             log(f"曲名精确匹配耗时: {time.time() - start_time:.4f}s")
 
@@ -535,39 +665,8 @@ async def search_music(ctx: SekaiHandlerContext, query: str, options: MusicSearc
     # 编辑距离匹配
     if not search_type and options.use_distance:
         start_time = time.time()
-        
-        music_sims = []
-        for music in musics:
-            if diff and not await check_music_has_diff(ctx, music['id'], diff):
-                continue
-            names = set()
-            names.add(music['title'])
-            names.add(music['pronunciation'])
-            if cn_title := await get_music_trans_title(music['id'], 'cn'):
-                names.add(cn_title)
-            if en_title := await get_music_trans_title(music['id'], 'en'):
-                names.add(en_title)
-            for alias in alias_db.get_aliases(music['id']):
-                names.add(alias)
-            min_dist = 1e9
-            for name in names:
-                name = clean_name(name)
-                dist = 1e9
-                # 首先判断是否为子串
-                if clean_q in name:
-                    dist = -len(clean_q) / len(name) if len(name) else 0 # 目标串越短越好
-                else:
-                    dist = 1.0 - rapidfuzz.fuzz.ratio(clean_q, name) / 100.0
-                min_dist = min(min_dist, dist)
-            # 计算相似度
-            if min_dist < 0:
-                sim = 1.0 + 1.0 * -min_dist  # 子串匹配长度相同时相似度为2.0
-            else:
-                sim = 1.0 - min_dist
-            if sim > options.distance_sim_threshold:
-                music_sims.append((music, sim))
-        music_sims.sort(key=lambda x: x[1], reverse=True)
-        music_sims = music_sims[:options.max_num]
+        search_index = await get_music_search_index(ctx)
+        music_sims = search_index.search(clean_q, diff, options.distance_sim_threshold, options.max_num)
         if music_sims:
             search_type = "distance"
             ret_musics = [m[0] for m in music_sims]
@@ -999,10 +1098,7 @@ async def check_music_has_diff(ctx: SekaiHandlerContext, mid: int, diff: str) ->
 # 根据曲名语义查询歌曲 返回歌曲列表和相似度
 async def query_music_by_emb(ctx: SekaiHandlerContext, text: str, limit: int=5):
     await update_music_name_embs(ctx)
-    def filter(key: str):
-        _, t, _ = key.split()
-        return t in ['cn_trans', 'en_trans', ctx.region]
-    query_result = await music_name_retriever.find(text, limit, filter=filter)
+    query_result = await music_name_retriever.find(text, limit, tags=['cn_trans', 'en_trans', ctx.region])
     ids = [int(item[0].split()[0]) for item in query_result]
     result_musics = await ctx.md.musics.collect_by_ids(ids)
     scores = [item[1] for item in query_result]
@@ -982,7 +982,7 @@ async def compose_mysekai_res_image(ctx: SekaiHandlerContext, qid: int, show_har
         add_watermark(canvas2, text=DEFAULT_WATERMARK_CFG.get() + ", map view from MiddleRed")
 
     with ProfileTimer("msr.get_imgs"):
-        return await asyncio.gather(canvas.get_img(), canvas2.get_img())
+        return await Canvas.get_imgs([canvas, canvas2])
 
 # 获取mysekai家具类别的名称和图片
 async def get_mysekai_fixture_genre_name_and_image(ctx: SekaiHandlerContext, gid: int, is_main_genre: bool) -> Tuple[str, Image.Image]:
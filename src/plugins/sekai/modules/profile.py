@@ -107,7 +107,10 @@ async def get_card_full_thumbnail(
     if not pcard:
         image_type = "after_training" if after_training else "normal"
         cache_path = f"{SEKAI_ASSET_DIR}/card_full_thumbnail/{ctx.region}/{cid}_{image_type}.png"
-        try: return open_image(cache_path)
+        try: 
+            img = open_image(cache_path)
+            # 卡面缩略图只被用于粘贴，附加指纹避免绘图缓存计算哈希时重复读取像素
+            return set_image_fingerprint(img, f"file:{cache_path}:{os.path.getmtime(cache_path)}")
         except: pass
 
     img = await get_card_thumbnail(ctx, cid, after_training, high_res=high_res)
@@ -470,7 +473,7 @@ async def verify_user_game_account(ctx: SekaiHandlerContext, triggered_by_not_ve
 
 # 获取用户验证过的游戏ID列表
 def get_user_verified_uids(ctx: SekaiHandlerContext) -> List[str]:
-    return profile_db.get_copy(f"verify_accounts_{ctx.region}", {}).get(str(ctx.user_id), [])
+    return list(profile_db.get_snapshot(f"verify_accounts_{ctx.region}", {}).get(str(ctx.user_id), []))
 
 # 获取游戏id并检查用户是否验证过当前的游戏id，失败抛出异常
 async def get_uid_and_check_verified(ctx: SekaiHandlerContext, force: bool = False) -> str:
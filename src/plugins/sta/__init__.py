@@ -1,6 +1,7 @@
 from ..utils import *
 from .draw import draw_sta, reset_jieba, draw_date_count_plot, draw_word_count_plot, draw_sta_sum
-from ..record.sql import query_msg_by_range, query_msg_count
+from ..record.sql import iter_msg
+from .sql import query_sta_data, query_day_counts
 
 
 config = Config("sta")
@@ -24,17 +25,12 @@ STA_WORD_TOPK_CFG = config.item('sta_word_topk')
 # 获取某天统计图数据
 async def get_day_statistic(group_id, date=None):
     if date is None: date = datetime.now().strftime("%Y-%m-%d")
-    start_time = datetime.strptime(date, "%Y-%m-%d").strftime("%Y-%m-%d 00:00:00")
-    end_time   = datetime.strptime(date, "%Y-%m-%d").strftime("%Y-%m-%d 23:59:59")
-    recs = await query_msg_by_range(group_id, 
-                     datetime.strptime(start_time, "%Y-%m-%d %H:%M:%S"), 
-                     datetime.strptime(end_time, "%Y-%m-%d %H:%M:%S"))
-    logger.info(f'获取{date}的统计图: 共获取到{len(recs)}条消息')
-    if len(recs) == 0: return f"{date} 的消息记录为空"
+    day = datetime.strptime(date, "%Y-%m-%d")
+    data = await query_sta_data(group_id, day, day)
+    logger.info(f'获取{date}的统计图: 共统计到{data.total}条消息')
+    if data.total == 0: return f"{date} 的消息记录为空"
     # 统计发言数
-    user_count = Counter()
-    for rec in recs: user_count.inc(rec['user_id'])
-    sorted_user_count = sorted(user_count.items(), key=lambda x: x[1], reverse=True)
+    sorted_user_count = sorted(data.user_count.items(), key=lambda x: x[1], reverse=True)
     # 计算出需要的topk
     need_k = len(sorted_user_count)
     topk_user = [user for user, _ in sorted_user_count[:need_k]]
@@ -48,24 +44,18 @@ async def get_day_statistic(group_id, date=None):
             topk_name.append(str(user))
     # 发送图片
     return await get_image_cq(
-        await draw_sta(group_id, recs, PLOT_INTERVAL_CFG.get(), PLOT_TOPK1_CFG.get(), PLOT_TOPK2_CFG.get(), topk_user, topk_name, date),
+        await draw_sta(group_id, data, PLOT_INTERVAL_CFG.get(), PLOT_TOPK1_CFG.get(), PLOT_TOPK2_CFG.get(), topk_user, topk_name, date),
     )
 
 # 获取长时间统计数据
 async def get_long_statistic(group_id, start_date: datetime, end_date: datetime):
-    start_time = start_date.strftime("%Y-%m-%d 00:00:00")
-    end_time   = end_date.strftime("%Y-%m-%d 23:59:59")
-    start_time = datetime.strptime(start_time, "%Y-%m-%d %H:%M:%S")
-    end_time   = datetime.strptime(end_time, "%Y-%m-%d %H:%M:%S")
-    recs = await query_msg_by_range(group_id, start_time, end_time)
-    logger.info(f'绘制从{start_date}到{end_date}的长时间统计图: 共获取到{len(recs)}条消息')
+    data = await query_sta_data(group_id, start_date, end_date)
+    logger.info(f'绘制从{start_date}到{end_date}的长时间统计图: 共统计到{data.total}条消息')
 
-    if len(recs) == 0: return f"从{start_date}到{end_date}的消息记录为空"
+    if data.total == 0: return f"从{start_date}到{end_date}的消息记录为空"
 
     # 统计发言数
-    user_count = Counter()
-    for rec in recs: user_count.inc(rec['user_id'])
-    sorted_user_count = sorted(user_count.items(), key=lambda x: x[1], reverse=True)
+    sorted_user_count = sorted(data.user_count.items(), key=lambda x: x[1], reverse=True)
     # 计算出需要的topk
     need_k = len(sorted_user_count)
     topk_user = [user for user, _ in sorted_user_count[:need_k]]
@@ -80,29 +70,19 @@ async def get_long_statistic(group_id, start_date: datetime, end_date: datetime)
     # 画图
     date = f"{start_date.strftime('%Y-%m-%d')}~{end_date.strftime('%Y-%m-%d')}"
     return await get_image_cq(
-        await draw_sta_sum(group_id, recs, PLOT_INTERVAL_CFG.get(), PLOT_TOPK1_CFG.get(), PLOT_TOPK2_CFG.get(), topk_user, topk_name, date),
+        await draw_sta_sum(group_id, data, PLOT_INTERVAL_CFG.get(), PLOT_TOPK1_CFG.get(), PLOT_TOPK2_CFG.get(), topk_user, topk_name, date),
     )
 
 # 获取总消息量关于时间的统计图数据
 async def get_date_count_statistic(group_id, days, user_id=None):
     t = datetime.now()
-    dates, counts = [], []
-    user_counts = None if user_id is None else []
-    for i in range(days):
-        date = (t - timedelta(days=i)).strftime("%Y-%m-%d")
-        start_time = datetime.strptime(date, "%Y-%m-%d").strftime("%Y-%m-%d 00:00:00")
-        end_time   = datetime.strptime(date, "%Y-%m-%d").strftime("%Y-%m-%d 23:59:59")
-        cnt = await query_msg_count(group_id, 
-                         datetime.strptime(start_time, "%Y-%m-%d %H:%M:%S"), 
-                         datetime.strptime(end_time, "%Y-%m-%d %H:%M:%S"))
-        if user_id is not None:
-            user_cnt = await query_msg_count(group_id,
-                                datetime.strptime(start_time, "%Y-%m-%d %H:%M:%S"), 
-                                datetime.strptime(end_time, "%Y-%m-%d %H:%M:%S"),
-                                user_id)
-            user_counts.append(user_cnt)
-        dates.append(datetime.strptime(start_time, "%Y-%m-%d %H:%M:%S"))
-        counts.append(cnt)
+    dates = [datetime.strptime((t - timedelta(days=i)).strftime("%Y-%m-%d"), "%Y-%m-%d") for i in range(days)]
+    day_counts = await query_day_counts(group_id, dates[-1], dates[0])
+    counts = [day_counts.get(date, 0) for date in dates]
+    user_counts = None
+    if user_id is not None:
+        user_day_counts = await query_day_counts(group_id, dates[-1], dates[0], user_id)
+        user_counts = [user_day_counts.get(date, 0) for date in dates]
     with TempFilePath(".png") as save_path:
         draw_date_count_plot(dates, counts, save_path, user_counts)
         return await get_image_cq(save_path)
@@ -111,22 +91,17 @@ async def get_date_count_statistic(group_id, days, user_id=None):
 async def get_word_statistic(group_id, days, word):
     words = word.split('，') if '，' in word else word.split(',')
     t = datetime.now()
-    dates = []
+    dates = [datetime.strptime((t - timedelta(days=i)).strftime("%Y-%m-%d"), "%Y-%m-%d") for i in range(days)]
     user_counts = Counter()
     user_date_counts = [Counter() for _ in range(days)]
-    for i in range(days):
-        date = (t - timedelta(days=i)).strftime("%Y-%m-%d")
-        start_time = datetime.strptime(date, "%Y-%m-%d").strftime("%Y-%m-%d 00:00:00")
-        end_time   = datetime.strptime(date, "%Y-%m-%d").strftime("%Y-%m-%d 23:59:59")
-        msgs = await query_msg_by_range(group_id,
-                         datetime.strptime(start_time, "%Y-%m-%d %H:%M:%S"), 
-                         datetime.strptime(end_time, "%Y-%m-%d %H:%M:%S"))
-        for msg in msgs:
-            text = extract_text(msg['msg'])
-            if any([word in text for word in words]):
-                user_counts.inc(str(msg['user_id']))
-                user_date_counts[i].inc(str(msg['user_id']))
-        dates.append(datetime.strptime(start_time, "%Y-%m-%d %H:%M:%S"))
+    # 分词结果与上下文有关（如"苹果汁"分为"苹果/汁"），词频预聚合表无法得到子串匹配的结果，因此扫描原始消息（每条消息只计一次）
+    end_time = dates[0] + timedelta(days=1) - timedelta(microseconds=1)
+    async for msg in iter_msg(group_id, dates[-1], end_time, fields=['time', 'user_id', 'msg']):
+        text = extract_text(msg['msg'])
+        if any([word in text for word in words]):
+            i = (dates[0] - datetime.strptime(msg['time'].strftime("%Y-%m-%d"), "%Y-%m-%d")).days
+            user_counts.inc(str(msg['user_id']))
+            user_date_counts[i].inc(str(msg['user_id']))
     sorted_user_counts = sorted(user_counts.items(), key=lambda x: x[1], reverse=True)
     topk_user = [str(user) for user, _ in sorted_user_counts[:STA_WORD_TOPK_CFG.get()]]
     topk_name = []
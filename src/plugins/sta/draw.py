@@ -22,6 +22,19 @@ matplotlib.rcParams['font.family'] = [FONT_NAME]
 matplotlib.rcParams['axes.unicode_minus'] = False   
 
 
+# 统计图所需的聚合数据，由预聚合表（sta/sql.py）查询得到
+@dataclass
+class StaData:
+    total: int = 0
+    user_count: dict[int, int] = field(default_factory=dict)            # 用户 -> 消息数
+    user_image_count: dict[int, int] = field(default_factory=dict)      # 用户 -> 图片消息数
+    minute_count: dict[int, int] = field(default_factory=dict)          # 时间槽起始分钟 -> 消息数
+    minute_image_count: dict[int, int] = field(default_factory=dict)    # 时间槽起始分钟 -> 图片消息数
+    day_count: dict[datetime, int] = field(default_factory=dict)        # 日期 -> 消息数
+    word_count: dict[str, int] = field(default_factory=dict)            # 名词 -> 出现次数
+    word_user_count: dict[str, dict[int, int]] = field(default_factory=dict)  # 名词 -> 用户 -> 出现次数
+
+
 def get_colors():
     cmap = plt.get_cmap('Set3')
     colors = [cmap(i) for i in range(cmap.N) if i not in [9]]
@@ -63,28 +76,22 @@ def get_cmap(gid, date, n=10, hue_range=0.2):
     return ret
 
 # 饼图Frame控件
-async def get_pie_frame(gid, date_str, recs, topk_user: list[int], topk_name: list[int]) -> Frame:
+async def get_pie_frame(gid, date_str, data: StaData, topk_user: list[int], topk_name: list[int]) -> Frame:
     logger.info(f"开始绘制饼图")
     bot = await aget_group_bot(gid, raise_exc=False)
 
     # 统计数量
     topk_user_set = set(topk_user)
-    user_count, user_image_count = Counter(), Counter()
     other_count, other_image_count = 0, 0
     other_users = set()
-    for rec in recs:
-        if rec['user_id'] not in topk_user_set:
-            other_count += 1
-            other_users.add(int(rec['user_id']))
-            if has_image(rec['msg']):
-                other_image_count += 1
-        else:
-            user_count.inc(rec['user_id'])
-            if has_image(rec['msg']):
-                user_image_count.inc(rec['user_id'])
-
-    topk_user_count = [user_count.get(user) for user in topk_user]
-    topk_user_image_count = [user_image_count.get(user) for user in topk_user]
+    for user, count in data.user_count.items():
+        if user not in topk_user_set:
+            other_count += count
+            other_users.add(int(user))
+            other_image_count += data.user_image_count.get(user, 0)
+
+    topk_user_count = [data.user_count.get(user, 0) for user in topk_user]
+    topk_user_image_count = [data.user_image_count.get(user, 0) for user in topk_user]
     total_count = sum(topk_user_count) + other_count
     
     # 计算其他数量（比例小于多少的用户并入其他）
@@ -173,36 +180,21 @@ async def get_pie_frame(gid, date_str, recs, topk_user: list[int], topk_name: li
     return frame
 
 # 绘制折线图
-def draw_plot(gid, date_str, ax, recs, interval, topk_user, topk_name):
+def draw_plot(gid, date_str, ax, data: StaData, interval, topk_user, topk_name):
     logger.log(f"开始绘制折线图")
-    topk = len(topk_user)
-    cnts = [[0] * int(24*60/interval) for _ in range(topk + 1)]
     all = [0] * int(24*60/interval)
     img_all = [0] * int(24*60/interval)
 
-    for rec in recs:
-        time = rec['time']
-        minute = time.hour * 60 + time.minute
+    for minute, count in data.minute_count.items():
         index = int(minute / interval)
-        if rec['user_id'] in topk_user:
-            cnts[topk_user.index(rec['user_id'])][index] += 1
-        else:
-            cnts[-1][index] += 1
-        all[index] += 1
-        if has_image(rec['msg']):
-            img_all[index] += 1
+        all[index] += count
+        img_all[index] += data.minute_image_count.get(minute, 0)
 
     x = [datetime.strptime("00:00", "%H:%M") + timedelta(minutes=interval*i) for i in range(int(24*60/interval))]
 
     ax.bar(x[1:-1], all[1:-1], width=timedelta(minutes=interval), align='edge', color='#bbbbbb', label='消息数')
     ax.bar(x[1:-1], img_all[1:-1], width=timedelta(minutes=interval), align='edge', color='#dddddd', label='图片消息数')
 
-    # cmap = get_cmap(gid, date_str)
-    # for i in range(0, topk):
-    #     offset = timedelta(minutes=interval) / 2
-    #     tx = [xi + offset for xi in x[1:-1]]
-    #     ax.plot(tx, cnts[i][1:-1], label=topk_name[i], linewidth=0.7, color=cmap[i])
-
     ax.xaxis.set_major_locator(mdates.HourLocator(interval=1))
     ax.xaxis.set_major_formatter(mdates.DateFormatter('%k'))
     plt.xticks(fontsize=8)
@@ -240,35 +232,28 @@ def init_jieba():
     global jieba_inited
     if not jieba_inited: reset_jieba()
 
+# 分词 返回长度大于1或者是用户词的词以及是否为名词（用户词视为名词）
+def cut_words(text: str, userwords: set[str]) -> list[tuple[str, bool]]:
+    ret = []
+    for word, flag in pseg.cut(text):
+        if word in userwords:
+            ret.append((word, True))
+        elif len(word) > 1:
+            ret.append((word, flag.startswith('n')))
+    return ret
+
 # 绘制词云图 返回图片和前WORD_TOPK个词的前WORD_USER_TOPK个用户以及他们的比例文本
-def draw_wordcloud(gid, date_str, recs, users, names) -> Tuple[Image.Image, str]:
+def draw_wordcloud(gid, date_str, data: StaData, users, names) -> Tuple[Image.Image, str]:
     logger.info(f"开始绘制词云图")
-    init_jieba()
 
-    userwords = set(file_db.get("userwords", []))
     stopwords = set(file_db.get("stopwords", []))
 
     all_words = { " ": 1 }
     word_user_count = {} # word_user_count[word][user] = count
-
-    for rec in recs:
-        msg = extract_text(rec['msg'])
-        words = pseg.cut(msg)
-        nouns = []
-        for word, flag in words:
-            if word in userwords:
-                nouns.append(word)
-            elif flag.startswith('n') and word not in stopwords and len(word) > 1:  
-                nouns.append(word)
-        for noun in nouns:
-            if noun not in all_words:
-                all_words[noun] = 0
-                word_user_count[noun] = {}
-            all_words[noun] += 1
-            user = rec['user_id']
-            if user not in word_user_count[noun]:
-                word_user_count[noun][user] = 0
-            word_user_count[noun][user] += 1
+    for word, count in data.word_count.items():
+        if word in stopwords: continue
+        all_words[word] = count
+        word_user_count[word] = data.word_user_count.get(word, {})
 
     WORD_TOPK = 3
     WORD_USER_TOPK = 5    
@@ -344,16 +329,16 @@ def draw_wordcloud(gid, date_str, recs, users, names) -> Tuple[Image.Image, str]
 
 
 # 绘制sta图
-async def draw_sta(gid, recs, interval, topk1, topk2, user, name, date_str):
+async def draw_sta(gid, data: StaData, interval, topk1, topk2, user, name, date_str):
     logger.info(f"开始绘制所有sta统计图")
     plt.subplots_adjust(wspace=0.0, hspace=0.0)
 
     fig, ax = plt.subplots(figsize=(8, 4), nrows=1, ncols=1)
     fig.tight_layout()
-    draw_plot(gid, date_str, ax, recs, interval, user[:topk2], name[:topk2])
+    draw_plot(gid, date_str, ax, data, interval, user[:topk2], name[:topk2])
     plot_image = plt_fig_to_image(fig)
 
-    wordcloud_image, word_rank_text = draw_wordcloud(gid, date_str, recs, user, name)
+    wordcloud_image, word_rank_text = draw_wordcloud(gid, date_str, data, user, name)
 
     c1, c2 = get_theme_color_info(gid, date_str)["colors"]
     bg_color = LinearGradient(c1=c1, c2=c2, p1=(1, 1), p2=(0, 0))
@@ -361,11 +346,11 @@ async def draw_sta(gid, recs, interval, topk1, topk2, user, name, date_str):
         with VSplit().set_sep(10).set_padding(10):
             bg = RoundRectBg(fill=(255, 255, 255, 200), radius=10, blurglass=True)
 
-            title = TextBox(f"{date_str} 群聊消息统计 总消息数: {len(recs)}条")
+            title = TextBox(f"{date_str} 群聊消息统计 总消息数: {data.total}条")
             title.set_bg(bg).set_padding(10).set_w(850)
             title.set_style(TextStyle(size=24, color=(0, 0, 0, 255), font=DEFAULT_FONT))
 
-            (await get_pie_frame(gid, date_str, recs, user[:topk1], name[:topk1])).set_bg(bg).set_w(850).set_h(440)
+            (await get_pie_frame(gid, date_str, data, user[:topk1], name[:topk1])).set_bg(bg).set_w(850).set_h(440)
             ImageBox(wordcloud_image, image_size_mode='fit', use_alphablend=True).set_bg(bg).set_padding(32).set_w(850)
 
             wrt = TextBox(word_rank_text, line_count=3)
@@ -379,21 +364,21 @@ async def draw_sta(gid, recs, interval, topk1, topk2, user, name, date_str):
 
 
 # 绘制sta图（长时间统计版本）
-async def draw_sta_sum(gid, recs, interval, topk1, topk2, user, name, date_str):
+async def draw_sta_sum(gid, data: StaData, interval, topk1, topk2, user, name, date_str):
     logger.info(f"开始绘制所有sta统计图")
     plt.subplots_adjust(wspace=0.0, hspace=0.0)
 
     fig, ax = plt.subplots(figsize=(8, 4), nrows=1, ncols=1)
     fig.tight_layout()
-    draw_plot(gid, date_str, ax, recs, interval, user[:topk2], name[:topk2])
+    draw_plot(gid, date_str, ax, data, interval, user[:topk2], name[:topk2])
     plot_image = plt_fig_to_image(fig)
 
     fig, ax = plt.subplots(figsize=(8, 5), nrows=1, ncols=1)
     fig.tight_layout()
-    draw_long_sta_date_count_plot(gid, date_str, ax, user[:topk2], name[:topk2], recs)
+    draw_long_sta_date_count_plot(gid, date_str, ax, user[:topk2], name[:topk2], data)
     date_count_image = plt_fig_to_image(fig)
 
-    wordcloud_image, word_rank_text = draw_wordcloud(gid, date_str, recs, user, name)
+    wordcloud_image, word_rank_text = draw_wordcloud(gid, date_str, data, user, name)
 
     c1, c2 = get_theme_color_info(gid, date_str)["colors"]
     bg_color = LinearGradient(c1=c1, c2=c2, p1=(1, 1), p2=(0, 0))
@@ -401,13 +386,13 @@ async def draw_sta_sum(gid, recs, interval, topk1, topk2, user, name, date_str):
         with VSplit().set_sep(10).set_padding(10):
             bg = RoundRectBg(fill=(255, 255, 255, 200), radius=10, blurglass=True)
 
-            title = TextBox(f"{date_str} 群聊消息统计 总消息数: {len(recs)}条")
+            title = TextBox(f"{date_str} 群聊消息统计 总消息数: {data.total}条")
             title.set_bg(bg).set_padding(10).set_w(850 + 850 + 10)
             title.set_style(TextStyle(size=24, color=(0, 0, 0, 255), font=DEFAULT_FONT))
 
             with HSplit().set_sep(10):
                 with VSplit().set_sep(10):
-                    (await get_pie_frame(gid, date_str, recs, user[:topk1], name[:topk1])).set_bg(bg).set_w(850).set_h(440)
+                    (await get_pie_frame(gid, date_str, data, user[:topk1], name[:topk1])).set_bg(bg).set_w(850).set_h(440)
                     ImageBox(wordcloud_image, image_size_mode='fit', use_alphablend=True).set_bg(bg).set_padding(32).set_w(850)
 
                     wrt = TextBox(word_rank_text, line_count=3)
@@ -480,35 +465,19 @@ def draw_word_count_plot(dates, topk_user, topk_name, user_counts, user_date_cou
 
 
 # 绘制长时间统计的群总聊天数关于时间的折线图
-def draw_long_sta_date_count_plot(gid, date_str, ax: plt.Axes, topk_user, topk_name, recs):
+def draw_long_sta_date_count_plot(gid, date_str, ax: plt.Axes, topk_user, topk_name, data: StaData):
     logger.info(f"开始绘制长时间统计的群总聊天数关于时间的折线图")
 
     # 计算起止时间
-    start_date = recs[0]['time']
-    end_date = recs[-1]['time']
+    start_date = min(data.day_count)
+    end_date = max(data.day_count)
     dates = [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
 
     # 计算每日消息数
-    counts = [0] * len(dates)
-    for rec in recs:
-        date = rec['time']
-        index = (date - start_date).days
-        counts[index] += 1
-
-    # 计算topk用户的每日消息数
-    user_counts = [[0] * len(dates) for _ in range(len(topk_user))]
-    for rec in recs:
-        user_id = rec['user_id']
-        if user_id not in topk_user: continue
-        date = rec['time']
-        index = (date - start_date).days
-        user_counts[topk_user.index(user_id)][index] += 1
+    counts = [data.day_count.get(date, 0) for date in dates]
 
     # 绘制图
-    # cmap = get_cmap(gid, date_str)
     ax.bar(dates, counts, label='日消息数', color='#bbbbbb', width=1)
-    # for i in range(len(topk_user)):
-    #     ax.plot(dates, user_counts[i], label=topk_name[i], color=cmap[i])
 
     ax.xaxis.set_major_locator(mdates.AutoDateLocator())
     ax.xaxis.set_major_formatter(mdates.DateFormatter('%m-%d'))
@@ -0,0 +1,261 @@
+from ..utils import *
+from ..record import after_insert_hook, flush_msgs_to_insert
+from ..record.sql import use_db, iter_msg_chunks
+from .draw import StaData, cut_words, init_jieba
+
+config = Config("sta")
+logger = get_logger("Sta")
+file_db = get_file_db("data/sta/db.json", logger)
+
+
+# 消息统计的预聚合数据库，由消息插入后的钩子增量维护
+ROLLUP_DB_PATH = "data/sta/rollup.sqlite"
+# 消息数按一天内的时间槽聚合，折线图的时间间隔需要是它的倍数
+ROLLUP_SLOT_MINUTES = 5
+
+ROLLUP_KIND_COUNT = "count"
+ROLLUP_KIND_WORD = "word"
+
+_rollup_lock = asyncio.Lock()
+_rollup_tables_created = False
+# 各群开始增量维护的时间戳，此后插入的消息由钩子计入，之前的消息在查询时从原始记录补全
+_rollup_since: dict[int, float] | None = None
+
+
+def get_day(t: datetime) -> int:
+    """
+    获取时间所在的日期（YYYYMMDD）
+    """
+    return t.year * 10000 + t.month * 100 + t.day
+
+def day_to_datetime(day: int) -> datetime:
+    return datetime(day // 10000, day // 100 % 100, day % 100)
+
+async def _ensure_tables(db):
+    global _rollup_tables_created
+    if _rollup_tables_created:
+        return
+    # 消息数 (群, 日期, 时间槽起始分钟, 用户, 消息数, 图片消息数)
+    await db.conn.execute("""
+        CREATE TABLE IF NOT EXISTS msg_count (
+            group_id INTEGER,
+            day INTEGER,
+            minute INTEGER,
+            user_id INTEGER,
+            count INTEGER,
+            image_count INTEGER,
+            PRIMARY KEY (group_id, day, minute, user_id)
+        ) WITHOUT ROWID
+    """)
+    # 词频 (群, 日期, 词, 用户, 出现次数, 包含该词的消息数, 是否为名词)
+    await db.conn.execute("""
+        CREATE TABLE IF NOT EXISTS word_count (
+            group_id INTEGER,
+            day INTEGER,
+            word TEXT,
+            user_id INTEGER,
+            count INTEGER,
+            msg_count INTEGER,
+            noun INTEGER,
+            PRIMARY KEY (group_id, day, word, user_id)
+        ) WITHOUT ROWID
+    """)
+    await db.conn.execute("CREATE INDEX IF NOT EXISTS word_count_word ON word_count (group_id, word, day)")
+    await db.conn.execute("CREATE TABLE IF NOT EXISTS rollup_since (group_id INTEGER PRIMARY KEY, since REAL)")
+    # 已从原始记录补全的日期
+    await db.conn.execute("""
+        CREATE TABLE IF NOT EXISTS rollup_days (
+            group_id INTEGER,
+            kind TEXT,
+            day INTEGER,
+            PRIMARY KEY (group_id, kind, day)
+        ) WITHOUT ROWID
+    """)
+    await db.conn.commit()
+    _rollup_tables_created = True
+
+async def _get_since(db, group_id: int, default: float | None = None) -> float | None:
+    """
+    获取群开始增量维护的时间戳，不存在时设置为default
+    """
+    global _rollup_since
+    if _rollup_since is None:
+        cursor = await db.conn.execute("SELECT group_id, since FROM rollup_since")
+        _rollup_since = {gid: since for gid, since in await cursor.fetchall()}
+        await cursor.close()
+    if group_id not in _rollup_since and default is not None:
+        _rollup_since[group_id] = default
+        await db.conn.execute("INSERT OR REPLACE INTO rollup_since (group_id, since) VALUES (?, ?)", (group_id, default))
+    return _rollup_since.get(group_id)
+
+
+# ============================ 更新 ============================ #
+
+def _count_msgs(items: list[tuple[int, dict]], count: bool, word: bool, userwords: set[str]) -> tuple[dict, dict]:
+    """
+    聚合一批 (群, 消息) 的消息数和词频，在线程池中执行
+    """
+    msg_counts: dict[tuple, list[int]] = {}
+    word_counts: dict[tuple, list[int]] = {}
+    for group_id, msg in items:
+        t: datetime = msg['time']
+        day = get_day(t)
+        user_id = int(msg['user_id'])
+        if count:
+            minute = (t.hour * 60 + t.minute) // ROLLUP_SLOT_MINUTES * ROLLUP_SLOT_MINUTES
+            c = msg_counts.setdefault((group_id, day, minute, user_id), [0, 0])
+            c[0] += 1
+            if has_image(msg['msg']):
+                c[1] += 1
+        if word:
+            seen = set()
+            for w, noun in cut_words(extract_text(msg['msg']), userwords):
+                c = word_counts.setdefault((group_id, day, w, user_id), [0, 0, 0])
+                c[0] += 1
+                if w not in seen:
+                    c[1] += 1
+                    seen.add(w)
+                if noun:
+                    c[2] = 1
+    return msg_counts, word_counts
+
+async def _add_counts(db, items: list[tuple[int, dict]], count: bool, word: bool):
+    """
+    把一批 (群, 消息) 累加到预聚合表，不提交
+    """
+    if not items:
+        return
+    if word:
+        init_jieba()
+    userwords = set(file_db.get("userwords", []))
+    msg_counts, word_counts = await run_in_pool(_count_msgs, items, count, word, userwords)
+    async with db.write_lock:
+        if msg_counts:
+            await db.conn.executemany("""
+                INSERT INTO msg_count (group_id, day, minute, user_id, count, image_count) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (group_id, day, minute, user_id) DO UPDATE SET
+                    count = count + excluded.count,
+                    image_count = image_count + excluded.image_count
+            """, [(*k, *v) for k, v in msg_counts.items()])
+        if word_counts:
+            await db.conn.executemany("""
+                INSERT INTO word_count (group_id, day, word, user_id, count, msg_count, noun) VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (group_id, day, word, user_id) DO UPDATE SET
+                    count = count + excluded.count,
+                    msg_count = msg_count + excluded.msg_count,
+                    noun = MAX(noun, excluded.noun)
+            """, [(*k, *v) for k, v in word_counts.items()])
+
+@after_insert_hook
+async def update_rollup(msgs: list[dict]):
+    group_msgs: dict[int, list[dict]] = {}
+    for msg in msgs:
+        if msg['group_id']:
+            group_msgs.setdefault(msg['group_id'], []).append(msg)
+    if not group_msgs:
+        return
+    async with _rollup_lock, use_db(ROLLUP_DB_PATH) as db:
+        await _ensure_tables(db)
+        items = []
+        for group_id, gmsgs in group_msgs.items():
+            since = await _get_since(db, group_id, min(msg['time'] for msg in gmsgs).timestamp())
+            # 早于开始维护时间的消息由补全负责，避免重复计数
+            items.extend((group_id, msg) for msg in gmsgs if msg['time'].timestamp() >= since)
+        await _add_counts(db, items, count=True, word=True)
+        await db.conn.commit()
+
+async def _ensure_rollup(group_id: int, start_date: datetime, end_date: datetime, kind: str):
+    """
+    确保日期范围内（包含首尾）的预聚合数据完整，开始增量维护之前的部分从原始消息记录补全
+    """
+    async with _rollup_lock, use_db(ROLLUP_DB_PATH) as db:
+        await _ensure_tables(db)
+        since = await _get_since(db, group_id)
+        if since is None:
+            # 开始增量维护前先把缓冲中的消息写入数据库，保证早于开始时间的消息都能从原始记录补全
+            since = time.time()
+            await flush_msgs_to_insert()
+            since = await _get_since(db, group_id, since)
+        since = datetime.fromtimestamp(since)
+        start_date = datetime(start_date.year, start_date.month, start_date.day)
+        end_date = min(datetime(end_date.year, end_date.month, end_date.day), since)
+        if start_date > end_date:
+            return
+        cursor = await db.conn.execute(
+            "SELECT day FROM rollup_days WHERE group_id = ? AND kind = ? AND day >= ? AND day <= ?",
+            (group_id, kind, get_day(start_date), get_day(end_date)),
+        )
+        done_days = {row[0] for row in await cursor.fetchall()}
+        await cursor.close()
+
+        t, msg_num, day_num = time.time(), 0, 0
+        date = start_date
+        while date <= end_date:
+            day = get_day(date)
+            if day not in done_days:
+                day_end = min(date + timedelta(days=1), since) - timedelta(microseconds=1)
+                fields = ['time', 'user_id', 'msg']
+                async for recs in iter_msg_chunks(group_id, date, day_end, fields=fields):
+                    await _add_counts(db, [(group_id, rec) for rec in recs], kind == ROLLUP_KIND_COUNT, kind == ROLLUP_KIND_WORD)
+                    msg_num += len(recs)
+                await db.conn.execute("INSERT INTO rollup_days (group_id, kind, day) VALUES (?, ?, ?)", (group_id, kind, day))
+                await db.conn.commit()
+                day_num += 1
+            date += timedelta(days=1)
+        if day_num:
+            logger.info(f"从原始记录补全群 {group_id} 的 {kind} 预聚合数据 {day_num} 天 {msg_num} 条消息 耗时{time.time() - t:.1f}s")
+
+
+# ============================ 查询 ============================ #
+
+async def _fetch_rollup(sql: str, params: tuple) -> list[tuple]:
+    async with use_db(ROLLUP_DB_PATH) as db:
+        cursor = await db.conn.execute(sql, params)
+        rows = await cursor.fetchall()
+        await cursor.close()
+        return rows
+
+async def query_sta_data(group_id: int, start_date: datetime, end_date: datetime) -> StaData:
+    """
+    获取日期范围内（包含首尾）的统计图数据
+    """
+    await _ensure_rollup(group_id, start_date, end_date, ROLLUP_KIND_COUNT)
+    await _ensure_rollup(group_id, start_date, end_date, ROLLUP_KIND_WORD)
+    where = "WHERE group_id = ? AND day >= ? AND day <= ?"
+    params = (group_id, get_day(start_date), get_day(end_date))
+
+    data = StaData()
+    for user_id, count, image_count in await _fetch_rollup(
+        f"SELECT user_id, SUM(count), SUM(image_count) FROM msg_count {where} GROUP BY user_id", params
+    ):
+        data.user_count[user_id] = count
+        data.user_image_count[user_id] = image_count
+        data.total += count
+    for minute, count, image_count in await _fetch_rollup(
+        f"SELECT minute, SUM(count), SUM(image_count) FROM msg_count {where} GROUP BY minute", params
+    ):
+        data.minute_count[minute] = count
+        data.minute_image_count[minute] = image_count
+    for day, count in await _fetch_rollup(
+        f"SELECT day, SUM(count) FROM msg_count {where} GROUP BY day", params
+    ):
+        data.day_count[day_to_datetime(day)] = count
+    for word, user_id, count in await _fetch_rollup(
+        f"SELECT word, user_id, SUM(count) FROM word_count {where} AND noun = 1 GROUP BY word, user_id", params
+    ):
+        data.word_count[word] = data.word_count.get(word, 0) + count
+        data.word_user_count.setdefault(word, {})[user_id] = count
+    return data
+
+async def query_day_counts(group_id: int, start_date: datetime, end_date: datetime, user_id: int = None) -> dict[datetime, int]:
+    """
+    获取日期范围内（包含首尾）每天的消息数，user_id不为None时只统计该用户
+    """
+    await _ensure_rollup(group_id, start_date, end_date, ROLLUP_KIND_COUNT)
+    where = "WHERE group_id = ? AND day >= ? AND day <= ?"
+    params = (group_id, get_day(start_date), get_day(end_date))
+    if user_id is not None:
+        where += " AND user_id = ?"
+        params += (int(user_id),)
+    rows = await _fetch_rollup(f"SELECT day, SUM(count) FROM msg_count {where} GROUP BY day", params)
+    return {day_to_datetime(day): count for day, count in rows}
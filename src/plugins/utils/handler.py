@@ -18,7 +18,14 @@ from nonebot.adapters.onebot.v11.event import Sender, Reply
 from nonebot.adapters.onebot.v11.message import MessageSegment, Message
 import nonebot.adapters.onebot.v11.bot as bot_module
 from argparse import ArgumentParser
+from collections import OrderedDict
+from typing import Awaitable
+import heapq
+import inspect
 import requests
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from ..common.process_pool import ProcessPool, is_main_process
 
 
 SUPERUSER_CFG = global_config.item('superuser')
@@ -225,31 +232,77 @@ bot_module.Bot.handle_event = _mp_handle_event
 # ============================ API调用 ============================ #
 
 class ExpirableCache:
-    def __init__(self, default_expire_seconds: int | ConfigItem):
-        self.cache: dict[Any, tuple[Any, datetime]] = {}
+    """
+    带过期时间的缓存  
+    读取时惰性检查单个key是否过期，过期时间按堆排列并在读写时摊还清理已过期的条目，
+    超出最大数量时淘汰最久未使用的条目
+    """
+    def __init__(self, default_expire_seconds: int | ConfigItem, max_num: int | ConfigItem = None, name: str = None):
+        self.cache: OrderedDict[Any, tuple[Any, float]] = OrderedDict()
+        self.heap: list[tuple[float, int, Any]] = []
+        self.seq = 0
         self.default_expire_seconds = default_expire_seconds
+        self.max_num = max_num if max_num is not None else EXPIRABLE_CACHE_MAX_NUM_CFG
+        self.name = name
+        self.stats = { 'hit': 0, 'miss': 0, 'expire': 0, 'evict': 0 }
+        if name:
+            _expirable_caches[name] = self
+
+    def _sweep(self, now: float):
+        """
+        - 清理堆顶已过期的条目，key被重新设置过的旧堆条目直接丢弃
+        """
+        heap = self.heap
+        while heap and heap[0][0] <= now:
+            expire_time, _, key = heapq.heappop(heap)
+            item = self.cache.get(key)
+            if item is not None and item[1] == expire_time:
+                del self.cache[key]
+                self.stats['expire'] += 1
+        # 同一key反复设置会留下大量旧堆条目，超过一定数量时重建
+        if len(heap) > 2 * len(self.cache) + 64:
+            self.heap = []
+            for key, (_, expire_time) in self.cache.items():
+                self.seq += 1
+                self.heap.append((expire_time, self.seq, key))
+            heapq.heapify(self.heap)
     
     def get(self, key: Any) -> Any | None:
-        for k in list(self.cache.keys()):
-            if self.cache[k][1] <= datetime.now():
-                del self.cache[k]
-        if key in self.cache:
-            value, expire_time = self.cache[key]
-            if expire_time > datetime.now():
-                return value
-            else:
-                del self.cache[key]
+        now = time.monotonic()
+        self._sweep(now)
+        item = self.cache.get(key)
+        if item is not None and item[1] > now:
+            self.cache.move_to_end(key)
+            self.stats['hit'] += 1
+            return item[0]
+        self.stats['miss'] += 1
         return None
 
     def set(self, key: Any, value: Any, expire_seconds: int | None = None):
+        now = time.monotonic()
+        self._sweep(now)
         expire_seconds = expire_seconds or get_cfg_or_value(self.default_expire_seconds)
-        self.cache[key] = (value, datetime.now() + timedelta(seconds=expire_seconds))
-
-_group_member_name_cache = ExpirableCache(global_config.item('group_member_name_cache_expire_seconds'))
-_stranger_name_cache = ExpirableCache(global_config.item('stranger_name_cache_expire_seconds'))
-_group_name_cache = ExpirableCache(global_config.item('group_name_cache_expire_seconds'))
-_bot_group_cache = ExpirableCache(global_config.item('bot_group_cache_expire_seconds'))
-_bot_friend_cache = ExpirableCache(global_config.item('bot_friend_cache_expire_seconds'))
+        expire_time = now + expire_seconds
+        self.cache[key] = (value, expire_time)
+        self.cache.move_to_end(key)
+        self.seq += 1
+        heapq.heappush(self.heap, (expire_time, self.seq, key))
+        max_num = get_cfg_or_value(self.max_num, 100000)
+        while len(self.cache) > max_num:
+            self.cache.popitem(last=False)
+            self.stats['evict'] += 1
+
+    def get_stats(self) -> dict[str, int]:
+        return { 'num': len(self.cache), **self.stats }
+
+EXPIRABLE_CACHE_MAX_NUM_CFG = global_config.item('expirable_cache_max_num')
+_expirable_caches: dict[str, ExpirableCache] = {}
+
+_group_member_name_cache = ExpirableCache(global_config.item('group_member_name_cache_expire_seconds'), name='group_member_name')
+_stranger_name_cache = ExpirableCache(global_config.item('stranger_name_cache_expire_seconds'), name='stranger_name')
+_group_name_cache = ExpirableCache(global_config.item('group_name_cache_expire_seconds'), name='group_name')
+_bot_group_cache = ExpirableCache(global_config.item('bot_group_cache_expire_seconds'), name='bot_group')
+_bot_friend_cache = ExpirableCache(global_config.item('bot_friend_cache_expire_seconds'), name='bot_friend')
 
 def get_user_name_by_event(event_or_reply: MessageEvent | Reply) -> str:
     """
@@ -261,16 +314,80 @@ def get_user_name_by_event(event_or_reply: MessageEvent | Reply) -> str:
         return card
     return nickname or str(event_or_reply.user_id)
     
+class SingleFlight:
+    """
+    合并相同key的并发异步调用，进行中的调用被所有等待者共享
+    """
+    def __init__(self):
+        self.futures: dict[Any, asyncio.Future] = {}
+        self.stats = { 'call': 0, 'shared': 0 }
+
+    async def do(self, key: Any, func: Callable[[], Awaitable[Any]]) -> Any:
+        fut = self.futures.get(key)
+        if fut is None:
+            self.stats['call'] += 1
+            fut = asyncio.ensure_future(func())
+            self.futures[key] = fut
+            def on_done(f: asyncio.Future):
+                if self.futures.get(key) is f:
+                    del self.futures[key]
+                # 所有等待者都被取消时避免出现未获取异常的警告
+                if not f.cancelled():
+                    f.exception()
+            fut.add_done_callback(on_done)
+        else:
+            self.stats['shared'] += 1
+        # 单个等待者被取消时不取消共享的调用
+        return await asyncio.shield(fut)
+
+_api_single_flight = SingleFlight()
+
+async def call_api_single_flight(bot: Bot, api: str, **kwargs) -> Any:
+    """
+    调用bot API，相同bot、API和参数的并发调用只会实际请求一次
+    """
+    key = (bot.self_id, api, tuple(sorted(kwargs.items())))
+    return await _api_single_flight.do(key, lambda: bot.call_api(api, **kwargs))
+
+GROUP_MEMBER_LIST_PREFETCH_THRESHOLD_CFG = global_config.item('group_member_list_prefetch_threshold')
+_group_member_name_misses: dict[int, int] = {}
+
+async def _prefetch_group_member_names(bot: Bot, group_id: int):
+    """
+    获取整个群成员列表并写入群成员名称缓存
+    """
+    members = await call_api_single_flight(bot, 'get_group_member_list', group_id=int(group_id))
+    for info in members:
+        user_id = int(info['user_id'])
+        name = info.get('card') or info.get('nickname', str(user_id))
+        _group_member_name_cache.set((group_id, user_id), name)
+    
 async def get_group_member_name(group_id: int, user_id: int) -> str:
     """
-    调用API获取群聊中的用户名（带缓存） 如果有群名片则返回群名片 否则返回昵称
+    调用API获取群聊中的用户名（带缓存） 如果有群名片则返回群名片 否则返回昵称  
+    同一个群同时有多个成员未命中缓存时改为获取整个群成员列表
     """
     global _group_member_name_cache
     key = (group_id, user_id)
     if cache := _group_member_name_cache.get(key):
         return cache
     bot = await aget_group_bot(group_id, raise_exc=True)
-    info = await bot.call_api('get_group_member_info', **{'group_id': int(group_id), 'user_id': int(user_id)})
+    _group_member_name_misses[group_id] = _group_member_name_misses.get(group_id, 0) + 1
+    try:
+        # 让出一次事件循环，使同一批并发的请求都被计数
+        await asyncio.sleep(0)
+        if _group_member_name_misses[group_id] >= get_cfg_or_value(GROUP_MEMBER_LIST_PREFETCH_THRESHOLD_CFG, 3):
+            try:
+                await _prefetch_group_member_names(bot, group_id)
+            except Exception as e:
+                utils_logger.warning(f'获取群 {group_id} 成员列表失败: {get_exc_desc(e)}')
+            if cache := _group_member_name_cache.get(key):
+                return cache
+        info = await call_api_single_flight(bot, 'get_group_member_info', group_id=int(group_id), user_id=int(user_id))
+    finally:
+        _group_member_name_misses[group_id] -= 1
+        if _group_member_name_misses[group_id] <= 0:
+            del _group_member_name_misses[group_id]
     name = info.get('card') or info.get('nickname', str(user_id))
     _group_member_name_cache.set(key, name)
     return name
@@ -284,7 +401,7 @@ async def get_group_ids(bot: Bot, refresh: bool = False) -> set[int]:
     if not refresh:
         if cache := _bot_group_cache.get(key):
             return cache
-    group_list = await bot.call_api('get_group_list')
+    group_list = await call_api_single_flight(bot, 'get_group_list')
     group_ids = set(int(group['group_id']) for group in group_list)
     _bot_group_cache.set(key, group_ids)
     return group_ids
@@ -318,7 +435,7 @@ async def get_stranger_info(bot: Bot, user_id: int) -> dict:
     global _stranger_name_cache
     if cache := _stranger_name_cache.get(int(user_id)):
         return {'user_id': int(user_id), 'nickname': cache}
-    info = await bot.call_api('get_stranger_info', **{'user_id': int(user_id)})
+    info = await call_api_single_flight(bot, 'get_stranger_info', user_id=int(user_id))
     name = info.get('nickname', str(user_id))
     _stranger_name_cache.set(int(user_id), name)
     return info
@@ -331,7 +448,7 @@ async def get_friend_ids(bot: Bot) -> set[int]:
     key = int(bot.self_id)
     if cache := _bot_friend_cache.get(key):
         return cache
-    friend_list = await bot.call_api('get_friend_list')
+    friend_list = await call_api_single_flight(bot, 'get_friend_list')
     friend_ids = set(int(friend['user_id']) for friend in friend_list)
     _bot_friend_cache.set(key, friend_ids)
     return friend_ids
@@ -349,7 +466,7 @@ async def get_group_name(bot: Bot, group_id: int) -> str:
     global _group_name_cache
     if cache := _group_name_cache.get(int(group_id)):
         return cache
-    group_info = await bot.call_api('get_group_info', **{'group_id': int(group_id)})
+    group_info = await call_api_single_flight(bot, 'get_group_info', group_id=int(group_id))
     name = group_info.get('group_name', str(group_id))
     _group_name_cache.set(int(group_id), name)
     return name
@@ -390,6 +507,91 @@ async def download_avatar(bot: Bot, user_id: int, circle=False) -> Image.Image:
         img.putalpha(circle_img)
     return img
       
+IMAGE_ENCODE_THREAD_NUM = global_config.get('msg_send.image_encode.thread_num', 4)
+IMAGE_ENCODE_GIF_PROCESS_NUM = global_config.get('msg_send.image_encode.gif_process_num', 0)
+IMAGE_ENCODE_SIZE_BUDGET_MB_CFG = global_config.item('msg_send.image_encode.size_budget_mb')
+IMAGE_ENCODE_QUALITY_LADDER_CFG = global_config.item('msg_send.image_encode.quality_ladder')
+IMAGE_ENCODE_CACHE_NUM_CFG = global_config.item('msg_send.image_encode.cache_num')
+
+# jpg/png编码在PIL中会释放GIL，使用线程池；透明GIF的转换主要是Python代码，可以放在进程池中避免占用主进程
+_image_encode_executor = ThreadPoolExecutor(max_workers=IMAGE_ENCODE_THREAD_NUM, thread_name_prefix='image_encode')
+_image_encode_process_pool: ProcessPool | None = None
+if IMAGE_ENCODE_GIF_PROCESS_NUM > 0 and is_main_process():
+    _image_encode_process_pool = ProcessPool(IMAGE_ENCODE_GIF_PROCESS_NUM, name='imgenc')
+
+# 最近编码的结果 (图片内容指纹, 编码参数) -> (数据, 格式)
+_encoded_image_cache: OrderedDict[tuple, Tuple[bytes, str]] = OrderedDict()
+
+@dataclass
+class ImageEncodeStats:
+    count: int = 0
+    cached_count: int = 0
+    total_time: float = 0.
+    max_time: float = 0.
+    total_size: int = 0
+    max_size: int = 0
+
+# 指令 -> 图片编码统计
+_image_encode_stats: Dict[str, ImageEncodeStats] = {}
+# 当前正在处理的指令，用于统计
+_current_trigger_cmd: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar('current_trigger_cmd', default=None)
+
+def get_image_encode_stats() -> Dict[str, ImageEncodeStats]:
+    """
+    获取各指令的图片编码统计
+    """
+    return _image_encode_stats
+
+async def encode_image_for_send(
+    image: Image.Image,
+    fmt: str,
+    quality: int = 75,
+    optimize: bool = False,
+    subsampling: int = -1,
+) -> Tuple[bytes, str]:
+    """
+    在工作线程/进程中编码要发送的图片，超出大小上限时降低质量
+    带有内容指纹（不会被原地修改）的图片以相同参数再次编码时复用结果，其他图片可能被原地修改，每次都重新编码
+    返回 (数据, 实际使用的格式)
+    """
+    size_budget = int(IMAGE_ENCODE_SIZE_BUDGET_MB_CFG.get(0) * 1024 * 1024)
+    fingerprint = get_image_fingerprint(image)
+    key = None
+    if fingerprint is not None:
+        key = (fingerprint, image.size, image.mode, fmt, quality, optimize, subsampling, size_budget)
+    stats = _image_encode_stats.setdefault(_current_trigger_cmd.get() or "other", ImageEncodeStats())
+    if key is not None and key in _encoded_image_cache:
+        _encoded_image_cache.move_to_end(key)
+        stats.cached_count += 1
+        return _encoded_image_cache[key]
+
+    start_time = time.time()
+    args = (quality, optimize, subsampling, 50, size_budget, IMAGE_ENCODE_QUALITY_LADDER_CFG.get(None))
+    if fmt == 'gif':
+        args = (quality, optimize, subsampling, get_gif_duration(image), size_budget, None)
+        if _image_encode_process_pool:
+            # 进程间传递图片对象只会保留当前帧，因此先在工作线程中拆分为帧
+            frames = await run_in_pool(gif_to_frames, image, pool=_image_encode_executor) if is_animated(image) else [image]
+            data, out_fmt = await _image_encode_process_pool.submit(encode_image, frames, fmt, *args)
+        else:
+            data, out_fmt = await run_in_pool(encode_image, image, fmt, *args, pool=_image_encode_executor)
+    else:
+        data, out_fmt = await run_in_pool(encode_image, image, fmt, *args, pool=_image_encode_executor)
+    elapsed = time.time() - start_time
+
+    stats.count += 1
+    stats.total_time += elapsed
+    stats.max_time = max(stats.max_time, elapsed)
+    stats.total_size += len(data)
+    stats.max_size = max(stats.max_size, len(data))
+    utils_logger.debug(f"编码{image.size[0]}x{image.size[1]}图片为{out_fmt} 耗时{elapsed:.3f}s 大小{get_readable_file_size(len(data))}")
+
+    if key is not None:
+        _encoded_image_cache[key] = (data, out_fmt)
+        while len(_encoded_image_cache) > IMAGE_ENCODE_CACHE_NUM_CFG.get(16):
+            _encoded_image_cache.popitem(last=False)
+    return data, out_fmt
+
 async def get_image_cq(
     image: Union[str, Image.Image, bytes],
     allow_error: bool = False, 
@@ -426,20 +628,15 @@ async def get_image_cq(
 
         is_gif_img = is_animated(image) or image.mode == 'P'
         ext = 'gif' if is_gif_img else ('jpg' if low_quality else 'png')
+        data, ext = await encode_image_for_send(
+            image, ext,
+            quality=get_cfg_or_value(quality),
+            optimize=get_cfg_or_value(optimize),
+            subsampling=get_cfg_or_value(subsampling),
+        )
         with TempFilePath(ext, remove_after=timedelta(minutes=global_config.get('msg_send.tmp_img_keep_minutes'))) as tmp_path:
-            if ext == 'gif':
-                save_transparent_gif(gif_to_frames(image), get_gif_duration(image), tmp_path)
-            elif ext == 'jpg':
-                image = image.convert('RGB')
-                image.save(
-                    tmp_path, format='JPEG', 
-                    quality=get_cfg_or_value(quality), 
-                    optimize=get_cfg_or_value(optimize),
-                    subsampling=get_cfg_or_value(subsampling), 
-                    progressive=False
-                )
-            else:
-                image.save(tmp_path)
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
             return f'[CQ:image,file=file://{os.path.abspath(tmp_path)}]'
 
     except Exception as e:
@@ -853,8 +1050,6 @@ def on_safe_mode() -> bool:
 # ============================ 消息发送 ============================ #
 
 _bot_reply_msg_ids = set()
-_current_msg_count = 0
-_current_msg_second = -1
 _send_msg_failed_last_mail_time = datetime.fromtimestamp(0)
 
 def check_send_msg_daily_limit(bot_id: int) -> bool:
@@ -914,50 +1109,212 @@ def check_is_bot_reply_msg(msg_id: int):
     return int(msg_id) in _bot_reply_msg_ids
 
 
-def send_msg_func(func):
-    """
-    发送消息函数的装饰器
-    """
-    async def wrapper(*args, **kwargs):
-        # 检查消息发送次数限制
-        cur_ts = int(datetime.now().timestamp())
-        global _current_msg_count, _current_msg_second
-        if cur_ts != _current_msg_second:
-            _current_msg_count = 0
-            _current_msg_second = cur_ts
-        if _current_msg_count >= global_config.get('msg_send.rate_limit.second'):
-            utils_logger.warning(f'消息达到发送频率，取消消息发送')
-            return
-        _current_msg_count += 1
-        
+MSG_SEND_QUEUE_MAX_SIZE_CFG = global_config.item('msg_send.queue.max_size')
+MSG_SEND_QUEUE_REPLY_DEADLINE_CFG = global_config.item('msg_send.queue.reply_deadline')
+MSG_SEND_QUEUE_PUSH_DEADLINE_CFG = global_config.item('msg_send.queue.push_deadline')
+MSG_SEND_QUEUE_COALESCE_MAX_LEN_CFG = global_config.item('msg_send.queue.coalesce_max_len')
+
+MSG_SEND_PRIORITY_REPLY = 0     # 指令回复
+MSG_SEND_PRIORITY_PUSH = 1      # 订阅推送、广播等主动发送
+
+@dataclass
+class OutboundMsg:
+    priority: int
+    seq: int
+    func: Callable
+    bound: inspect.BoundArguments
+    context: contextvars.Context
+    deadline: float
+    future: asyncio.Future
+    coalesce_key: Optional[tuple] = None
+    merged_num: int = 1
+
+class OutboundMsgQueue:
+    """
+    单个bot账号的消息发送队列：令牌桶控制发送速率（桶容量和每秒补充数量都为 msg_send.rate_limit.second），
+    超出速率的消息排队等待而不是直接丢弃，指令回复优先于推送发送，队列有长度上限，排队超时的消息丢弃，
+    发往同一目标的排队中的文本推送会合并为一条
+    """
+    def __init__(self, bot_id: Optional[int]):
+        self.bot_id = bot_id
+        self.heap: list[tuple[int, int, OutboundMsg]] = []
+        self.coalescing: dict[tuple, OutboundMsg] = {}
+        self.seq = 0
+        self.tokens = float(global_config.get('msg_send.rate_limit.second'))
+        self.last_refill = time.monotonic()
+        self.wakeup = asyncio.Event()
+        self.worker: Optional[asyncio.Task] = None
+        self.stats = { 'sent': 0, 'coalesced': 0, 'expired': 0, 'evicted': 0, 'daily_limited': 0 }
+
+    def _refill(self) -> float:
+        rate = max(1, global_config.get('msg_send.rate_limit.second'))
+        now = time.monotonic()
+        self.tokens = min(float(rate), self.tokens + (now - self.last_refill) * rate)
+        self.last_refill = now
+        return rate
+
+    def _try_coalesce(self, msg: OutboundMsg) -> Optional[asyncio.Future]:
+        max_len = MSG_SEND_QUEUE_COALESCE_MAX_LEN_CFG.get(0)
+        if not max_len or msg.coalesce_key is None:
+            return None
+        queued = self.coalescing.get(msg.coalesce_key)
+        if queued is None or queued.future.done():
+            return None
+        content = msg.bound.arguments.get('content')
+        queued_content = queued.bound.arguments.get('content')
+        if not isinstance(content, str) or not isinstance(queued_content, str):
+            return None
+        if len(queued_content) + len(content) + 1 > max_len:
+            return None
+        queued.bound.arguments['content'] = queued_content + '\n' + content
+        queued.deadline = max(queued.deadline, msg.deadline)
+        queued.merged_num += 1
+        self.stats['coalesced'] += 1
+        return queued.future
+
+    def _drop(self, msg: OutboundMsg, reason: str, stat: str):
+        self.stats[stat] += 1
+        if self.coalescing.get(msg.coalesce_key) is msg:
+            self.coalescing.pop(msg.coalesce_key)
+        utils_logger.warning(f'Bot账号 {self.bot_id} 取消发送{msg.func.__name__}消息({msg.merged_num}条): {reason}')
+        if not msg.future.done():
+            msg.future.set_result(None)
+
+    def put(self, func: Callable, bound: inspect.BoundArguments, priority: int, coalesce_key: Optional[tuple]) -> asyncio.Future:
+        deadline_cfg = MSG_SEND_QUEUE_REPLY_DEADLINE_CFG if priority == MSG_SEND_PRIORITY_REPLY else MSG_SEND_QUEUE_PUSH_DEADLINE_CFG
+        self.seq += 1
+        msg = OutboundMsg(
+            priority=priority,
+            seq=self.seq,
+            func=func,
+            bound=bound,
+            context=contextvars.copy_context(),
+            deadline=time.monotonic() + deadline_cfg.get(60),
+            future=asyncio.get_event_loop().create_future(),
+            coalesce_key=coalesce_key,
+        )
+        if future := self._try_coalesce(msg):
+            return future
+
+        # 队列已满时丢弃优先级最低且最晚加入的消息
+        if len(self.heap) >= MSG_SEND_QUEUE_MAX_SIZE_CFG.get(200):
+            worst = max(self.heap)
+            if (worst[0], worst[1]) < (msg.priority, msg.seq):
+                self._drop(msg, '发送队列已满', 'evicted')
+                return msg.future
+            self.heap.remove(worst)
+            heapq.heapify(self.heap)
+            self._drop(worst[2], '发送队列已满', 'evicted')
+
+        heapq.heappush(self.heap, (msg.priority, msg.seq, msg))
+        if coalesce_key is not None:
+            self.coalescing[coalesce_key] = msg
+        self.wakeup.set()
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.create_task(self._run())
+        return msg.future
+
+    async def _run(self):
+        while True:
+            if not self.heap:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            rate = self._refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / rate)
+                continue
+            _, _, msg = heapq.heappop(self.heap)
+            if self.coalescing.get(msg.coalesce_key) is msg:
+                self.coalescing.pop(msg.coalesce_key)
+            if msg.future.done():
+                continue
+            if time.monotonic() > msg.deadline:
+                self._drop(msg, '排队超时', 'expired')
+                continue
+            # 指令回复的每日上限在指令处理前检查，推送在这里检查
+            if msg.priority != MSG_SEND_PRIORITY_REPLY and self.bot_id is not None \
+                and not check_send_msg_daily_limit(self.bot_id):
+                self._drop(msg, '达到每日发送上限', 'daily_limited')
+                continue
+            self.tokens -= 1
+            # 在调用者的上下文中发送，保证matcher等上下文变量可用
+            msg.context.run(asyncio.create_task, self._send(msg))
+
+    async def _send(self, msg: OutboundMsg):
         try:
-            ret = await func(*args, **kwargs)
+            ret = await msg.func(*msg.bound.args, **msg.bound.kwargs)
         except Exception as e:
-            # 失败发送邮件通知
-            # global _send_msg_failed_last_mail_time
-            # if datetime.now() - _send_msg_failed_last_mail_time > timedelta(seconds=global_config.get('msg_send.failed_mail_interval')):
-            #     _send_msg_failed_last_mail_time = datetime.now()
-            #     asyncio.create_task(asend_exception_mail("消息发送失败", traceback.format_exc(), utils_logger))
-            raise e
+            if not msg.future.done():
+                msg.future.set_exception(e)
+            return
+        self.stats['sent'] += 1
 
         # 记录自身对指令的回复消息id集合
         try:
             if ret:
-                global _bot_reply_msg_ids
                 _bot_reply_msg_ids.add(int(ret["message_id"]))
         except Exception as e:
             utils_logger.print_exc(f'记录发送消息的id失败')
 
         # 记录消息发送次数
-        bot_id = None
-        for arg in list(args) + list(kwargs.values()):
+        record_daily_msg_send(self.bot_id)
+
+        if not msg.future.done():
+            msg.future.set_result(ret)
+
+    def get_stats(self) -> dict:
+        return self.stats | { 'queued': len(self.heap) }
+
+_outbound_msg_queues: dict[Optional[int], OutboundMsgQueue] = {}
+
+def get_outbound_msg_queue(bot_id: Optional[int]) -> OutboundMsgQueue:
+    if bot_id not in _outbound_msg_queues:
+        _outbound_msg_queues[bot_id] = OutboundMsgQueue(bot_id)
+    return _outbound_msg_queues[bot_id]
+
+def get_outbound_msg_queue_stats() -> dict[Optional[int], dict]:
+    """
+    获取各bot账号消息发送队列的统计
+    """
+    return { bot_id: q.get_stats() for bot_id, q in _outbound_msg_queues.items() }
+
+def send_msg_func(func=None, *, coalesce: bool = False):
+    """
+    发送消息函数的装饰器，消息经过所属bot账号的发送队列按速率发送
+    coalesce: 是否允许把排队中发往同一目标的文本推送合并为一条（被装饰函数的第一个参数为目标，content参数为消息内容）
+    """
+    if func is None:
+        return lambda f: send_msg_func(f, coalesce=coalesce)
+    sig = inspect.signature(func)
+    first_param = next(iter(sig.parameters))
+
+    async def wrapper(*args, **kwargs):
+        bound = sig.bind(*args, **kwargs)
+        bound.apply_defaults()
+
+        # 未指定bot的event外发送先确定发送的bot，保证同一账号的回复和推送进入同一个队列限速
+        if bound.arguments.get('bot', ...) is None:
+            if first_param == 'group_id':
+                bound.arguments['bot'] = await aget_group_bot(bound.arguments['group_id'])
+            elif first_param == 'user_id':
+                bound.arguments['bot'] = await aget_private_bot(bound.arguments['user_id'])
+
+        bot_id, is_reply = None, _current_trigger_cmd.get() is not None
+        for arg in bound.arguments.values():
             if isinstance(arg, (MessageEvent, Bot)):
                 bot_id = int(arg.self_id)
+                is_reply = is_reply or isinstance(arg, MessageEvent)
                 break
-        record_daily_msg_send(bot_id)
-            
-        return ret
-        
+        priority = MSG_SEND_PRIORITY_REPLY if is_reply else MSG_SEND_PRIORITY_PUSH
+
+        coalesce_key = None
+        if coalesce and priority == MSG_SEND_PRIORITY_PUSH:
+            coalesce_key = (func.__name__, bound.arguments[first_param])
+
+        # 已取消等待的调用者不影响合并到同一条消息的其他调用者
+        return await asyncio.shield(get_outbound_msg_queue(bot_id).put(func, bound, priority, coalesce_key))
+
     return wrapper
     
 # -------- event内发送 -------- #
@@ -988,7 +1345,7 @@ async def send_at_msg(handler, event: MessageEvent, message: str):
 
 # -------- event外发送 -------- #
 
-@send_msg_func
+@send_msg_func(coalesce=True)
 async def send_group_msg_by_bot(group_id: int, content: str, bot: Bot = None):
     """
     在event外发送群聊消息
@@ -1006,7 +1363,7 @@ async def send_group_msg_by_bot(group_id: int, content: str, bot: Bot = None):
         return
     return await bot.send_group_msg(group_id=int(group_id), message=content)
 
-@send_msg_func
+@send_msg_func(coalesce=True)
 async def send_private_msg_by_bot(user_id: int, content: str, bot: Bot = None):
     """
     在event外发送私聊消息
@@ -2349,6 +2706,7 @@ class CmdHandler:
                                 raise ReplyException(f"没有找到该指令的帮助\n发送\"/help\"查看完整帮助")
 
                     # 执行函数
+                    _current_trigger_cmd.set(context.trigger_cmd)
                     return await handler_func(context)
                 
                 except NoReplyException:
@@ -2699,7 +3057,11 @@ _handler.check_superuser()
 @_handler.handle()
 async def _(ctx: HandlerContext):
     count = get_send_msg_daily_count(int(ctx.bot.self_id))
-    return await ctx.asend_reply_msg(f'该账号今日已发送消息数量: {count}')
+    msg = f'该账号今日已发送消息数量: {count}'
+    if stats := get_outbound_msg_queue_stats().get(int(ctx.bot.self_id)):
+        msg += f"\n发送队列: 排队{stats['queued']} 已发送{stats['sent']} 合并{stats['coalesced']} "
+        msg += f"超时丢弃{stats['expired']} 队满丢弃{stats['evicted']} 超出每日上限{stats['daily_limited']}"
+    return await ctx.asend_reply_msg(msg)
 
 # 删除Painter缓存
 _handler = CmdHandler(['/clear pcache', '/pcache clear'], utils_logger)
@@ -2716,11 +3078,41 @@ _handler.check_superuser()
 @_handler.handle()
 async def _(ctx: HandlerContext):
     ret = Painter.get_cache_key_mtimes()
+    stats = Painter.get_cache_stats()
     msg = f"当前Painter缓存的keys:\n"
     for key, mtime in ret.items():
         msg += f"{key}: {mtime.strftime('%Y-%m-%d %H:%M:%S')}\n"
+    msg += f"---\n"
+    msg += f"磁盘: {stats['disk_num']}个 {get_readable_file_size(stats['disk_bytes'])}\n"
+    msg += f"内存: {stats['mem_num']}个 {get_readable_file_size(stats['mem_bytes'])}\n"
+    msg += f"命中: 内存{stats['mem_hit']} 磁盘{stats['disk_hit']} 未命中{stats['miss']}\n"
+    msg += f"读取: {get_readable_file_size(stats['hit_bytes'])} 写入: {get_readable_file_size(stats['write_bytes'])}\n"
+    msg += f"淘汰: {stats['evict_num']}个 {get_readable_file_size(stats['evict_bytes'])}\n"
     return await ctx.asend_reply_msg(msg.strip())
 
+# 查看FileDB复制统计
+_handler = CmdHandler(['/dbstats'], utils_logger)
+_handler.check_superuser()
+@_handler.handle()
+async def _(ctx: HandlerContext):
+    stats = FileDB.get_copy_stats()
+    msg = f"get_copy: {stats['copy_num']}次 复制{get_readable_file_size(stats['copy_bytes'])}\n"
+    msg += f"get_snapshot: 复用{stats['snapshot_hit']}次 创建{stats['snapshot_num']}次 复制{get_readable_file_size(stats['snapshot_bytes'])}\n"
+    return await ctx.asend_reply_msg(msg.strip())
+
+# 查看API缓存统计
+_handler = CmdHandler(['/apicache'], utils_logger)
+_handler.check_superuser()
+@_handler.handle()
+async def _(ctx: HandlerContext):
+    msg = ""
+    for name, cache in _expirable_caches.items():
+        stats = cache.get_stats()
+        total = stats['hit'] + stats['miss']
+        hit_rate = stats['hit'] / total * 100 if total else 0
+        msg += f"{name}: {stats['num']}条 命中{stats['hit']}/{total}({hit_rate:.1f}%) 过期{stats['expire']} 淘汰{stats['evict']}\n"
+    return await ctx.asend_reply_msg(msg.strip() or "没有API缓存")
+
 # 安全模式
 _handler = CmdHandler(['/safe'], utils_logger)
 _handler.check_superuser()
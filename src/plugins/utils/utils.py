@@ -25,6 +25,7 @@ if _memray_at_startup := global_config.get('memray_at_startup.enable'):
 
 from typing import Optional, List, Tuple, Dict, Union, Any, Set, Callable
 import os
+import sys
 import os.path as osp
 from os.path import join as pjoin
 from pathlib import Path
@@ -44,6 +45,7 @@ import re
 import math
 import io
 import time
+import threading
 import zstandard
 
 import faulthandler
@@ -327,6 +329,8 @@ def start_repeat_with_interval(
     if delay is None:
         delay = random.uniform(STARTUP_TASK_MIN_DELAY, STARTUP_TASK_MAX_DELAY)
     async def task():
+        # 定时任务中的绘图优先级低于指令
+        set_painter_priority(PAINTER_PRIORITY_BACKGROUND)
         await asyncio.sleep(delay)
         try:
             error_count = 0
@@ -775,15 +779,124 @@ async def adump_json_zstd(data: dict, path: str):
 # ============================ 文件数据库 ============================ #
 
 FILE_DB_SAVE_INTERVAL_CFG = global_config.item('file_db.save_interval_seconds')
+FILE_DB_COMPACT_MIN_MB_CFG = global_config.item('file_db.compact_min_mb')
+
+class FrozenDict(dict):
+    """
+    只读的dict，用于FileDB.get_snapshot返回的快照，修改时抛出TypeError  
+    deepcopy时返回普通的可修改dict
+    """
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('FileDB快照是只读的，需要修改请使用get_copy或deepcopy')
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __hash__(self):
+        return id(self)
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return {k: deepcopy(v, memo) for k, v in self.items()}
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+class FrozenList(list):
+    """
+    只读的list，用于FileDB.get_snapshot返回的快照，修改时抛出TypeError  
+    deepcopy时返回普通的可修改list
+    """
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('FileDB快照是只读的，需要修改请使用get_copy或deepcopy')
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _readonly
+    append = extend = insert = pop = remove = clear = sort = reverse = _readonly
+
+    def __hash__(self):
+        return id(self)
+
+    def __copy__(self):
+        return list(self)
+
+    def __deepcopy__(self, memo):
+        return [deepcopy(v, memo) for v in self]
+
+    def __reduce__(self):
+        return (FrozenList, (list(self),))
+
+def _copy_json_obj(obj: Any, freeze: bool, memo: dict = None) -> tuple[Any, int]:
+    """
+    - 复制json类型的数据，返回(复制结果, 复制的容器字节数)
+    - freeze为True时dict转换为FrozenDict，list和tuple转换为FrozenList
+    - freeze为False时结果与deepcopy相同：只有dict/list/tuple本身（不包括子类）逐层复制，其他对象使用deepcopy
+    - 被多处引用的对象复制后仍共享同一个副本
+    """
+    if obj is None or isinstance(obj, (str, int, float, bool)):
+        return obj, 0
+    if memo is None:
+        memo = {}
+    if id(obj) in memo:
+        return memo[id(obj)], 0
+    if (isinstance(obj, dict) if freeze else type(obj) is dict):
+        nbytes = sys.getsizeof(obj)
+        ret = {}
+        for k, v in obj.items():
+            ret[k], n = _copy_json_obj(v, freeze, memo)
+            nbytes += n
+        if freeze:
+            ret = FrozenDict(ret)
+    elif (isinstance(obj, (list, tuple)) if freeze else type(obj) in (list, tuple)):
+        nbytes = sys.getsizeof(obj)
+        ret = []
+        for v in obj:
+            v, n = _copy_json_obj(v, freeze, memo)
+            ret.append(v)
+            nbytes += n
+        if freeze:
+            ret = FrozenList(ret)
+        elif type(obj) is tuple:
+            ret = tuple(ret)
+    else:
+        # 与deepcopy共用memo，保持与快速路径之间的共享关系
+        ret = deepcopy(obj, memo)
+        return ret, sys.getsizeof(ret)
+    memo[id(obj)] = ret
+    return ret, nbytes
+
+# 所有FileDB的文件读写都在该单线程中顺序执行，避免阻塞事件循环
+_file_db_io_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='file_db_io')
 
 class FileDB:
+    """
+    基于json文件的数据库  
+    修改以追加日志（{path}.journal，每行一条 [操作, key, value]）的形式写入，
+    日志大小超过快照大小（且超过file_db.compact_min_mb）时合并写入快照文件；
+    加载时读取快照后重放日志，文件读写都在后台线程中进行
+    """
     _updated_dbs: set['FileDB'] = set()
+    _copy_stats: Dict[str, int] = {
+        'copy_num': 0,          # get_copy调用次数
+        'copy_bytes': 0,        # get_copy复制的字节数
+        'snapshot_hit': 0,      # get_snapshot复用快照次数
+        'snapshot_num': 0,      # get_snapshot创建快照次数
+        'snapshot_bytes': 0,    # 创建快照复制的字节数
+    }
 
     def __init__(self, path: str, logger: Logger):
         self.path = os.path.abspath(path)
+        self.journal_path = self.path + '.journal'
         self.data = {}
         self.logger = logger
         self.loaded = False
+        self._pending: List[bytes] = []
+        self._pending_lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._flush_scheduled = False
+        self._snapshot_bytes = 0
+        self._journal_bytes = 0
+        self._need_compact = False
+        self._snapshots: Dict[tuple[str, ...], Any] = {}
 
     def __hash__(self) -> int:
         return hash(self.path)
@@ -798,26 +911,86 @@ class FileDB:
             return
         try:
             self.data = load_json(self.path)
+            self._snapshot_bytes = os.path.getsize(self.path)
             self.logger.debug(f'加载数据库 {self.path} 成功')
         except:
             self.logger.debug(f'加载数据库 {self.path} 失败 使用空数据')
             self.data = {}
+        self._replay_journal()
         self.loaded = True
 
-    def _after_change(self):
+    def _replay_journal(self):
+        """
+        - 在快照上重放日志，最后一行不完整（写入时崩溃）时忽略
+        """
+        if not os.path.exists(self.journal_path):
+            return
+        num, offset = 0, 0
+        with open(self.journal_path, 'rb') as f:
+            for line in f:
+                try:
+                    op, key, value = orjson.loads(line)
+                except:
+                    # 截断损坏的部分，避免之后追加的日志无法被重放
+                    self.logger.warning(f'数据库 {self.path} 日志第{num + 1}条损坏，忽略之后的日志')
+                    break
+                if op == 's':
+                    d, k = self._get_last_dict_and_key(key, create_path=True, ensure_load=False)
+                    d[k] = value
+                elif op == 'd':
+                    d, k = self._get_last_dict_and_key(key, ensure_load=False)
+                    if d is not None:
+                        d.pop(k, None)
+                num += 1
+                offset += len(line)
+        if offset != os.path.getsize(self.journal_path):
+            os.truncate(self.journal_path, offset)
+        self._journal_bytes = offset
+        if num:
+            self.logger.debug(f'数据库 {self.path} 重放日志 {num} 条')
+
+    @staticmethod
+    def _split_key(key: str) -> tuple[str, ...]:
+        return tuple(k.replace("&#46;", ".") for k in key.replace("\\.", "&#46;").split('.'))
+
+    def _invalidate_snapshots(self, key: str):
+        """
+        - 清除与修改的key在同一路径上（祖先或后代）的快照
+        """
+        if not self._snapshots:
+            return
+        path = self._split_key(key)
+        for p in list(self._snapshots):
+            n = min(len(p), len(path))
+            if p[:n] == path[:n]:
+                del self._snapshots[p]
+
+    def _after_change(self, op: str, key: str, value: Any = None):
+        self._invalidate_snapshots(key)
+        try:
+            entry = orjson.dumps([op, key, value]) + b'\n'
+        except:
+            self.logger.print_exc(f'序列化数据库 {self.path} {key} 的修改失败，将在下次合并时写入完整快照')
+            entry = None
+        with self._pending_lock:
+            if entry is None:
+                self._need_compact = True
+            else:
+                self._pending.append(entry)
         if FILE_DB_SAVE_INTERVAL_CFG.get() == 0:
-            self.save()
+            self._schedule_flush()
         else:
             FileDB._updated_dbs.add(self)
 
-    def _get_last_dict_and_key(self, key: str, create_path: bool = False) -> tuple[dict | None, str | None]:
+    def _get_last_dict_and_key(self, key: str, create_path: bool = False, ensure_load: bool = True) -> tuple[dict | None, str | None]:
         """
         - 从多层key获取最后一层dict和key
         - 设置create_path时找不到会创建直到last_dict的路径，否则返回(None,None)
         - 设置create_path后需要自行保证_after_change被调用
         """
         assert isinstance(key, str), f'key: "{key}" 必须是字符串，当前类型: {type(key)}'
-        self._ensure_load()
+        if ensure_load:
+            self._ensure_load()
         key = key.replace("\.", "&#46;")
         keys = key.split('.')
         last_dict = self.data
@@ -840,14 +1013,73 @@ class FileDB:
         self._ensure_load()
         return self.data.keys()
 
+    def _schedule_flush(self, compact: bool = False):
+        """
+        - 在后台线程中写入日志，已有未开始的写入任务时不重复提交
+        """
+        with self._pending_lock:
+            if self._flush_scheduled and not compact:
+                return
+            self._flush_scheduled = True
+        return _file_db_io_executor.submit(self._flush, compact)
+
+    def _flush(self, compact: bool = False):
+        """
+        - 将未写入的修改追加到日志，日志过大时合并为快照，在后台线程中执行
+        """
+        try:
+            with self._io_lock:
+                with self._pending_lock:
+                    self._flush_scheduled = False
+                    entries, self._pending = self._pending, []
+                    compact = compact or self._need_compact
+                if not compact and entries:
+                    buffer = b''.join(entries)
+                    os.makedirs(os.path.dirname(self.journal_path), exist_ok=True)
+                    with open(self.journal_path, 'ab') as f:
+                        f.write(buffer)
+                        f.flush()
+                        os.fsync(f.fileno())
+                    self._journal_bytes += len(buffer)
+                    compact_min_bytes = FILE_DB_COMPACT_MIN_MB_CFG.get(1) * 1024 * 1024
+                    compact = self._journal_bytes > max(self._snapshot_bytes, compact_min_bytes)
+                if compact:
+                    self._compact()
+        except:
+            self.logger.print_exc(f'保存数据库 {self.path} 失败')
+
+    def _compact(self):
+        """
+        - 写入完整快照并清空日志，需要持有_io_lock  
+        快照替换完成后才截断日志，在两者之间崩溃时重放日志得到的结果相同
+        """
+        with self._pending_lock:
+            # 快照包含了之前的所有修改，丢弃尚未写入日志的条目
+            self._pending.clear()
+            self._need_compact = False
+        # orjson序列化时持有GIL，得到的是一致的快照
+        buffer = orjson.dumps(self.data, option=orjson.OPT_INDENT_2)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(buffer)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self._snapshot_bytes = len(buffer)
+        self._journal_bytes = 0
+        self.logger.debug(f'保存数据库快照 {self.path} ({len(buffer) / 1024:.1f}KB)')
+
     def save(self):
         """
-        - 保存数据到文件，在修改后会被自动调用，一般不需要手动调用
+        - 立即保存完整快照到文件，修改会自动写入日志，一般不需要手动调用
         """
         try:
             self._ensure_load()
-            dump_json(self.data, self.path)
-            self.logger.debug(f'保存数据库 {self.path}')
+            with self._io_lock:
+                self._compact()
         except:
             self.logger.print_exc(f'保存数据库 {self.path} 失败')
 
@@ -867,12 +1099,43 @@ class FileDB:
         """
         - 获取某个key的值的深拷贝，找不到返回default的深拷贝
         - 支持多层key，用点号分隔，如"a.b.c"
+        - 只读取不修改时使用get_snapshot可以避免每次复制
         """
         self._ensure_load()
         d, k = self._get_last_dict_and_key(key)
-        if d is None:
-            return deepcopy(default)
-        return deepcopy(d.get(k, default))
+        value = default if d is None else d.get(k, default)
+        ret, nbytes = _copy_json_obj(value, freeze=False)
+        FileDB._copy_stats['copy_num'] += 1
+        FileDB._copy_stats['copy_bytes'] += nbytes
+        return ret
+
+    def get_snapshot(self, key: str, default: Any=None) -> Any:
+        """
+        - 获取某个key的值的只读快照（dict为FrozenDict，list为FrozenList），找不到返回default
+        - 支持多层key，用点号分隔，如"a.b.c"
+        - 快照在该路径上的下一次set/delete前会被复用，适合频繁读取的大数据；
+        通过get获取对象并原地修改而不调用set时快照不会更新
+        """
+        self._ensure_load()
+        path = self._split_key(key)
+        if path in self._snapshots:
+            FileDB._copy_stats['snapshot_hit'] += 1
+            return self._snapshots[path]
+        d, k = self._get_last_dict_and_key(key)
+        if d is None or k not in d:
+            return default
+        ret, nbytes = _copy_json_obj(d[k], freeze=True)
+        self._snapshots[path] = ret
+        FileDB._copy_stats['snapshot_num'] += 1
+        FileDB._copy_stats['snapshot_bytes'] += nbytes
+        return ret
+
+    @classmethod
+    def get_copy_stats(cls) -> Dict[str, int]:
+        """
+        - 获取get_copy和get_snapshot的复制统计
+        """
+        return dict(cls._copy_stats)
 
     def set(self, key: str, value: Any):
         """
@@ -883,7 +1146,7 @@ class FileDB:
         self.logger.debug(f'设置数据库 {self.path} {key}')
         d, k = self._get_last_dict_and_key(key, create_path=True)
         d[k] = value
-        self._after_change()
+        self._after_change('s', key, value)
 
     def delete(self, key: str):
         """
@@ -895,16 +1158,21 @@ class FileDB:
         d, k = self._get_last_dict_and_key(key)
         if d is not None and k in d:
             del d[k]
-            self._after_change()
+            self._after_change('d', key)
 
     @classmethod
-    def save_all_changed(cls):
+    def save_all_changed(cls, wait: bool = False, compact: bool = False):
         """
-        - 保存所有修改过的数据库
+        - 将所有修改过的数据库提交到后台线程保存，wait为True时等待保存完成
         """
+        futures = []
         for db in list(cls._updated_dbs):
-            db.save()
+            futures.append(db._schedule_flush(compact))
         cls._updated_dbs.clear()
+        if wait:
+            for future in futures:
+                if future is not None:
+                    future.result()
 
 
 @repeat_with_interval(FILE_DB_SAVE_INTERVAL_CFG, '保存文件数据库', utils_logger)
@@ -913,7 +1181,10 @@ async def _save_changed_file_dbs():
 
 @on_shutdown()
 def _save_all_file_dbs_on_shutdown():
-    FileDB.save_all_changed()
+    for db in _file_dbs.values():
+        if db._pending or db._journal_bytes or db._need_compact:
+            FileDB._updated_dbs.add(db)
+    FileDB.save_all_changed(wait=True, compact=True)
 
 
 _file_dbs: Dict[str, FileDB] = {}
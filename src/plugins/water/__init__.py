@@ -1,6 +1,6 @@
 from ..utils import *
 from ..record import before_record_hook, after_record_hook
-from .sql import insert_hashes, query_by_hash, query_by_unique_id
+from .sql import insert_hashes, query_by_hash, query_by_unique_id, query_by_near_hash
 from asyncio import CancelledError, Queue
 
 config = Config("water")
@@ -13,6 +13,8 @@ autowater_gwls = {
     t: get_group_white_list(file_db, logger, f'autowater_{t}', is_service=False)
     for t in ['text', 'image', 'stamp', 'json', 'video', 'forward']
 }
+NEAR_IMAGE_MAX_DISTANCE_CFG = config.item('near_image_max_distance')
+
 autowater_type_desc = {
     'text': '文本',
     'image': '图片',
@@ -188,7 +190,12 @@ async def get_hash_from_msg(group_id, msg, types=None):
 async def get_hashes_water_info(group_id, msg_id, hashes):
     ret = []
     for h in hashes:
-        recs = await query_by_hash(group_id, h['type'], h['hash'])
+        max_distance = NEAR_IMAGE_MAX_DISTANCE_CFG.get(0)
+        if h['type'] == 'image' and max_distance > 0:
+            # 图片按phash的汉明距离查找近似重复，重新压缩过的图片也能匹配
+            recs = await query_by_near_hash(group_id, h['type'], h['hash'], max_distance)
+        else:
+            recs = await query_by_hash(group_id, h['type'], h['hash'])
         recs = [rec for rec in sorted(recs, key=lambda x: x['time']) if rec['msg_id'] != msg_id]    # 排序并去掉查询的消息本身
         fst, lst, topk_users = None, None, None
         if recs:
@@ -1,5 +1,6 @@
 from ..utils import *
 import aiosqlite
+import itertools
 from datetime import datetime
 
 
@@ -8,9 +9,16 @@ logger = get_logger("Water")
 
 DB_PATH = "data/water/hash.sqlite"
 HASH_TABLE_NAME = "hash_{}"
+# 图片phash的多重索引哈希（multi-index hashing）表，64位phash分为4段16位分别建立索引，
+# 汉明距离不超过k的两个phash至少有一段的距离不超过k//4，因此只需要查找每段附近的少量取值
+MIH_TABLE_NAME = "hash_{}_mih"
+MIH_TYPES = ('image',)
+MIH_CHUNK_NUM = 4
+MIH_CHUNK_BITS = 16
 
 _conn: aiosqlite.Connection = None         # 连接
 _created_table_group_ids = set()             # 是否创建过表
+_mih_synced_ids: dict[int, int] = {}         # 多重索引表已同步到的hash记录ID
 
 
 # 获得连接 
@@ -39,13 +47,82 @@ async def get_conn(group_id: int | list[int]):
                     unique_id TEXT
                 )
             """)       
+            table = HASH_TABLE_NAME.format(gid)
+            await _conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_type_phash ON {table} (type, phash)")
+            await _conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_type_unique_id ON {table} (type, unique_id)")
+            await _conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_type_msg_id ON {table} (type, msg_id)")
+            # 创建多重索引表 (hash记录ID, 类型, phash的4段)
+            mih_table = MIH_TABLE_NAME.format(gid)
+            await _conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {mih_table} (
+                    id INTEGER PRIMARY KEY,
+                    type TEXT,
+                    {', '.join(f'c{i} INTEGER' for i in range(MIH_CHUNK_NUM))}
+                )
+            """)
+            for i in range(MIH_CHUNK_NUM):
+                await _conn.execute(f"CREATE INDEX IF NOT EXISTS {mih_table}_c{i} ON {mih_table} (type, c{i})")
             _created_table_group_ids.add(gid)
             table_created = True
+            # 补全已有记录的多重索引
+            await _sync_mih(gid)
     if table_created:
         await _conn.commit()
 
     return _conn
 
+# 把phash分为MIH_CHUNK_NUM段
+def split_phash(phash: int) -> list[int]:
+    mask = (1 << MIH_CHUNK_BITS) - 1
+    return [(phash >> (i * MIH_CHUNK_BITS)) & mask for i in range(MIH_CHUNK_NUM)]
+
+# 合并MIH_CHUNK_NUM段为phash
+def merge_phash(chunks: list[int]) -> int:
+    return sum(c << (i * MIH_CHUNK_BITS) for i, c in enumerate(chunks))
+
+# 获取与某段取值汉明距离不超过radius的所有取值
+def get_chunk_neighbors(value: int, radius: int) -> list[int]:
+    ret = [value]
+    for r in range(1, radius + 1):
+        for bits in itertools.combinations(range(MIH_CHUNK_BITS), r):
+            v = value
+            for b in bits:
+                v ^= 1 << b
+            ret.append(v)
+    return ret
+
+# 把hash表中新增的图片记录同步到多重索引表（不提交）
+async def _sync_mih(group_id: int):
+    table, mih_table = HASH_TABLE_NAME.format(group_id), MIH_TABLE_NAME.format(group_id)
+    last_id = _mih_synced_ids.get(group_id)
+    if last_id is None:
+        cursor = await _conn.execute(f"SELECT MAX(id) FROM {mih_table}")
+        last_id = (await cursor.fetchone())[0] or 0
+        await cursor.close()
+    cursor = await _conn.execute(f"""
+        SELECT id, type, phash FROM {table}
+        WHERE id > ? AND type IN ({', '.join('?' * len(MIH_TYPES))})
+        ORDER BY id
+        """, (last_id, *MIH_TYPES))
+    rows = await cursor.fetchall()
+    await cursor.close()
+    values = []
+    for id, type, phash in rows:
+        try:
+            values.append((id, type, *split_phash(int(phash))))
+        except (TypeError, ValueError):
+            continue
+    if values:
+        await _conn.executemany(f"""
+            INSERT OR IGNORE INTO {mih_table} (id, type, {', '.join(f'c{i}' for i in range(MIH_CHUNK_NUM))})
+            VALUES (?, ?, {', '.join('?' * MIH_CHUNK_NUM)})
+            """, values)
+        if len(values) > 1000:
+            logger.info(f"补全 {table} 表的 {len(values)} 条图片多重索引")
+    if rows:
+        last_id = rows[-1][0]
+    _mih_synced_ids[group_id] = last_id
+
 # 插入一条hash数据
 async def insert_hash(group_id: int, type: str, hash: str, msg_id: int, user_id: int, nickname: str, time: int, unique_id: str):
     if isinstance(time, datetime):
@@ -55,6 +132,8 @@ async def insert_hash(group_id: int, type: str, hash: str, msg_id: int, user_id:
         INSERT INTO {HASH_TABLE_NAME.format(group_id)} (type, phash, msg_id, user_id, nickname, time, unique_id)
         VALUES (?,?,?,?,?,?,?)
         """, (type, hash, msg_id, user_id, nickname, time, unique_id))
+    if type in MIH_TYPES:
+        await _sync_mih(group_id)
     await conn.commit()
     # logger.debug(f"插入hash数据 type={type} hash={hash} msg_id={msg_id} user_id={user_id} nickname={nickname} time={time} unique_id={unique_id}")
 
@@ -83,6 +162,8 @@ async def insert_hashes(hashes: list):
                 hash['unique_id']
             ))
         await conn.executemany(insert_query, values)
+        if any(hash['type'] in MIH_TYPES for hash in hashes):
+            await _sync_mih(group_id)
     await conn.commit()
 
     logger.debug(f"插入来自 {len(hashes)} 个群的 {len(hashes)} 条hash数据")
@@ -115,6 +196,46 @@ async def query_by_hash(group_id: int, type: str, hash: str) -> list:
     await cursor.close()
     return [hash_row_to_dict(row) for row in rows]
 
+# 根据类型和phash查询汉明距离不超过max_distance的记录，返回的记录带有distance字段
+async def query_by_near_hash(group_id: int, type: str, hash: str, max_distance: int) -> list:
+    assert type in MIH_TYPES, f"类型 {type} 不支持近似查询"
+    phash = int(hash)
+    conn = await get_conn(group_id)
+    mih_table = MIH_TABLE_NAME.format(group_id)
+    radius = max_distance // MIH_CHUNK_NUM
+    sqls, params = [], []
+    for i, chunk in enumerate(split_phash(phash)):
+        neighbors = get_chunk_neighbors(chunk, radius)
+        sqls.append(f"""
+            SELECT id, {', '.join(f'c{j}' for j in range(MIH_CHUNK_NUM))} FROM {mih_table}
+            WHERE type = ? AND c{i} IN ({', '.join('?' * len(neighbors))})
+        """)
+        params += [type, *neighbors]
+    cursor = await conn.execute(" UNION ".join(sqls), params)
+    rows = await cursor.fetchall()
+    await cursor.close()
+
+    distances = {}
+    for id, *chunks in rows:
+        distance = (phash ^ merge_phash(chunks)).bit_count()
+        if distance <= max_distance:
+            distances[id] = distance
+
+    ret = []
+    ids = list(distances)
+    for i in range(0, len(ids), 500):
+        batch = ids[i:i+500]
+        cursor = await conn.execute(f"""
+            SELECT * FROM {HASH_TABLE_NAME.format(group_id)}
+            WHERE id IN ({', '.join('?' * len(batch))})
+            """, batch)
+        for row in await cursor.fetchall():
+            rec = hash_row_to_dict(row)
+            rec['distance'] = distances[rec['id']]
+            ret.append(rec)
+        await cursor.close()
+    return ret
+
 # 根据类型和msg_id查询记录
 async def query_by_msg_id(group_id: int, type: str, msg_id: int) -> list:
     conn = await get_conn(group_id)
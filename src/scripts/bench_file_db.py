@@ -0,0 +1,80 @@
+"""
+FileDB连续set的延迟测试，模拟绑定、订阅列表等较大的数据库在短时间内被频繁修改的情况，
+对比修改后整个文件同步重写（file_db.save_interval_seconds为0时的旧行为）与追加日志的set延迟
+
+在bot根目录下运行（需要能读取 config/global.yaml）:
+    python src/scripts/bench_file_db.py --users 20000 --sets 2000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import nonebot
+nonebot.init()
+
+from plugins.utils.utils import FileDB, dump_json, get_logger, _file_db_io_executor
+
+
+def make_data(user_num: int) -> dict:
+    rng = random.Random(0)
+    return {
+        'bind_list': {
+            str(10000000 + i): {'jp': str(rng.randrange(10**15, 10**16)), 'cn': str(rng.randrange(10**15, 10**16))}
+            for i in range(user_num)
+        },
+        'sub_list': {str(i): [str(rng.randrange(10**8)) for _ in range(20)] for i in range(user_num // 10)},
+    }
+
+def percentile(ts: list[float], p: float) -> float:
+    ts = sorted(ts)
+    return ts[min(len(ts) - 1, int(len(ts) * p))]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--sets', type=int, default=2000)
+    args = parser.parse_args()
+
+    data = make_data(args.users)
+    rng = random.Random(1)
+    keys = [f"bind_list.{10000000 + rng.randrange(args.users)}.jp" for _ in range(args.sets)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # 优化前：每次set后同步重写整个文件
+        path = os.path.join(tmp, 'before.json')
+        dump_json(data, path)
+        ts = []
+        for i, key in enumerate(keys):
+            t = time.perf_counter()
+            d, k = data['bind_list'], key.split('.')[1]
+            d[k]['jp'] = str(i)
+            dump_json(data, path)
+            ts.append(time.perf_counter() - t)
+        size_mb = os.path.getsize(path) / 1024 / 1024
+        print(f"db size={size_mb:.1f}MB sets={args.sets}")
+        print(f"before (full rewrite):  p50={percentile(ts, 0.5) * 1000:8.3f}ms p99={percentile(ts, 0.99) * 1000:8.3f}ms")
+
+        # 优化后：set只追加日志条目，写入在后台线程进行
+        path = os.path.join(tmp, 'after.json')
+        dump_json(data, path)
+        db = FileDB(path, get_logger('Bench'))
+        db.get('bind_list')
+        ts = []
+        t0 = time.perf_counter()
+        for i, key in enumerate(keys):
+            t = time.perf_counter()
+            db.set(key, str(i))
+            db._schedule_flush()
+            ts.append(time.perf_counter() - t)
+        _file_db_io_executor.submit(lambda: None).result()
+        total = time.perf_counter() - t0
+        print(f"after  (journal):       p50={percentile(ts, 0.5) * 1000:8.3f}ms p99={percentile(ts, 0.99) * 1000:8.3f}ms (flushed in {total:.2f}s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""
+歌曲搜索（search_music 中的曲名精确匹配 + 子串/编辑距离匹配）的延迟测试，
+对比每次查询遍历所有歌曲逐对计算编辑距离的旧实现与预构建搜索索引后批量计算的耗时
+
+使用本地缓存的MasterData、曲名翻译和别名库，查询语料可以通过 --queries 指定（每行一条，例如从聊天记录中提取的查曲文本），
+不指定时使用别名库中的所有别名及其截断/错字变体
+
+在bot根目录下运行（需要能读取 config/global.yaml，且已缓存对应区服的 musics 和 musicDifficulties）:
+    python src/scripts/bench_music_search.py --region jp --queries queries.txt
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import nonebot
+nonebot.init()
+
+import rapidfuzz
+from plugins.utils.utils import load_json, clean_name
+from plugins.sekai.asset import MASTER_DB_CACHE_DIR
+from plugins.sekai.modules.music import MusicSearchIndex, music_cn_titles, music_en_titles
+
+
+def percentile(ts: list[float], p: float) -> float:
+    ts = sorted(ts)
+    return ts[min(len(ts) - 1, int(len(ts) * p))]
+
+def load_queries(path: str | None, aliases: dict[int, list[str]], num: int) -> list[str]:
+    if path:
+        with open(path, encoding='utf-8') as f:
+            return [line.strip() for line in f if line.strip()]
+    rng = random.Random(0)
+    all_aliases = [a for v in aliases.values() for a in v]
+    queries = []
+    for _ in range(num):
+        alias = rng.choice(all_aliases)
+        r = rng.random()
+        if r < 0.4:
+            queries.append(alias)
+        elif r < 0.7 and len(alias) > 1:
+            start = rng.randrange(len(alias) - 1)
+            queries.append(alias[start:start + rng.randint(1, 4)])
+        else:
+            chars = list(alias)
+            chars[rng.randrange(len(chars))] = rng.choice(rng.choice(all_aliases))
+            queries.append("".join(chars))
+    return queries
+
+def search_before(
+    clean_q: str, musics: list[dict], cn_titles: dict, en_titles: dict,
+    aliases: dict[int, list[str]], diff: str | None, music_diffs: dict[int, set[str]],
+) -> list[tuple[dict, float]]:
+    """
+    优化前：逐首歌曲收集并清洗名称，逐对计算编辑距离
+    """
+    for music in musics:
+        titles = [clean_name(music['title'])]
+        if cn_title := cn_titles.get(str(music['id'])):
+            titles.append(clean_name(cn_title))
+        if en_title := en_titles.get(str(music['id'])):
+            titles.append(clean_name(en_title))
+        if clean_q in titles:
+            return [(music, 1.0)]
+    music_sims = []
+    for music in musics:
+        if diff and diff not in music_diffs.get(music['id'], set()):
+            continue
+        names = { music['title'], music['pronunciation'] }
+        if cn_title := cn_titles.get(str(music['id'])):
+            names.add(cn_title)
+        if en_title := en_titles.get(str(music['id'])):
+            names.add(en_title)
+        names.update(aliases.get(music['id'], []))
+        min_dist = 1e9
+        for name in names:
+            name = clean_name(name)
+            if clean_q in name:
+                dist = -len(clean_q) / len(name) if len(name) else 0
+            else:
+                dist = 1.0 - rapidfuzz.fuzz.ratio(clean_q, name) / 100.0
+            min_dist = min(min_dist, dist)
+        sim = 1.0 + -min_dist if min_dist < 0 else 1.0 - min_dist
+        if sim > 0.7:
+            music_sims.append((music, sim))
+    music_sims.sort(key=lambda x: x[1], reverse=True)
+    return music_sims[:4]
+
+def search_after(clean_q: str, index: MusicSearchIndex, diff: str | None) -> list[tuple[dict, float]]:
+    if music := index.find_title(clean_q):
+        return [(music, 1.0)]
+    return index.search(clean_q, diff, 0.7, 4)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--region', type=str, default='jp')
+    parser.add_argument('--queries', type=str, default=None)
+    parser.add_argument('--num', type=int, default=2000)
+    parser.add_argument('--diff', type=str, default=None)
+    args = parser.parse_args()
+
+    musics = load_json(os.path.join(MASTER_DB_CACHE_DIR, args.region, "musics.json"))
+    diffs = load_json(os.path.join(MASTER_DB_CACHE_DIR, args.region, "musicDifficulties.json"))
+    cn_titles = load_json(music_cn_titles.file_cache_path)
+    en_titles = load_json(music_en_titles.file_cache_path)
+    aliases = { int(mid): v for mid, v in load_json("data/sekai/music_alias/local.json").get('alias', {}).items() }
+    music_diffs: dict[int, set[str]] = {}
+    for d in diffs:
+        music_diffs.setdefault(d['musicId'], set()).add(d['musicDifficulty'])
+    queries = [clean_name(q) for q in load_queries(args.queries, aliases, args.num)]
+    print(f"region={args.region} musics={len(musics)} aliases={sum(len(v) for v in aliases.values())} queries={len(queries)}")
+
+    ts, before_results = [], []
+    for q in queries:
+        t = time.perf_counter()
+        before_results.append(search_before(q, musics, cn_titles, en_titles, aliases, args.diff, music_diffs))
+        ts.append(time.perf_counter() - t)
+    print(f"before (per-pair loop): p50={percentile(ts, 0.5) * 1000:8.3f}ms p99={percentile(ts, 0.99) * 1000:8.3f}ms")
+
+    t = time.perf_counter()
+    index = MusicSearchIndex(None, musics, diffs, cn_titles, en_titles, aliases)
+    print(f"index build: {(time.perf_counter() - t) * 1000:.1f}ms names={len(index.names)}")
+    ts, mismatch = [], 0
+    for q, before in zip(queries, before_results):
+        t = time.perf_counter()
+        after = search_after(q, index, args.diff)
+        ts.append(time.perf_counter() - t)
+        if [m['id'] for m, _ in before] != [m['id'] for m, _ in after]:
+            mismatch += 1
+    print(f"after  (search index):  p50={percentile(ts, 0.5) * 1000:8.3f}ms p99={percentile(ts, 0.99) * 1000:8.3f}ms mismatch={mismatch}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Painter缓存哈希计算的微基准测试，模拟 /pjsk box 卡牌列表绘制（compose_box_image）的操作序列，
+对比无指纹的全量像素哈希与带指纹、按操作缓存哈希后的耗时
+
+在bot根目录下运行（需要能读取 config/global.yaml）:
+    python src/scripts/bench_painter_hash.py --cards 400 --repeat 5
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from PIL import Image
+import numpy as np
+from plugins.draw.painter import (
+    Painter,
+    deterministic_hash,
+    set_image_fingerprint,
+    IMAGE_FINGERPRINT_ATTR,
+    FontDesc,
+)
+
+
+def make_images(card_num: int, thumb_size: int) -> tuple[list[Image.Image], list[Image.Image]]:
+    rng = np.random.default_rng(0)
+    thumbs = [
+        Image.fromarray(rng.integers(0, 256, (thumb_size, thumb_size, 4), dtype=np.uint8), 'RGBA')
+        for _ in range(card_num)
+    ]
+    # 角色图标和限定标识等在绘制中反复使用的小图
+    icons = [
+        Image.fromarray(rng.integers(0, 256, (64, 64, 4), dtype=np.uint8), 'RGBA')
+        for _ in range(28)
+    ]
+    return thumbs, icons
+
+def build_painter(thumbs: list[Image.Image], icons: list[Image.Image], sz: int) -> Painter:
+    p = Painter(size=(4096, 4096))
+    p.roundrect((0, 0), (4096, 4096), (255, 255, 255, 200), 16)
+    for i, thumb in enumerate(thumbs):
+        x, y = (i % 64) * (sz + 4), (i // 64) * (sz + 4)
+        if i % 16 == 0:
+            p.paste(icons[(i // 16) % len(icons)], (x, y), (sz, sz))
+            p.rect((x, y + sz), (sz, 4), (100, 100, 200, 255))
+        p.set_region((x, y), (sz, sz))
+        p.paste(thumb, (0, 0), (sz, sz))
+        if i % 7 == 0:
+            p.paste(icons[i % len(icons)], (0, 0), (int(sz * 0.6), None))
+        p.text(f"{i}", (0, sz), FontDesc("SourceHanSansCN-Regular", 12), (0, 0, 0, 255))
+        p.restore_region()
+    return p
+
+def timeit(func, repeat: int) -> float:
+    ts = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        func()
+        ts.append(time.perf_counter() - t)
+    return min(ts)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cards', type=int, default=400)
+    parser.add_argument('--thumb-size', type=int, default=128)
+    parser.add_argument('--sz', type=int, default=48)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    thumbs, icons = make_images(args.cards, args.thumb_size)
+    total_mb = sum(img.size[0] * img.size[1] * 4 for img in thumbs + icons) / 1024 / 1024
+    print(f"cards={args.cards} thumb={args.thumb_size}px images={len(thumbs) + len(icons)} pixels={total_mb:.1f}MB")
+
+    # 优化前：整个操作列表每次都全量序列化，所有图片读取像素
+    for img in thumbs + icons:
+        if hasattr(img, IMAGE_FINGERPRINT_ATTR):
+            delattr(img, IMAGE_FINGERPRINT_ATTR)
+    p = build_painter(thumbs, icons, args.sz)
+    before = timeit(lambda: deterministic_hash({"key": "bench", "op": p.operations}), args.repeat)
+
+    # 优化后：资源图片带指纹，操作哈希只计算一次
+    for i, img in enumerate(thumbs + icons):
+        set_image_fingerprint(img, f"bench:{i}")
+    def cold():
+        p = build_painter(thumbs, icons, args.sz)
+        t = time.perf_counter()
+        p.get_operations_hash("bench")
+        return time.perf_counter() - t
+    after_cold = min(cold() for _ in range(args.repeat))
+    p = build_painter(thumbs, icons, args.sz)
+    p.get_operations_hash("bench")
+    after_warm = timeit(lambda: p.get_operations_hash("bench"), args.repeat)
+
+    print(f"ops={len(p.operations)}")
+    print(f"before (full pixel hash):        {before * 1000:8.2f} ms")
+    print(f"after  (fingerprint, first call): {after_cold * 1000:8.2f} ms  x{before / after_cold:.1f}")
+    print(f"after  (memoized op hashes):      {after_warm * 1000:8.2f} ms  x{before / after_warm:.1f}")
+
+
+if __name__ == '__main__':
+    main()
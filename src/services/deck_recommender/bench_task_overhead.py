@@ -0,0 +1,108 @@
+"""
+组卡任务的每任务额外开销测试（不实际组卡的no-op组卡任务）
+
+1. worker内组卡前准备：旧实现每个任务读取一次版本数据库 deckrec.json 并比较版本，
+   新实现由主进程推送数据更新，任务只查询一次已加载的区服数据
+2. 经过调度器的端到端开销：提交no-op组卡任务到worker进程并取回结果的延迟和吞吐
+
+在组卡服务目录下运行（需要已通过 /update_data 同步过对应区服的数据，userdata为用户数据json文件）:
+    python bench_task_overhead.py --region jp --userdata userdata.json --num 2000
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+from hashlib import md5
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from utils import *
+from config import *
+from worker import Worker, WorkerScheduler
+
+
+def percentile(ts: list[float], p: float) -> float:
+    ts = sorted(ts)
+    return ts[min(len(ts) - 1, int(len(ts) * p))]
+
+def bench_prepare(region: str, num: int):
+    db = load_json(DB_PATH, default={})
+    masterdata_version = db.get('masterdata_version', {}).get(region)
+    musicmetas_update_ts = db.get('musicmetas_update_ts', {}).get(region)
+
+    # 优化前：每个任务读取版本数据库并比较版本
+    loaded = { 'masterdata_version': masterdata_version, 'musicmetas_update_ts': musicmetas_update_ts }
+    ts = []
+    for _ in range(num):
+        t = time.perf_counter()
+        db = load_json(DB_PATH, default={})
+        _ = loaded['masterdata_version'] != db.get('masterdata_version', {}).get(region)
+        _ = loaded['musicmetas_update_ts'] != db.get('musicmetas_update_ts', {}).get(region)
+        ts.append(time.perf_counter() - t)
+    print(f"prepare before (load db):    p50={percentile(ts, 0.5) * 1e6:8.1f}us p99={percentile(ts, 0.99) * 1e6:8.1f}us")
+
+    # 优化后：查询已加载的区服数据
+    worker = Worker(0, 1)
+    worker.init()
+    t = time.perf_counter()
+    worker.update_data(region, masterdata_version, musicmetas_update_ts)
+    print(f"region data load: {time.perf_counter() - t:.2f}s")
+    ts = []
+    for _ in range(num):
+        t = time.perf_counter()
+        worker._get_region_data(region)
+        ts.append(time.perf_counter() - t)
+    print(f"prepare after (dict lookup): p50={percentile(ts, 0.5) * 1e6:8.1f}us p99={percentile(ts, 0.99) * 1e6:8.1f}us")
+
+async def bench_scheduler(region: str, userdata_bytes: bytes, num: int, concurrency: int):
+    userdata_hash = md5(userdata_bytes).hexdigest()
+
+    async def run_one() -> float:
+        t = time.perf_counter()
+        task = await WorkerScheduler.submit(
+            'noop_recommend', (region, {}, userdata_hash),
+            userdata_hash=userdata_hash, userdata_bytes=userdata_bytes,
+        )
+        result = await task.future
+        assert result['status'] == 'success', result.get('message')
+        return time.perf_counter() - t
+
+    # 预热：等待worker启动并加载数据，各worker缓存用户数据
+    await asyncio.gather(*[run_one() for _ in range(WorkerScheduler.worker_num * 2)])
+
+    ts = []
+    async def client(n: int):
+        for _ in range(n):
+            ts.append(await run_one())
+    start = time.perf_counter()
+    await asyncio.gather(*[client(num // concurrency) for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    print(f"scheduler no-op task:        p50={percentile(ts, 0.5) * 1e3:8.3f}ms p99={percentile(ts, 0.99) * 1e3:8.3f}ms throughput={len(ts) / elapsed:.0f}/s")
+    metrics = WorkerScheduler.get_metrics()
+    print(f"wait_time p50={metrics['wait_time_p50'] * 1e3:.3f}ms p99={metrics['wait_time_p99'] * 1e3:.3f}ms affinity_hit={metrics['affinity_hit']}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--region', type=str, default='jp')
+    parser.add_argument('--userdata', type=str, required=True)
+    parser.add_argument('--num', type=int, default=2000)
+    parser.add_argument('--worker_num', type=int, default=WORKER_NUM)
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+
+    with open(args.userdata, 'rb') as f:
+        userdata_bytes = f.read()
+
+    bench_prepare(args.region, args.num)
+
+    WorkerScheduler.init_workers(args.worker_num)
+    try:
+        asyncio.run(bench_scheduler(args.region, userdata_bytes, args.num, args.concurrency))
+    finally:
+        for p in WorkerScheduler.all_processes.values():
+            p.kill()
+
+
+if __name__ == '__main__':
+    main()
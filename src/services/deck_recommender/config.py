@@ -13,4 +13,13 @@ PORT = CONFIG.get('port', 45556)
 WORKER_NUM = CONFIG.get('worker_num', 1)
 DATA_DIR = CONFIG.get('data_dir', 'lunabot_deckrec_data')
 USERDATA_CACHE_NUM = CONFIG.get('userdata_cache_num', 10)
+USERDATA_REGISTRY_NUM = CONFIG.get('userdata_registry_num', 64)
+RESULT_MEMO_TTL = CONFIG.get('result_memo_ttl', 300)
+RESULT_MEMO_NUM = CONFIG.get('result_memo_num', 256)
+TASK_TIMEOUT = CONFIG.get('task_timeout', 60)               # 任务未指定timeout_ms时的最长执行时间（秒）
+TASK_TIMEOUT_GRACE = CONFIG.get('task_timeout_grace', 10)   # 任务指定timeout_ms时额外允许的执行时间（秒）
+MAX_QUEUE_WAIT = CONFIG.get('max_queue_wait', 120)          # 任务最长排队时间（秒）
+ALL_ALG_WAIT_RATIO = CONFIG.get('all_alg_wait_ratio', 2.0)  # 多算法组卡第一个结果返回后，最多等待到其耗时的多少倍
+ALL_ALG_MIN_WAIT = CONFIG.get('all_alg_min_wait', 1.0)      # 多算法组卡第一个结果返回后，至少再等待多少秒
+REGION_DATA_WAIT = CONFIG.get('region_data_wait', 60)       # worker首次加载区服数据未完成时组卡任务的最长等待时间（秒）
 DB_PATH = pjoin(DATA_DIR, 'deckrec.json')
@@ -1,4 +1,5 @@
 from hashlib import md5
+from collections import OrderedDict
 from fastapi import FastAPI, HTTPException, Request, Response
 import uvicorn
 from sekai_deck_recommend_cpp import (
@@ -20,6 +21,107 @@ except ImportError:
     pass
 
 
+# =========================== 缓存 =========================== #
+
+class UserdataRegistry:
+    """
+    主进程中按内容哈希保存的原始用户数据LRU，组卡时只发送给未缓存该用户数据的worker解析
+    """
+    def __init__(self, max_num: int):
+        self.max_num = max_num
+        self.data: OrderedDict[str, bytes] = OrderedDict()
+
+    def put(self, userdata_bytes: bytes) -> str:
+        userdata_hash = md5(userdata_bytes).hexdigest()
+        self.data[userdata_hash] = userdata_bytes
+        self.data.move_to_end(userdata_hash)
+        while len(self.data) > self.max_num:
+            self.data.popitem(last=False)
+        return userdata_hash
+
+    def get(self, userdata_hash: str) -> bytes | None:
+        if userdata_hash in self.data:
+            self.data.move_to_end(userdata_hash)
+            return self.data[userdata_hash]
+        return None
+
+    def contains(self, userdata_hash: str) -> bool:
+        # 只以主进程保存的原始数据为准，仅有worker缓存时任务可能被调度到其他worker而无法解析
+        return userdata_hash in self.data
+
+
+class ResultMemo:
+    """
+    相同（区服，用户数据哈希，组卡参数）的组卡结果在有效期内直接复用，执行中的相同请求共享同一个结果
+    """
+    def __init__(self, ttl: float, max_num: int):
+        self.ttl = ttl
+        self.max_num = max_num
+        self.results: OrderedDict[bytes, tuple[float, dict]] = OrderedDict()
+        self.running: dict[bytes, asyncio.Future] = {}
+        self.follower_num: dict[bytes, int] = {}
+        self.generation = 0
+        self.hit_num = 0
+
+    @staticmethod
+    def get_key(region: str, userdata_hash: str, options: dict) -> bytes:
+        return orjson.dumps([region, userdata_hash, options], option=orjson.OPT_SORT_KEYS)
+
+    def has_followers(self, key: bytes) -> bool:
+        return bool(self.follower_num.get(key))
+
+    def clear(self):
+        self.results.clear()
+        self.generation += 1
+
+    async def get_or_run(self, key: bytes, func) -> tuple[dict, bool]:
+        """
+        func返回 (结果, 结果能否缓存)，返回 (结果, 是否复用)
+        """
+        if self.ttl <= 0:
+            return (await func())[0], False
+        if key in self.results:
+            expire_time, result = self.results[key]
+            if expire_time > time.time():
+                self.results.move_to_end(key)
+                self.hit_num += 1
+                return result, True
+            self.results.pop(key)
+        if key in self.running:
+            self.hit_num += 1
+            self.follower_num[key] = self.follower_num.get(key, 0) + 1
+            try:
+                return await asyncio.shield(self.running[key]), True
+            finally:
+                self.follower_num[key] -= 1
+                if not self.follower_num[key]:
+                    self.follower_num.pop(key)
+
+        generation = self.generation
+        future = asyncio.get_event_loop().create_future()
+        self.running[key] = future
+        try:
+            result, cacheable = await func()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        finally:
+            self.running.pop(key, None)
+        future.set_result(result)
+        # 执行期间数据更新过的结果和使用旧数据得到的结果不缓存
+        if cacheable and generation == self.generation:
+            self.results[key] = (time.time() + self.ttl, result)
+            while len(self.results) > self.max_num:
+                self.results.popitem(last=False)
+        return result, False
+
+userdata_registry = UserdataRegistry(USERDATA_REGISTRY_NUM)
+result_memo = ResultMemo(RESULT_MEMO_TTL, RESULT_MEMO_NUM)
+
 
 def update_data(
     region: str, 
@@ -56,6 +158,12 @@ def update_data(
             log(f"更新 {region} MusicMetas {current_ts_text} -> {local_ts_text}")
 
     dump_json(db, DB_PATH)
+    # 数据有更新时通知worker在后台重新加载
+    latest_masterdata_version = db.get('masterdata_version', {}).get(region)
+    latest_musicmetas_update_ts = db.get('musicmetas_update_ts', {}).get(region)
+    if latest_masterdata_version != current_masterdata_version or latest_musicmetas_update_ts != current_musicmetas_update_ts:
+        result_memo.clear()
+        WorkerScheduler.notify_data_update(region, latest_masterdata_version, latest_musicmetas_update_ts)
     if missing_data:
         log(f"{region} 检测到数据更新不完整，缺少：{', '.join(missing_data)}")
         raise HTTPException(status_code=426, detail={
@@ -122,19 +230,9 @@ async def _(request: Request):
         segments = await extract_decompressed_payload(request)
         userdata_bytes = segments[0]
 
-        t = datetime.now()
-        all_result = await asyncio.gather(*[ctx.cache_userdata(userdata_bytes) for ctx in WorkerContext.workers()])
-        elapsed = (datetime.now() - t).total_seconds()
-        
-        for result in all_result:
-            if result['status'] != 'success':
-                raise HTTPException(
-                    status_code=500, 
-                    detail=result.get('message', '内部错误'),
-                )
-            
-        userdata_hash = all_result[0]['userdata_hash']
-        log(f"缓存用户数据 {userdata_hash} 成功，耗时 {elapsed:.3f} 秒")
+        # 只在主进程保存原始数据，由实际执行组卡的worker按需解析
+        userdata_hash = userdata_registry.put(userdata_bytes)
+        log(f"缓存用户数据 {userdata_hash} 成功，大小 {len(userdata_bytes) / 1024:.1f}KB")
         
         return { "userdata_hash": userdata_hash }
 
@@ -147,6 +245,19 @@ async def _(request: Request):
             detail=get_exc_desc(e),
         )
 
+@app.get("/metrics")
+async def _():
+    return WorkerScheduler.get_metrics() | {
+        'userdata_registry_num': len(userdata_registry.data),
+        'result_memo_num': len(result_memo.results),
+        'result_memo_hit': result_memo.hit_num,
+    }
+
+@app.head("/userdata/{userdata_hash}")
+async def _(userdata_hash: str):
+    # 检查用户数据是否已缓存，已缓存时客户端无需重新上传
+    return Response(status_code=200 if userdata_registry.contains(userdata_hash) else 404)
+
 @app.post("/recommend")
 async def _(request: Request):
     try:
@@ -157,10 +268,27 @@ async def _(request: Request):
         batch_options = data['batch_options']
         userdata_hash = data['userdata_hash']
 
-        async def do_recommend(options):
+        userdata_bytes = userdata_registry.get(userdata_hash)
+        if userdata_bytes is None:
+            raise HTTPException(
+                status_code=404,
+                detail="组卡服务端找不到对应的用户数据缓存",
+            )
+
+        # 数值越小越优先
+        priority = data.get('priority', 0)
+        # 同一组内是对同一组卡参数使用不同算法的结果，第一个结果返回后只在限定时间内等待其他算法
+        early_return_groups: list[list[int]] = data.get('early_return_groups', [])
+        worker_tasks: dict[int, WorkerTask] = {}
+
+        async def run_recommend(index: int, options: dict):
             start_time = datetime.now()
-            async with WorkerContext() as ctx:
-                result = await ctx.recommend(region, options, userdata_hash)
+            def on_submit(task: WorkerTask):
+                worker_tasks[index] = task
+            result = await WorkerScheduler.recommend(
+                region, options, userdata_hash, userdata_bytes, 
+                priority=priority, on_submit=on_submit,
+            )
         
             if result['status'] != 'success':
                 raise HTTPException(
@@ -170,15 +298,66 @@ async def _(request: Request):
 
             total_time = (datetime.now() - start_time).total_seconds()
             wait_time = total_time - result['cost_time']
+            # worker后台加载新数据完成前的任务仍使用旧数据，其结果不缓存
+            cacheable = tuple(result.get('data_versions') or ()) == WorkerScheduler.data_versions.get(region)
 
             return {
                 "result": result['result'],
                 "alg": options['algorithm'],
                 "cost_time": result['cost_time'],
                 "wait_time": wait_time,
-            }
-            
-        return await asyncio.gather(*[do_recommend(options) for options in batch_options])
+            }, cacheable
+
+        async def do_recommend(index: int, options: dict):
+            key = ResultMemo.get_key(region, userdata_hash, options)
+            result, memoized = await result_memo.get_or_run(key, lambda: run_recommend(index, options))
+            if memoized:
+                result = result | { "wait_time": 0.0 }
+            return result
+
+        tasks = [asyncio.create_task(do_recommend(i, options)) for i, options in enumerate(batch_options)]
+        for task in tasks:
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+        def is_success(task: asyncio.Task) -> bool:
+            return task.done() and not task.cancelled() and task.exception() is None
+
+        async def wait_group(indices: list[int]):
+            start_time = time.time()
+            pending = { tasks[i] for i in indices }
+            first_done = False
+            while pending and not first_done:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                first_done = any(is_success(t) for t in done)
+            if not first_done or not pending:
+                return
+            elapsed = time.time() - start_time
+            budget = max(elapsed * (ALL_ALG_WAIT_RATIO - 1), ALL_ALG_MIN_WAIT)
+            _, pending = await asyncio.wait(pending, timeout=budget)
+            # 超出等待时间：还在排队的任务取消，已在执行的任务继续执行（结果会进入缓存）
+            for i in indices:
+                if tasks[i] in pending and i in worker_tasks:
+                    key = ResultMemo.get_key(region, userdata_hash, batch_options[i])
+                    if not result_memo.has_followers(key):
+                        WorkerScheduler.cancel(worker_tasks[i])
+
+        grouped = { i for g in early_return_groups for i in g }
+        await asyncio.gather(
+            *[wait_group(g) for g in early_return_groups],
+            *[tasks[i] for i in range(len(tasks)) if i not in grouped],
+            return_exceptions=True,
+        )
+        # 组内未在等待时间内完成的结果为None，组内全部失败时报告错误
+        success_groups = { i for g in early_return_groups if any(is_success(tasks[j]) for j in g) for i in g }
+        results = []
+        for i, task in enumerate(tasks):
+            if is_success(task):
+                results.append(task.result())
+            elif i in success_groups:
+                results.append(None)
+            else:
+                raise task.exception() if not task.cancelled() else RuntimeError("组卡任务被取消")
+        return results
 
     except Exception as e:
         if isinstance(e, HTTPException):
@@ -191,7 +370,7 @@ async def _(request: Request):
 
 
 if __name__ == "__main__":
-    WorkerContext.init_workers(WORKER_NUM)
+    WorkerScheduler.init_workers(WORKER_NUM)
     log(f"组卡服务初始化 worker_num={WORKER_NUM} data_dir={DATA_DIR}")
 
     uvicorn.run(
@@ -10,10 +10,21 @@ from sekai_deck_recommend_cpp import (
     DeckRecommendUserData,
 )
 from hashlib import md5
+from collections import OrderedDict, deque
+import bisect
+import queue
 import multiprocessing as mp
 from multiprocessing import Queue, Process
 from concurrent.futures import ThreadPoolExecutor
 import setproctitle
+import threading
+
+
+@dataclass
+class RegionData:
+    recommender: SekaiDeckRecommend
+    masterdata_version: str
+    musicmetas_update_ts: int
 
 
 class Worker:
@@ -32,10 +43,11 @@ class Worker:
     def init(self):
         if self.inited:
             return
-        self.recommender = SekaiDeckRecommend()
-        self.masterdata_version: dict[str, str] = {}
-        self.musicmetas_update_ts: dict[str, int] = {}
-        self.userdata_cache: list[tuple[str, DeckRecommendUserData]] = []
+        # 各区服加载完成的数据，更新时在后台构建新的组卡器后整体替换
+        self.region_data: dict[str, RegionData] = {}
+        self.loading_regions: set[str] = set()
+        self.region_data_cond = threading.Condition()
+        self.userdata_cache: OrderedDict[str, DeckRecommendUserData] = OrderedDict()
         self.inited = True
 
     def _deckrec_options_to_str(self, userdata_hash: str, options: DeckRecommendOptions) -> str:
@@ -68,43 +80,76 @@ class Worker:
         log += f"fixed_cards={options.fixed_cards})"
         return log
 
-    def _update_data(self, region: str):
-        db = load_json(DB_PATH, default={})
+    def mark_loading(self, regions: list[str]):
+        with self.region_data_cond:
+            self.loading_regions.update(regions)
+
+    def update_data(self, region: str, masterdata_version: str | None, musicmetas_update_ts: int | None):
+        """
+        在后台线程中加载区服数据到新的组卡器，完成后替换，加载期间组卡任务继续使用旧数据
+        """
+        self.init()
+        self.mark_loading([region])
+        try:
+            current = self.region_data.get(region)
+            if current and current.masterdata_version == masterdata_version \
+                and current.musicmetas_update_ts == musicmetas_update_ts:
+                return
+            if not masterdata_version or not musicmetas_update_ts:
+                return
+            start_time = datetime.now()
+            recommender = SekaiDeckRecommend()
+            recommender.update_masterdata(pjoin(DATA_DIR, 'masterdata', region), region)
+            recommender.update_musicmetas(pjoin(DATA_DIR, f'musicmetas_{region}.json'), region)
+            with self.region_data_cond:
+                self.region_data[region] = RegionData(recommender, masterdata_version, musicmetas_update_ts)
+            mm_time_text = datetime.fromtimestamp(musicmetas_update_ts).strftime('%Y-%m-%d %H:%M:%S')
+            elapsed = (datetime.now() - start_time).total_seconds()
+            self.log(f"加载 {region} MasterData: v{masterdata_version} MusicMetas: {mm_time_text}，耗时 {elapsed:.1f} 秒")
+        except BaseException as e:
+            self.error(f"加载 {region} 数据失败:", get_exc_desc(e))
+        finally:
+            with self.region_data_cond:
+                self.loading_regions.discard(region)
+                self.region_data_cond.notify_all()
 
-        masterdata_version = db.get('masterdata_version', {}).get(region)
-        if self.masterdata_version.get(region) != masterdata_version:
-            local_md_dir = pjoin(DATA_DIR, 'masterdata', region)
-            self.recommender.update_masterdata(local_md_dir, region)
-            self.masterdata_version[region] = masterdata_version
-            self.log(f"加载 {region} MasterData: v{masterdata_version}")
+    def _get_region_data(self, region: str) -> RegionData | None:
+        data = self.region_data.get(region)
+        if data is None:
+            # 首次加载还未完成时等待
+            with self.region_data_cond:
+                self.region_data_cond.wait_for(
+                    lambda: region in self.region_data or region not in self.loading_regions, 
+                    timeout=REGION_DATA_WAIT,
+                )
+                data = self.region_data.get(region)
+        return data
 
-        musicmetas_update_ts = db.get('musicmetas_update_ts', {}).get(region)
-        if self.musicmetas_update_ts.get(region) != musicmetas_update_ts:
-            local_mm_path = pjoin(DATA_DIR, f'musicmetas_{region}.json')
-            self.recommender.update_musicmetas(local_mm_path, region)
-            self.musicmetas_update_ts[region] = musicmetas_update_ts
-            self.log(f"加载 {region} MusicMetas: {datetime.fromtimestamp(musicmetas_update_ts).strftime('%Y-%m-%d %H:%M:%S')}")
+    def _get_userdata(self, userdata_hash: str, userdata_bytes: bytes | None = None) -> DeckRecommendUserData | None:
+        """
+        从LRU缓存获取解析后的用户数据，未缓存且提供了原始数据时解析并加入缓存
+        """
+        if userdata_hash in self.userdata_cache:
+            self.userdata_cache.move_to_end(userdata_hash)
+            return self.userdata_cache[userdata_hash]
+        if userdata_bytes is None:
+            return None
+        userdata = DeckRecommendUserData()
+        userdata.load_from_bytes(userdata_bytes)
+        self.userdata_cache[userdata_hash] = userdata
+        while len(self.userdata_cache) > USERDATA_CACHE_NUM:
+            self.userdata_cache.popitem(last=False)
+        return userdata
 
     def cache_userdata(self, userdata_bytes: bytes) -> dict:
         self.init()
         try:
             hash = md5(userdata_bytes).hexdigest()
-            for h, _ in self.userdata_cache:
-                if h == hash:
-                    return {
-                        'status': 'success',
-                        'userdata_hash': hash,
-                    }
-            userdata = DeckRecommendUserData()
-            userdata.load_from_bytes(userdata_bytes)
-            self.userdata_cache.append((hash, userdata))
-            # self.log(f"缓存用户数据: hash={hash}")
-            while len(self.userdata_cache) > USERDATA_CACHE_NUM:
-                h, _ = self.userdata_cache.pop(0)
-                # self.log(f"移除用户数据缓存: hash={h}")
+            self._get_userdata(hash, userdata_bytes)
             return {
                 'status': 'success',
                 'userdata_hash': hash,
+                'userdata_hashes': list(self.userdata_cache),
             }
         except BaseException as e:
             self.error("缓存用户数据失败:", get_exc_desc(e))
@@ -113,37 +158,69 @@ class Worker:
                 'message': get_exc_desc(e),
             }
     
-    def recommend(self, region: str, options: dict, userdata_hash: str) -> dict:
+    def _prepare_recommend(
+        self, region: str, options: dict, userdata_hash: str, userdata_bytes: bytes | None,
+    ) -> tuple[RegionData, DeckRecommendOptions] | dict:
+        """
+        获取组卡所需的区服数据和用户数据，失败时返回错误结果
+        """
+        region_data = self._get_region_data(region)
+        if region_data is None:
+            return {
+                'status': 'error',
+                'message': '组卡服务端数据未初始化完成，请稍后再试'
+            }
+        
+        user_data = self._get_userdata(userdata_hash, userdata_bytes)
+        if user_data is None:
+            return {
+                'status': 'error',
+                'message': '组卡服务端找不到对应的用户数据缓存',
+                'userdata_hashes': list(self.userdata_cache),
+            }
+
+        options = DeckRecommendOptions.from_dict(options)
+        options.user_data = user_data
+        return region_data, options
+
+    def noop_recommend(self, region: str, options: dict, userdata_hash: str, userdata_bytes: bytes | None = None) -> dict:
+        """
+        只执行组卡前的准备而不组卡，用于测试每个任务的额外开销
+        """
+        self.init()
+        try:
+            prepared = self._prepare_recommend(region, options, userdata_hash, userdata_bytes)
+            if isinstance(prepared, dict):
+                return prepared
+            return {
+                'status': 'success',
+                'result': {},
+                'cost_time': 0.0,
+                'userdata_hashes': list(self.userdata_cache),
+            }
+        except BaseException as e:
+            return {
+                'status': 'error',
+                'message': get_exc_desc(e),
+            }
+
+    def recommend(self, region: str, options: dict, userdata_hash: str, userdata_bytes: bytes | None = None) -> dict:
+        """
+        userdata_bytes: 该worker未缓存对应用户数据时由主进程附带的原始用户数据
+        """
         self.init()
         seq = self.deckrec_seq_top
         self.deckrec_seq_top += self.worker_num
         
         try:
-            self._update_data(region)
-
-            if not self.masterdata_version.get(region) or not self.musicmetas_update_ts.get(region):
-                return {
-                    'status': 'error',
-                    'message': '组卡服务端数据未初始化完成，请稍后再试'
-                }
-            
-            user_data = None
-            for h, data in self.userdata_cache:
-                if h == userdata_hash:
-                    user_data = data
-                    break
-            if user_data is None:
-                return {
-                    'status': 'error',
-                    'message': '组卡服务端找不到对应的用户数据缓存'
-                }
-
-            options = DeckRecommendOptions.from_dict(options)
-            options.user_data = user_data
+            prepared = self._prepare_recommend(region, options, userdata_hash, userdata_bytes)
+            if isinstance(prepared, dict):
+                return prepared
+            region_data, options = prepared
             self.log(f"组卡任务#{seq}: {self._deckrec_options_to_str(userdata_hash, options)}")
 
             start_time = datetime.now()
-            res = self.recommender.recommend(options)
+            res = region_data.recommender.recommend(options)
             cost_time = datetime.now() - start_time
 
             self.log(f"组卡任务#{seq}完成，耗时 {cost_time.total_seconds():.3f} 秒")
@@ -152,6 +229,9 @@ class Worker:
                 'status': 'success',
                 'result': res.to_dict(),
                 'cost_time': cost_time.total_seconds(),
+                'userdata_hashes': list(self.userdata_cache),
+                # 实际使用的数据版本，主进程据此判断结果能否缓存
+                'data_versions': (region_data.masterdata_version, region_data.musicmetas_update_ts),
             }
         except BaseException as e:
             self.error(f"组卡任务#{seq}失败:", get_exc_desc(e))
@@ -161,17 +241,76 @@ class Worker:
             }
 
 
-class WorkerContext:
+@dataclass(eq=False)
+class WorkerTask:
+    priority: int
+    seq: int
+    method_name: str
+    args: tuple
+    timeout: float                      # 开始执行后的最长执行时间，超时终止并重启worker
+    future: asyncio.Future
+    userdata_hash: str | None = None
+    userdata_bytes: bytes | None = None  # 分配到未缓存该用户数据的worker时附带发送
+    submit_time: float = field(default_factory=time.time)
+    start_time: float | None = None
+    worker_id: int | None = None
+
+    def sort_key(self) -> tuple[int, int]:
+        return (self.priority, self.seq)
+
+
+class WorkerCrashedError(Exception):
+    pass
+
+
+class WorkerScheduler:
+    """
+    组卡worker调度：所有任务进入共享的优先级队列（priority小的优先，同优先级先进先出），
+    空闲worker取队首任务执行，优先分配给已缓存对应用户数据的worker，
+    任务执行超过期限或worker进程异常退出时终止并重启该worker
+    """
     all_workers: dict[int, Worker] = {}
     all_processes: dict[int, Process] = {}
-    available_workers: asyncio.Queue[Worker] = {}
     task_queues: dict[int, Queue] = {}
     result_queues: dict[int, Queue] = {}
+    control_queues: dict[int, Queue] = {}
     thread_pool: ThreadPoolExecutor = None
+    worker_num: int = 0
+    data_versions: dict[str, tuple[str, int]] = {}  # 各区服当前的 (masterdata_version, musicmetas_update_ts)
+
+    pending: list[WorkerTask] = []
+    idle_workers: list[int] = []
+    running: dict[int, WorkerTask] = {}
+    worker_userdata: dict[int, set[str]] = {}   # 各worker已缓存的用户数据哈希，用于按用户数据亲和分配worker
+    cond: asyncio.Condition = None
+    dispatch_task: asyncio.Task = None
+    seq: int = 0
+
+    metrics: dict[str, int] = {}
+    wait_times: deque[float] = deque(maxlen=1000)
+    run_times: deque[float] = deque(maxlen=1000)
 
     @staticmethod
-    def worker_loop(worker: Worker, task_queue: Queue, result_queue: Queue):
+    def control_loop(worker: Worker, control_queue: Queue):
+        while True:
+            region, masterdata_version, musicmetas_update_ts = control_queue.get()
+            worker.update_data(region, masterdata_version, musicmetas_update_ts)
+
+    @staticmethod
+    def worker_loop(
+        worker: Worker, 
+        task_queue: Queue, 
+        result_queue: Queue, 
+        control_queue: Queue, 
+        data_versions: dict[str, tuple[str, int]],
+    ):
         setproctitle.setproctitle(f'lunabot-deckrec-worker-{worker.worker_id}')
+        worker.init()
+        # 启动时的数据和之后的数据更新通知都在后台线程加载，组卡任务只在首次加载未完成时等待
+        worker.mark_loading(list(data_versions))
+        for region, (masterdata_version, musicmetas_update_ts) in data_versions.items():
+            control_queue.put((region, masterdata_version, musicmetas_update_ts))
+        threading.Thread(target=WorkerScheduler.control_loop, args=(worker, control_queue), daemon=True).start()
         worker.log("Worker已启动")
         while True:
             task: tuple[str, tuple, dict] = task_queue.get()
@@ -187,70 +326,259 @@ class WorkerContext:
                     'message': get_exc_desc(e),
                 })
 
+    @classmethod
+    def _spawn_worker(cls, worker_id: int):
+        mp_ctx = mp.get_context('spawn')
+        worker = Worker(worker_id, cls.worker_num)
+        cls.all_workers[worker_id] = worker
+        cls.task_queues[worker_id] = mp_ctx.Queue()
+        cls.result_queues[worker_id] = mp_ctx.Queue()
+        cls.control_queues[worker_id] = mp_ctx.Queue()
+        p = mp_ctx.Process(
+            target=cls.worker_loop, 
+            args=(
+                worker, cls.task_queues[worker_id], cls.result_queues[worker_id], 
+                cls.control_queues[worker_id], dict(cls.data_versions),
+            ),
+        )
+        p.start()
+        cls.all_processes[worker_id] = p
+        cls.worker_userdata[worker_id] = set()
+
+    @classmethod
+    def _kill_and_respawn_worker(cls, worker_id: int):
+        p = cls.all_processes[worker_id]
+        if p.is_alive():
+            p.kill()
+        p.join(timeout=10)
+        cls._spawn_worker(worker_id)
+
     @classmethod
     def init_workers(cls, worker_num: int):
         if mp.current_process().name == 'MainProcess':
             setproctitle.setproctitle('lunabot-deckrec-main')
+        cls.worker_num = worker_num
         cls.all_workers = {}
-        mp_ctx = mp.get_context('spawn')
+        db = load_json(DB_PATH, default={})
+        cls.data_versions = {
+            region: (masterdata_version, db.get('musicmetas_update_ts', {}).get(region))
+            for region, masterdata_version in db.get('masterdata_version', {}).items()
+        }
         for i in range(worker_num):
-            worker = Worker(i, worker_num)
-            cls.all_workers[i] = worker
-            cls.task_queues[i] = mp_ctx.Queue()
-            cls.result_queues[i] = mp_ctx.Queue()
-            p = mp_ctx.Process(
-                target=cls.worker_loop, 
-                args=(worker, cls.task_queues[i], cls.result_queues[i]),
-            )
-            p.start()
-            cls.all_processes[i] = p
-            
-        cls.available_workers = asyncio.Queue()
-        for w in cls.all_workers.values():
-            cls.available_workers.put_nowait(w)
-        cls.thread_pool = ThreadPoolExecutor(max_workers=worker_num)
-        
-    def __init__(self, task_timeout: float = 60) -> None:
-        self.worker: Worker | None = None
-        self.task_timeout = task_timeout
-
-    async def __aenter__(self):
-        if not self.available_workers:
-            raise RuntimeError("Please call WorkerContext.init_workers() first")
-        self.worker = await self.available_workers.get()
-        return self
-    
-    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
-        self.available_workers.put_nowait(self.worker)
+            cls._spawn_worker(i)
+        cls.pending = []
+        cls.idle_workers = list(cls.all_workers)
+        cls.running = {}
+        cls.cond = asyncio.Condition()
+        cls.metrics = {
+            'submitted': 0, 'finished': 0, 'failed': 0, 'cancelled': 0, 'queue_expired': 0,
+            'timeout_killed': 0, 'crashed': 0, 'affinity_hit': 0,
+        }
+        # 每个worker一个等待结果的线程，额外的线程用于重启worker
+        cls.thread_pool = ThreadPoolExecutor(max_workers=worker_num * 2)
+
+    @classmethod
+    def notify_data_update(cls, region: str, masterdata_version: str | None, musicmetas_update_ts: int | None):
+        """
+        通知所有worker区服数据已更新，worker在后台重新加载后切换
+        """
+        versions = (masterdata_version, musicmetas_update_ts)
+        if cls.data_versions.get(region) == versions:
+            return
+        cls.data_versions[region] = versions
+        for control_queue in cls.control_queues.values():
+            control_queue.put((region, masterdata_version, musicmetas_update_ts))
+
+    # ---------------- 提交和取消 ---------------- #
+
+    @classmethod
+    async def submit(
+        cls, 
+        method_name: str, 
+        args: tuple, 
+        priority: int = 0, 
+        timeout: float = TASK_TIMEOUT, 
+        userdata_hash: str | None = None, 
+        userdata_bytes: bytes | None = None,
+    ) -> WorkerTask:
+        if cls.cond is None:
+            raise RuntimeError("Please call WorkerScheduler.init_workers() first")
+        if cls.dispatch_task is None or cls.dispatch_task.done():
+            cls.dispatch_task = asyncio.create_task(cls._dispatch_loop())
+        cls.seq += 1
+        task = WorkerTask(
+            priority=priority,
+            seq=cls.seq,
+            method_name=method_name,
+            args=args,
+            timeout=timeout,
+            future=asyncio.get_event_loop().create_future(),
+            userdata_hash=userdata_hash,
+            userdata_bytes=userdata_bytes,
+        )
+        async with cls.cond:
+            bisect.insort(cls.pending, task, key=WorkerTask.sort_key)
+            cls.metrics['submitted'] += 1
+            cls.cond.notify()
+        return task
+
+    @classmethod
+    def cancel(cls, task: WorkerTask) -> bool:
+        """
+        取消还在排队的任务，已开始执行的任务不取消，返回是否取消成功
+        """
+        if task.start_time is not None or task not in cls.pending:
+            return False
+        cls.pending.remove(task)
+        cls.metrics['cancelled'] += 1
+        task.future.cancel()
+        return True
+
+    @classmethod
+    async def recommend(
+        cls, 
+        region: str, 
+        options: dict, 
+        userdata_hash: str, 
+        userdata_bytes: bytes | None, 
+        priority: int = 0,
+        on_submit = None,
+    ) -> dict:
+        """
+        提交组卡任务并等待结果，on_submit: 提交后以WorkerTask调用的回调（用于之后取消）
+        """
+        timeout = TASK_TIMEOUT
+        if options.get('timeout_ms'):
+            timeout = options['timeout_ms'] / 1000 + TASK_TIMEOUT_GRACE
+        task = await cls.submit(
+            'recommend', (region, options, userdata_hash), 
+            priority=priority, timeout=timeout,
+            userdata_hash=userdata_hash, userdata_bytes=userdata_bytes,
+        )
+        if on_submit:
+            on_submit(task)
+        return await task.future
+
+    # ---------------- 调度和执行 ---------------- #
+
+    @classmethod
+    def _expire_pending(cls):
+        now = time.time()
+        for task in [t for t in cls.pending if now - t.submit_time > MAX_QUEUE_WAIT]:
+            cls.pending.remove(task)
+            cls.metrics['queue_expired'] += 1
+            if not task.future.done():
+                task.future.set_result({
+                    'status': 'error',
+                    'message': f'组卡服务繁忙，排队超过{MAX_QUEUE_WAIT}秒',
+                })
 
     @classmethod
-    def workers(cls):
-        for w in cls.all_workers.values():
-            ctx = WorkerContext()
-            ctx.worker = w
-            yield ctx
+    async def _dispatch_loop(cls):
+        while True:
+            async with cls.cond:
+                await cls.cond.wait_for(lambda: cls.pending and cls.idle_workers)
+                cls._expire_pending()
+                if not cls.pending:
+                    continue
+                task = cls.pending.pop(0)
+                worker_id = cls.idle_workers[0]
+                if task.userdata_hash:
+                    for i in cls.idle_workers:
+                        if task.userdata_hash in cls.worker_userdata.get(i, ()):
+                            worker_id = i
+                            cls.metrics['affinity_hit'] += 1
+                            break
+                cls.idle_workers.remove(worker_id)
+                task.worker_id = worker_id
+                task.start_time = time.time()
+                cls.running[worker_id] = task
+            asyncio.create_task(cls._run_task(worker_id, task))
 
-    async def _get_result(self):
+    @classmethod
+    def _wait_result(cls, process: Process, result_queue: Queue, timeout: float) -> dict:
+        end_time = time.time() + timeout
+        while True:
+            try:
+                return result_queue.get(timeout=max(0.01, min(1.0, end_time - time.time())))
+            except queue.Empty:
+                if not process.is_alive():
+                    raise WorkerCrashedError()
+                if time.time() >= end_time:
+                    raise TimeoutError()
+
+    @classmethod
+    async def _execute(cls, worker_id: int, task: WorkerTask, send_userdata: bool) -> dict:
+        args = task.args
+        if task.userdata_hash:
+            args = args + (task.userdata_bytes if send_userdata else None,)
+        cls.task_queues[worker_id].put((task.method_name, args, {},))
+        result = await asyncio.get_event_loop().run_in_executor(
+            cls.thread_pool, cls._wait_result,
+            cls.all_processes[worker_id], cls.result_queues[worker_id], 
+            task.timeout - (time.time() - task.start_time),
+        )
+        if 'userdata_hashes' in result:
+            cls.worker_userdata[worker_id] = set(result['userdata_hashes'])
+        return result
+
+    @classmethod
+    async def _run_task(cls, worker_id: int, task: WorkerTask):
+        cls.wait_times.append(task.start_time - task.submit_time)
         try:
-            return await asyncio.wait_for(
-                asyncio.get_event_loop().run_in_executor(
-                    self.thread_pool, 
-                    self.result_queues[self.worker.worker_id].get,
-                ),
-                timeout=self.task_timeout,
-            )
-        except asyncio.TimeoutError:
-            self.task_queues[self.worker.worker_id] = mp.get_context('spawn').Queue()
-            self.result_queues[self.worker.worker_id] = mp.get_context('spawn').Queue()
-            raise RuntimeError("Worker任务超时，队列已重置")
-
-    async def cache_userdata(self, userdata_bytes: bytes) -> dict:
-        self.task_queues[self.worker.worker_id].put(('cache_userdata', (userdata_bytes,), {},))
-        return await self._get_result()
-    
-    async def recommend(self, region: str, options: dict, userdata_hash: str) -> dict:
-        self.task_queues[self.worker.worker_id].put(('recommend', (region, options, userdata_hash,), {},))
-        return await self._get_result()
+            send_userdata = task.userdata_hash not in cls.worker_userdata.get(worker_id, ())
+            result = await cls._execute(worker_id, task, send_userdata)
+            # 记录的缓存状态过期时附带原始数据重试一次
+            if result['status'] != 'success' and not send_userdata and task.userdata_bytes is not None \
+                and task.userdata_hash not in cls.worker_userdata.get(worker_id, ()):
+                result = await cls._execute(worker_id, task, True)
+        except (TimeoutError, WorkerCrashedError) as e:
+            if isinstance(e, TimeoutError):
+                cls.metrics['timeout_killed'] += 1
+                message = f'组卡任务超过{task.timeout:.1f}秒未完成，已终止'
+            else:
+                cls.metrics['crashed'] += 1
+                message = '组卡worker进程异常退出'
+            error(f"[worker-{worker_id}] {message}，重启worker", print_trace=False)
+            try:
+                await asyncio.get_event_loop().run_in_executor(cls.thread_pool, cls._kill_and_respawn_worker, worker_id)
+            except Exception as e:
+                error(f"[worker-{worker_id}] 重启worker失败:", get_exc_desc(e))
+            result = { 'status': 'error', 'message': message }
+        except Exception as e:
+            result = { 'status': 'error', 'message': get_exc_desc(e) }
 
+        cls.run_times.append(time.time() - task.start_time)
+        cls.metrics['finished' if result['status'] == 'success' else 'failed'] += 1
+        async with cls.cond:
+            cls.running.pop(worker_id, None)
+            cls.idle_workers.append(worker_id)
+            cls.cond.notify_all()
+        if not task.future.done():
+            task.future.set_result(result)
 
+    # ---------------- 统计 ---------------- #
 
+    @classmethod
+    def get_metrics(cls) -> dict:
+        def percentile(ts: list[float], p: float) -> float:
+            if not ts:
+                return 0.0
+            ts = sorted(ts)
+            return ts[min(len(ts) - 1, int(len(ts) * p))]
+        now = time.time()
+        queue_depth = {}
+        for task in cls.pending:
+            queue_depth[task.priority] = queue_depth.get(task.priority, 0) + 1
+        wait_times, run_times = list(cls.wait_times), list(cls.run_times)
+        return cls.metrics | {
+            'queue_depth': len(cls.pending),
+            'queue_depth_by_priority': queue_depth,
+            'oldest_wait': max((now - t.submit_time for t in cls.pending), default=0.0),
+            'running': { i: round(now - t.start_time, 3) for i, t in cls.running.items() },
+            'idle_workers': len(cls.idle_workers),
+            'wait_time_p50': percentile(wait_times, 0.5),
+            'wait_time_p99': percentile(wait_times, 0.99),
+            'run_time_p50': percentile(run_times, 0.5),
+            'run_time_p99': percentile(run_times, 0.99),
+        }